@@ -50,7 +50,7 @@ class CitaMedicaAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Información de la Cita', {
-            'fields': ('paciente', 'fecha_hora', 'estado', 'comentarios')
+            'fields': ('paciente', 'fecha_hora', 'duracion_minutos', 'estado', 'comentarios')
         }),
         ('Asignaciones', {
             'fields': ('doctor_asignado', 'usuario_creacion', 'sucursal')
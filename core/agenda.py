@@ -0,0 +1,334 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.models import Sucursal
+from .eventos import publicar_evento
+from .models import CitaMedica
+from .reportes import invalidar_reportes_rango
+
+Usuario = get_user_model()
+
+# Resolución de los intervalos al restarlos como enteros
+MICROSEGUNDO = timedelta(microseconds=1)
+
+# Estados que no ocupan lugar en la agenda
+ESTADOS_SIN_OCUPACION = ['cancelada']
+
+HORARIO_ATENCION_DEFECTO = {
+    'hora_inicio': '09:00',
+    'hora_fin': '18:00',
+    'dias': [0, 1, 2, 3, 4, 5],
+}
+
+
+class ConflictoAgenda(Exception):
+    """El horario solicitado se cruza con otra cita del doctor o excede la capacidad de la sucursal"""
+
+    cruces = ()
+
+
+def citas_que_ocupan(queryset=None):
+    """Citas activas que ocupan un horario en la agenda"""
+    queryset = CitaMedica.objects.all() if queryset is None else queryset
+    return queryset.filter(activo=True).exclude(estado__in=ESTADOS_SIN_OCUPACION)
+
+
+def citas_superpuestas(inicio, duracion_minutos, excluir_id=None, **filtros):
+    """
+    Retorna las citas que se cruzan con [inicio, inicio + duración).
+
+    La consulta es un rango acotado sobre el índice (doctor_asignado, fecha_hora) o
+    (sucursal, fecha_hora): solo se leen las citas que empiezan entre
+    inicio - DURACION_MAXIMA_MINUTOS y el fin del intervalo, no todo el historial.
+    """
+    fin = inicio + timedelta(minutes=duracion_minutos)
+    candidatas = citas_que_ocupan().filter(
+        fecha_hora__lt=fin,
+        fecha_hora__gt=inicio - timedelta(minutes=CitaMedica.DURACION_MAXIMA_MINUTOS),
+        **filtros
+    ).only('id', 'fecha_hora', 'duracion_minutos')
+    if excluir_id:
+        candidatas = candidatas.exclude(pk=excluir_id)
+    return [
+        cita for cita in candidatas
+        if cita.fecha_hora + timedelta(minutes=cita.duracion_minutos) > inicio
+    ]
+
+
+def bloquear_agenda(doctor=None, sucursal=None):
+    """
+    Bloquea (SELECT ... FOR UPDATE) la fila del doctor y, si aplica, la de la sucursal.
+
+    Serializa las reservas concurrentes sobre la misma agenda; debe llamarse dentro de
+    transaction.atomic() y antes de verificar_disponibilidad.
+    """
+    if doctor is not None:
+        list(Usuario.objects.select_for_update().filter(pk=doctor.pk).values_list('pk', flat=True))
+    if sucursal is not None and capacidad_sucursal():
+        list(Sucursal.objects.select_for_update().filter(pk=sucursal.pk).values_list('pk', flat=True))
+
+
+def capacidad_sucursal():
+    """Cantidad máxima de citas simultáneas por sucursal (None = sin límite)"""
+    return getattr(settings, 'CITAS_SIMULTANEAS_POR_SUCURSAL', None)
+
+
+def verificar_disponibilidad(inicio, duracion_minutos, doctor=None, sucursal=None, excluir_id=None):
+    """Lanza ConflictoAgenda si el doctor está ocupado o la sucursal no tiene lugar en ese horario"""
+    if doctor is not None:
+        conflictos = citas_superpuestas(
+            inicio, duracion_minutos, excluir_id=excluir_id, doctor_asignado=doctor
+        )
+        if conflictos:
+            raise ConflictoAgenda(
+                f"Error: El doctor ya tiene una cita a las "
+                f"{conflictos[0].fecha_hora.strftime('%d/%m/%Y %H:%M')} que se cruza con este horario"
+            )
+
+    capacidad = capacidad_sucursal()
+    if sucursal is not None and capacidad:
+        conflictos = citas_superpuestas(
+            inicio, duracion_minutos, excluir_id=excluir_id, sucursal=sucursal
+        )
+        if len(conflictos) >= capacidad:
+            raise ConflictoAgenda("Error: La sucursal no tiene lugar disponible en este horario")
+
+
+def horario_atencion():
+    """Horario de atención configurado (settings.HORARIO_ATENCION) con valores por defecto"""
+    horario = dict(HORARIO_ATENCION_DEFECTO)
+    horario.update(getattr(settings, 'HORARIO_ATENCION', {}) or {})
+    return horario
+
+
+def ventanas_laborales(fecha_desde, fecha_hasta, hora_inicio, hora_fin, dias):
+    """Intervalos [inicio, fin) de atención de cada día laboral del rango, en la zona horaria local"""
+    ventanas = []
+    fecha = fecha_desde
+    while fecha <= fecha_hasta:
+        if fecha.weekday() in dias:
+            ventanas.append((
+                timezone.make_aware(datetime.combine(fecha, hora_inicio)),
+                timezone.make_aware(datetime.combine(fecha, hora_fin)),
+            ))
+        fecha += timedelta(days=1)
+    return ventanas
+
+
+def _a_microsegundos(instantes, base):
+    return np.array([(instante - base) // MICROSEGUNDO for instante in instantes], dtype=np.int64)
+
+
+def restar_intervalos(ventanas, ocupados):
+    """
+    Resta los intervalos ocupados de las ventanas de atención con operaciones vectorizadas.
+
+    Ambas listas deben venir ordenadas por inicio. Las citas que se enciman se funden
+    con un máximo acumulado de sus fines; los huecos entre ellas se cruzan con las
+    ventanas con searchsorted, sin comparar cada ventana contra todas las citas.
+    """
+    if not ventanas:
+        return []
+    if not ocupados:
+        return list(ventanas)
+
+    base = ventanas[0][0]
+    inicio_ventanas = _a_microsegundos([inicio for inicio, _ in ventanas], base)
+    fin_ventanas = _a_microsegundos([fin for _, fin in ventanas], base)
+    inicio_ocupados = _a_microsegundos([inicio for inicio, _ in ocupados], base)
+    fin_ocupados = np.maximum.accumulate(_a_microsegundos([fin for _, fin in ocupados], base))
+
+    # Un bloque ocupado nuevo empieza donde una cita inicia después de todo lo anterior
+    nuevos = np.concatenate(([True], inicio_ocupados[1:] > fin_ocupados[:-1]))
+    ultimos = np.concatenate((nuevos[1:], [True]))
+    extremo = np.iinfo(np.int64)
+    inicio_huecos = np.concatenate(([extremo.min], fin_ocupados[ultimos]))
+    fin_huecos = np.concatenate((inicio_ocupados[nuevos], [extremo.max]))
+
+    # Huecos que se cruzan con cada ventana: terminan después de su inicio y empiezan antes de su fin
+    primero = np.searchsorted(fin_huecos, inicio_ventanas, side='right')
+    cantidad = np.maximum(np.searchsorted(inicio_huecos, fin_ventanas, side='left') - primero, 0)
+    ventana = np.repeat(np.arange(len(ventanas)), cantidad)
+    hueco = np.repeat(primero - np.cumsum(cantidad) + cantidad, cantidad) + np.arange(cantidad.sum())
+
+    inicios = np.maximum(inicio_ventanas[ventana], inicio_huecos[hueco])
+    fines = np.minimum(fin_ventanas[ventana], fin_huecos[hueco])
+    validos = inicios < fines
+    return [
+        (base + timedelta(microseconds=int(inicio)), base + timedelta(microseconds=int(fin)))
+        for inicio, fin in zip(inicios[validos], fines[validos])
+    ]
+
+
+def dividir_en_horarios(libres, duracion_minutos, desde=None):
+    """Divide los intervalos libres en horarios consecutivos de la duración solicitada"""
+    duracion = timedelta(minutes=duracion_minutos)
+    horarios = []
+    for inicio, fin in libres:
+        if desde and inicio < desde:
+            # No ofrecer horarios en el pasado; redondear al siguiente múltiplo de la duración
+            saltos = -(-(desde - inicio) // duracion)
+            inicio = inicio + saltos * duracion
+        while inicio + duracion <= fin:
+            horarios.append((inicio, inicio + duracion))
+            inicio += duracion
+    return horarios
+
+
+def horarios_disponibles(doctores, fecha_desde, fecha_hasta, duracion_minutos,
+                         hora_inicio=None, hora_fin=None):
+    """
+    Calcula los horarios libres de cada doctor en el rango de fechas.
+
+    Se hace una sola consulta por el índice (doctor_asignado, fecha_hora) con las citas
+    del rango ordenadas por doctor y fecha, y se recorre una sola vez.
+    Retorna {doctor_id: [(inicio, fin), ...]}.
+    """
+    horario = horario_atencion()
+    hora_inicio = hora_inicio or time.fromisoformat(horario['hora_inicio'])
+    hora_fin = hora_fin or time.fromisoformat(horario['hora_fin'])
+    ventanas = ventanas_laborales(fecha_desde, fecha_hasta, hora_inicio, hora_fin, horario['dias'])
+
+    ocupados = {doctor.pk: [] for doctor in doctores}
+    if ventanas and ocupados:
+        citas = citas_que_ocupan().filter(
+            doctor_asignado__in=list(ocupados),
+            fecha_hora__lt=ventanas[-1][1],
+            fecha_hora__gt=ventanas[0][0] - timedelta(minutes=CitaMedica.DURACION_MAXIMA_MINUTOS),
+        ).order_by('doctor_asignado', 'fecha_hora').values_list(
+            'doctor_asignado_id', 'fecha_hora', 'duracion_minutos'
+        )
+        for doctor_id, fecha_hora, duracion in citas:
+            ocupados[doctor_id].append((fecha_hora, fecha_hora + timedelta(minutes=duracion)))
+
+    ahora = timezone.now()
+    return {
+        doctor_id: dividir_en_horarios(restar_intervalos(ventanas, intervalos), duracion_minutos, desde=ahora)
+        for doctor_id, intervalos in ocupados.items()
+    }
+
+
+# Estados de las citas que se mueven al reprogramar una agenda en bloque
+ESTADOS_REPROGRAMABLES = ['creada', 'confirmada', 'reagendada']
+
+
+def _cruces_con_movidas(movidas, existentes):
+    """
+    Pares (id movida, id existente) que se cruzan, en una sola pasada ordenada.
+
+    Cada elemento es (inicio, fin, id). Se recorre la unión ordenada por inicio
+    recordando el intervalo de cada grupo que termina más tarde.
+    """
+    eventos = sorted(
+        [(inicio, fin, pk, True) for inicio, fin, pk in movidas]
+        + [(inicio, fin, pk, False) for inicio, fin, pk in existentes]
+    )
+    cruces = []
+    ultimo = {True: None, False: None}
+    for inicio, fin, pk, movida in eventos:
+        otro = ultimo[not movida]
+        if otro and otro[0] > inicio:
+            cruces.append((pk, otro[1]) if movida else (otro[1], pk))
+        if ultimo[movida] is None or fin > ultimo[movida][0]:
+            ultimo[movida] = (fin, pk)
+    return cruces
+
+
+def _excede_capacidad(intervalos, capacidad):
+    """Indica si en algún instante hay más de `capacidad` intervalos simultáneos"""
+    eventos = sorted(
+        [(inicio, 1) for inicio, _ in intervalos] + [(fin, -1) for _, fin in intervalos]
+    )
+    simultaneas = 0
+    for _, cambio in eventos:
+        simultaneas += cambio
+        if simultaneas > capacidad:
+            return True
+    return False
+
+
+def reprogramar_citas(doctor, sucursal, desde, hasta, nuevo_doctor=None, desplazamiento=None):
+    """
+    Mueve en bloque las citas pendientes de `doctor` en `sucursal` entre `desde` y `hasta`.
+
+    Las citas pueden pasar a `nuevo_doctor`, correrse `desplazamiento` (timedelta) o
+    ambas cosas. Todo ocurre en una transacción: se bloquean las agendas involucradas,
+    se leen las citas afectadas y las que podrían cruzarse con una consulta cada una y,
+    si no hay conflictos, se aplica un único UPDATE. Lanza ConflictoAgenda con los
+    cruces encontrados; en ese caso no se modifica ninguna cita.
+    """
+    doctor_destino = nuevo_doctor or doctor
+    desplazamiento = desplazamiento or timedelta(0)
+    duracion_maxima = timedelta(minutes=CitaMedica.DURACION_MAXIMA_MINUTOS)
+
+    with transaction.atomic():
+        bloquear_agenda(doctor, sucursal if desplazamiento else None)
+        if nuevo_doctor is not None:
+            bloquear_agenda(nuevo_doctor)
+
+        afectadas = list(
+            citas_que_ocupan().select_for_update().filter(
+                doctor_asignado=doctor,
+                sucursal=sucursal,
+                estado__in=ESTADOS_REPROGRAMABLES,
+                fecha_hora__gte=desde,
+                fecha_hora__lte=hasta,
+            ).order_by('fecha_hora').values_list('id', 'fecha_hora', 'duracion_minutos')
+        )
+        if not afectadas:
+            return []
+
+        ids = [pk for pk, _, _ in afectadas]
+        movidas = [
+            (fecha_hora + desplazamiento, fecha_hora + desplazamiento + timedelta(minutes=duracion), pk)
+            for pk, fecha_hora, duracion in afectadas
+        ]
+        if desplazamiento and movidas[0][0] <= timezone.now():
+            raise ConflictoAgenda("Error: Las citas reprogramadas deben quedar en el futuro")
+
+        rango = {
+            'fecha_hora__lt': max(fin for _, fin, _ in movidas),
+            'fecha_hora__gt': movidas[0][0] - duracion_maxima,
+        }
+        existentes = [
+            (fecha_hora, fecha_hora + timedelta(minutes=duracion), pk)
+            for pk, fecha_hora, duracion in citas_que_ocupan().filter(
+                doctor_asignado=doctor_destino, **rango
+            ).exclude(pk__in=ids).values_list('id', 'fecha_hora', 'duracion_minutos')
+        ]
+        cruces = _cruces_con_movidas(movidas, existentes)
+        if cruces:
+            error = ConflictoAgenda(
+                f"Error: {len(cruces)} cita(s) se cruzan con otras citas del doctor en el nuevo horario"
+            )
+            error.cruces = cruces
+            raise error
+
+        capacidad = capacidad_sucursal()
+        if desplazamiento and capacidad:
+            ocupacion = [
+                (fecha_hora, fecha_hora + timedelta(minutes=duracion))
+                for fecha_hora, duracion in citas_que_ocupan().filter(
+                    sucursal=sucursal, **rango
+                ).exclude(pk__in=ids).values_list('fecha_hora', 'duracion_minutos')
+            ]
+            if _excede_capacidad(ocupacion + [(inicio, fin) for inicio, fin, _ in movidas], capacidad):
+                raise ConflictoAgenda("Error: La sucursal no tiene lugar disponible en el nuevo horario")
+
+        cambios = {'actualizado_en': timezone.now()}
+        if nuevo_doctor is not None:
+            cambios['doctor_asignado'] = nuevo_doctor
+        if desplazamiento:
+            cambios['fecha_hora'] = F('fecha_hora') + desplazamiento
+            cambios['estado'] = 'reagendada'
+        CitaMedica.objects.filter(pk__in=ids).update(**cambios)
+        invalidar_reportes_rango('citas', min(desde, desde + desplazamiento), max(hasta, hasta + desplazamiento))
+        publicar_evento(sucursal.pk, 'citas_actualizadas', {'ids': ids})
+
+    return ids
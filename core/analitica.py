@@ -0,0 +1,192 @@
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from users.models import Sucursal
+from .models import Diagnostico, RefraccionDiagnostico
+from .refraccion import CAMPOS_REFRACCION
+
+VARIABLES = ['esfera', 'cilindro', 'adicion']
+AGRUPACIONES = {
+    'rango_edad': None,
+    'sucursal': 'diagnostico__sucursal_id',
+    'tipo_lente': 'diagnostico__tipo_lente',
+    'material_lente': 'diagnostico__material_lente',
+}
+# Límites inferiores de cada rango de edad (años cumplidos a la fecha de la consulta)
+RANGOS_EDAD = [0, 10, 20, 40, 60]
+PERCENTILES = [5, 25, 50, 75, 95]
+PASO_HISTOGRAMA = 0.25
+TAMANO_BLOQUE = 5000
+
+
+class ParametroInvalido(ValueError):
+    """Los parámetros del análisis no son válidos"""
+
+
+def etiquetas_rango_edad():
+    """Etiquetas de RANGOS_EDAD: '0-9', '10-19', ..., '60+'"""
+    etiquetas = [f'{inicio}-{fin - 1}' for inicio, fin in zip(RANGOS_EDAD, RANGOS_EDAD[1:])]
+    return etiquetas + [f'{RANGOS_EDAD[-1]}+']
+
+
+def parametros_analisis(params):
+    """Valida y normaliza los parámetros del análisis; el resultado es también la llave de caché"""
+    parametros = {
+        'variable': params.get('variable', 'esfera'),
+        'agrupar_por': params.get('agrupar_por', 'rango_edad'),
+        'campo': params.get('campo', 'rx_final'),
+        'ojo': params.get('ojo') or None,
+        'sucursal': params.get('sucursal') or None,
+        'fecha_desde': params.get('fecha_desde') or None,
+        'fecha_hasta': params.get('fecha_hasta') or None,
+    }
+    if parametros['variable'] not in VARIABLES:
+        raise ParametroInvalido(f"variable debe ser una de: {', '.join(VARIABLES)}")
+    if parametros['agrupar_por'] not in AGRUPACIONES:
+        raise ParametroInvalido(f"agrupar_por debe ser uno de: {', '.join(AGRUPACIONES)}")
+    if parametros['campo'] not in CAMPOS_REFRACCION:
+        raise ParametroInvalido(f"campo debe ser uno de: {', '.join(CAMPOS_REFRACCION)}")
+    if parametros['ojo'] not in (None, 'OD', 'OI'):
+        raise ParametroInvalido("ojo debe ser OD u OI")
+    for nombre in ('fecha_desde', 'fecha_hasta'):
+        if parametros[nombre] and not parse_date(parametros[nombre]):
+            raise ParametroInvalido(f"{nombre} debe tener el formato AAAA-MM-DD")
+    if parametros['sucursal'] and not str(parametros['sucursal']).isdigit():
+        raise ParametroInvalido("sucursal debe ser un ID numérico")
+    return parametros
+
+
+def _cargar_columnas(parametros):
+    """
+    Carga los valores y la columna de agrupación en arreglos de NumPy, por bloques.
+
+    Solo se leen las columnas necesarias con values_list; cada bloque se convierte a
+    arreglo y al final se concatenan, sin crear instancias de modelos.
+    """
+    variable = parametros['variable']
+    filtros = {
+        'campo': parametros['campo'],
+        f'{variable}__isnull': False,
+        'diagnostico__activo': True,
+    }
+    if parametros['ojo']:
+        filtros['ojo'] = parametros['ojo']
+    if parametros['sucursal']:
+        filtros['diagnostico__sucursal_id'] = parametros['sucursal']
+    if parametros['fecha_desde']:
+        filtros['diagnostico__fecha_hora_consulta__date__gte'] = parametros['fecha_desde']
+    if parametros['fecha_hasta']:
+        filtros['diagnostico__fecha_hora_consulta__date__lte'] = parametros['fecha_hasta']
+
+    por_edad = parametros['agrupar_por'] == 'rango_edad'
+    if por_edad:
+        filtros['diagnostico__paciente__fecha_nacimiento__isnull'] = False
+        columnas = [variable, 'diagnostico__paciente__fecha_nacimiento', 'diagnostico__fecha_hora_consulta']
+    else:
+        columnas = [variable, AGRUPACIONES[parametros['agrupar_por']]]
+
+    filas = RefraccionDiagnostico.objects.filter(**filtros).values_list(*columnas).iterator(
+        chunk_size=TAMANO_BLOQUE
+    )
+
+    valores, grupos = [], []
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= TAMANO_BLOQUE:
+            _agregar_bloque(bloque, por_edad, valores, grupos)
+            bloque = []
+    if bloque:
+        _agregar_bloque(bloque, por_edad, valores, grupos)
+
+    if not valores:
+        return np.empty(0), np.empty(0, dtype=object)
+    return np.concatenate(valores), np.concatenate(grupos)
+
+
+def _agregar_bloque(bloque, por_edad, valores, grupos):
+    columnas = list(zip(*bloque))
+    valores.append(np.array(columnas[0], dtype=float))
+    if por_edad:
+        nacimiento = np.array(columnas[1], dtype='datetime64[D]')
+        consulta = np.array([timezone.localtime(fecha).date() for fecha in columnas[2]], dtype='datetime64[D]')
+        edad = ((consulta - nacimiento).astype(int) // 365.25).astype(int)
+        indices = np.digitize(edad, RANGOS_EDAD) - 1
+        grupos.append(np.array(etiquetas_rango_edad(), dtype=object)[np.clip(indices, 0, None)])
+    else:
+        grupos.append(np.array(['' if g is None else g for g in columnas[1]], dtype=object))
+
+
+def _estadisticas(valores):
+    """Cantidad, media, percentiles e histograma (bins de PASO_HISTOGRAMA dioptrías) de un arreglo"""
+    minimo = np.floor(valores.min() / PASO_HISTOGRAMA) * PASO_HISTOGRAMA
+    maximo = np.ceil(valores.max() / PASO_HISTOGRAMA) * PASO_HISTOGRAMA
+    bordes = np.arange(minimo, maximo + PASO_HISTOGRAMA * 1.5, PASO_HISTOGRAMA)
+    conteos, bordes = np.histogram(valores, bins=bordes)
+    percentiles = np.percentile(valores, PERCENTILES)
+    return {
+        'cantidad': int(valores.size),
+        'media': round(float(valores.mean()), 2),
+        'desviacion_estandar': round(float(valores.std()), 2),
+        'percentiles': {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, percentiles)},
+        'histograma': [
+            {'desde': round(float(bordes[i]), 2), 'hasta': round(float(bordes[i + 1]), 2), 'cantidad': int(c)}
+            for i, c in enumerate(conteos) if c
+        ],
+    }
+
+
+def _etiquetas_grupo(agrupar_por):
+    if agrupar_por == 'sucursal':
+        return dict(Sucursal.objects.values_list('id', 'nombre'))
+    if agrupar_por == 'tipo_lente':
+        return dict(Diagnostico.TIPO_LENTE_CHOICES)
+    if agrupar_por == 'material_lente':
+        return dict(Diagnostico.MATERIAL_LENTE_CHOICES)
+    return {}
+
+
+def calcular_distribucion(parametros):
+    """Distribución de la variable de refracción por grupo, calculada de forma vectorizada"""
+    valores, grupos = _cargar_columnas(parametros)
+    etiquetas = _etiquetas_grupo(parametros['agrupar_por'])
+
+    resultado = []
+    if valores.size:
+        claves, inversos = np.unique(grupos.astype(str), return_inverse=True)
+        for indice in range(len(claves)):
+            seleccion = inversos == indice
+            grupo = grupos[seleccion][0]
+            resultado.append(dict(
+                {'grupo': grupo, 'grupo_nombre': etiquetas.get(grupo, grupo)},
+                **_estadisticas(valores[seleccion])
+            ))
+        if parametros['agrupar_por'] == 'rango_edad':
+            orden = etiquetas_rango_edad()
+            resultado.sort(key=lambda g: orden.index(g['grupo']))
+
+    return dict(parametros, total=int(valores.size), grupos=resultado)
+
+
+def llave_cache(parametros):
+    """Llave de caché determinista para una combinación de parámetros"""
+    crudo = json.dumps(parametros, sort_keys=True)
+    return 'analitica_refraccion:' + hashlib.md5(crudo.encode()).hexdigest()
+
+
+def distribucion_refraccion(parametros, usar_cache=True):
+    """Distribución cacheada por combinación de parámetros (settings.ANALITICA_CACHE_SEGUNDOS)"""
+    llave = llave_cache(parametros)
+    if usar_cache:
+        resultado = cache.get(llave)
+        if resultado is not None:
+            return resultado
+    resultado = calcular_distribucion(parametros)
+    cache.set(llave, resultado, getattr(settings, 'ANALITICA_CACHE_SEGUNDOS', 600))
+    return resultado
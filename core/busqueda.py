@@ -0,0 +1,244 @@
+import math
+import re
+import unicodedata
+
+from django.db.models import Count, Q
+
+from .models import Paciente, TerminoDiagnostico, TrigramaPaciente
+
+CAMPOS_BUSQUEDA_PACIENTE = ['nombre_completo', 'codigo_paciente', 'correo', 'telefono']
+
+# Llaves de datos_clinicos incluidas en el índice de palabras de diagnósticos
+CAMPOS_CLINICOS_BUSQUEDA = ['rx_final', 'diagnostico_tratamiento', 'hallazgos_encontrados']
+LONGITUD_MAXIMA_TERMINO = 40
+
+# Proporción mínima de trigramas del término que debe coincidir para considerar un resultado
+COINCIDENCIA_MINIMA = 0.7
+
+_ESPACIOS = re.compile(r'\s+')
+_SEPARADORES_TELEFONO = re.compile(r'[\s\-+().]')
+_CORREO = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+# Palabras y valores como "2.25", "20/20" o "0-180"; los signos sueltos se descartan
+_PALABRA = re.compile(r'[a-z0-9]+(?:[.,/\-][a-z0-9]+)*')
+
+DIGITOS_MINIMOS_TELEFONO = 10
+
+
+def normalizar_texto(texto):
+    """Convierte a minúsculas, elimina acentos y colapsa espacios ("José  Pérez" -> "jose perez")"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return _ESPACIOS.sub(' ', sin_acentos.lower()).strip()
+
+
+def solo_digitos(texto):
+    """Retorna únicamente los dígitos del texto"""
+    return ''.join(c for c in texto or '' if c.isdigit())
+
+
+def normalizar_telefono(telefono):
+    """Forma normalizada del teléfono: solo dígitos ("+52 55-1234-5678" -> "525512345678")"""
+    return solo_digitos(telefono)
+
+
+def normalizar_correo(correo):
+    """Forma normalizada del correo: sin espacios y en minúsculas"""
+    return (correo or '').strip().lower()
+
+
+def es_correo_completo(termino):
+    """Indica si el término es un correo completo (y no un fragmento)"""
+    return bool(_CORREO.match((termino or '').strip()))
+
+
+def es_telefono_completo(termino):
+    """Indica si el término es un número telefónico completo"""
+    termino = (termino or '').strip()
+    return (
+        _SEPARADORES_TELEFONO.sub('', termino).isdigit()
+        and len(solo_digitos(termino)) >= DIGITOS_MINIMOS_TELEFONO
+    )
+
+
+def filtrar_por_contacto(queryset, telefono=None, correo=None):
+    """Búsqueda exacta por teléfono y/o correo sobre las columnas normalizadas e indexadas"""
+    if telefono:
+        queryset = queryset.filter(telefono_normalizado=normalizar_telefono(telefono))
+    if correo:
+        queryset = queryset.filter(correo_normalizado=normalizar_correo(correo))
+    return queryset
+
+
+def generar_trigramas(texto):
+    """Genera el conjunto de trigramas de un texto ya normalizado"""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def trigramas_paciente(paciente):
+    """Trigramas de todos los campos buscables de un paciente"""
+    trigramas = set()
+    trigramas |= generar_trigramas(normalizar_texto(paciente.nombre_completo))
+    trigramas |= generar_trigramas(normalizar_texto(paciente.codigo_paciente))
+    trigramas |= generar_trigramas(normalizar_texto(paciente.correo))
+    trigramas |= generar_trigramas(normalizar_telefono(paciente.telefono))
+    return trigramas
+
+
+def trigramas_termino(termino):
+    """Trigramas de un término de búsqueda; los teléfonos se comparan solo por sus dígitos"""
+    sin_separadores = _SEPARADORES_TELEFONO.sub('', termino or '')
+    if sin_separadores.isdigit():
+        return generar_trigramas(sin_separadores)
+    return generar_trigramas(normalizar_texto(termino))
+
+
+def indexar_paciente(paciente):
+    """Sincroniza los trigramas de un paciente escribiendo solo las diferencias"""
+    nuevos = trigramas_paciente(paciente)
+    actuales = set(
+        TrigramaPaciente.objects.filter(paciente=paciente).values_list('trigrama', flat=True)
+    )
+
+    sobrantes = actuales - nuevos
+    if sobrantes:
+        TrigramaPaciente.objects.filter(paciente=paciente, trigrama__in=sobrantes).delete()
+
+    faltantes = nuevos - actuales
+    if faltantes:
+        TrigramaPaciente.objects.bulk_create(
+            [TrigramaPaciente(paciente=paciente, trigrama=t) for t in faltantes]
+        )
+
+
+def indexar_pacientes(pacientes, reemplazar=True):
+    """Indexa un lote de pacientes con un solo DELETE y un solo INSERT masivo"""
+    pacientes = [p for p in pacientes if p.pk]
+    if not pacientes:
+        return 0
+    if reemplazar:
+        TrigramaPaciente.objects.filter(paciente__in=[p.pk for p in pacientes]).delete()
+    registros = [
+        TrigramaPaciente(paciente_id=paciente.pk, trigrama=trigrama)
+        for paciente in pacientes
+        for trigrama in trigramas_paciente(paciente)
+    ]
+    TrigramaPaciente.objects.bulk_create(registros, batch_size=1000)
+    return len(registros)
+
+
+def buscar_pacientes(queryset, termino):
+    """
+    Filtra y ordena por relevancia un queryset de pacientes usando el índice de trigramas.
+
+    Los correos y teléfonos completos se resuelven con una búsqueda exacta sobre las
+    columnas normalizadas. Para el resto, cada trigrama del término es una búsqueda
+    por índice en TrigramaPaciente, en lugar de cuatro LIKE '%...%' sobre toda la
+    tabla. Los resultados se ordenan por cantidad de trigramas coincidentes, lo que
+    tolera acentos y errores menores de escritura.
+    """
+    # Un correo o teléfono completo (p. ej. identificador de llamada) es una búsqueda exacta por índice
+    if es_correo_completo(termino):
+        return filtrar_por_contacto(queryset, correo=termino)
+    if es_telefono_completo(termino):
+        exactos = filtrar_por_contacto(queryset, telefono=termino)
+        # Si no hay coincidencia exacta (p. ej. guardado con lada) se recurre a los trigramas
+        if exactos.exists():
+            return exactos
+
+    trigramas = trigramas_termino(termino)
+    if not trigramas:
+        # Términos de menos de tres caracteres: solo coincidencias por prefijo
+        termino = (termino or '').strip()
+        return queryset.filter(
+            Q(codigo_paciente__istartswith=termino) |
+            Q(nombre_completo__istartswith=termino)
+        )
+
+    minimo = max(1, math.ceil(len(trigramas) * COINCIDENCIA_MINIMA))
+    return queryset.filter(
+        trigramas__trigrama__in=trigramas
+    ).annotate(
+        relevancia=Count('trigramas')
+    ).filter(
+        relevancia__gte=minimo
+    ).order_by('-relevancia', '-creado_en', '-id')
+
+
+def extraer_terminos(texto):
+    """Palabras normalizadas (sin acentos ni mayúsculas) de un texto libre"""
+    return {
+        palabra[:LONGITUD_MAXIMA_TERMINO]
+        for palabra in _PALABRA.findall(normalizar_texto(texto))
+    }
+
+
+def terminos_diagnostico(diagnostico):
+    """Palabras de las llaves clínicas buscables y del comentario de un diagnóstico"""
+    datos_clinicos = diagnostico.datos_clinicos or {}
+    terminos = extraer_terminos(diagnostico.comentario)
+    for campo in CAMPOS_CLINICOS_BUSQUEDA:
+        valor = datos_clinicos.get(campo)
+        if isinstance(valor, str):
+            terminos |= extraer_terminos(valor)
+    return terminos
+
+
+def indexar_diagnostico(diagnostico):
+    """Sincroniza las palabras indexadas de un diagnóstico escribiendo solo las diferencias"""
+    nuevos = terminos_diagnostico(diagnostico)
+    actuales = set(
+        TerminoDiagnostico.objects.filter(diagnostico=diagnostico).values_list('termino', flat=True)
+    )
+
+    sobrantes = actuales - nuevos
+    if sobrantes:
+        TerminoDiagnostico.objects.filter(diagnostico=diagnostico, termino__in=sobrantes).delete()
+
+    faltantes = nuevos - actuales
+    if faltantes:
+        TerminoDiagnostico.objects.bulk_create(
+            [TerminoDiagnostico(diagnostico=diagnostico, termino=t) for t in faltantes]
+        )
+
+
+def indexar_diagnosticos(diagnosticos, reemplazar=True):
+    """Indexa un lote de diagnósticos con un solo DELETE y un solo INSERT masivo"""
+    diagnosticos = [d for d in diagnosticos if d.pk]
+    if not diagnosticos:
+        return 0
+    if reemplazar:
+        TerminoDiagnostico.objects.filter(diagnostico__in=[d.pk for d in diagnosticos]).delete()
+    registros = [
+        TerminoDiagnostico(diagnostico_id=diagnostico.pk, termino=termino)
+        for diagnostico in diagnosticos
+        for termino in terminos_diagnostico(diagnostico)
+    ]
+    TerminoDiagnostico.objects.bulk_create(registros, batch_size=1000)
+    return len(registros)
+
+
+def buscar_diagnosticos(queryset, termino):
+    """
+    Filtra diagnósticos por paciente o por el contenido de sus datos clínicos.
+
+    Cada palabra del término es una búsqueda por prefijo sobre el índice
+    (termino, diagnostico) de TerminoDiagnostico y deben coincidir todas, en lugar de
+    un JSON_EXTRACT ... LIKE '%...%' por llave clínica sobre toda la tabla. El nombre,
+    código y contacto del paciente se resuelven con el índice de trigramas de pacientes.
+    """
+    termino = (termino or '').strip()
+    pacientes = buscar_pacientes(Paciente.objects.all(), termino).order_by().values('id')
+    condicion = Q(paciente_id__in=pacientes)
+
+    palabras = extraer_terminos(termino)
+    if palabras:
+        coincidencias = Q()
+        for palabra in palabras:
+            coincidencias &= Q(id__in=TerminoDiagnostico.objects.filter(
+                termino__startswith=palabra
+            ).values('diagnostico_id'))
+        condicion |= coincidencias
+
+    return queryset.filter(condicion)
@@ -0,0 +1,55 @@
+import json
+
+from .models import Diagnostico
+
+# Esquema compilado una sola vez al importar el módulo
+CAMPOS_CLINICOS = frozenset(Diagnostico.get_campos_clinicos_disponibles())
+
+# Las prescripciones y la agudeza visual son textos cortos; el resto son notas clínicas
+CAMPOS_CORTOS = frozenset(['rx_en_uso', 'rx_final', 'retinoscopia', 'agudeza_visual'])
+LONGITUD_MAXIMA_CORTO = 500
+LONGITUD_MAXIMA_NOTA = 5000
+TAMANO_MAXIMO_DATOS_CLINICOS = 32000
+
+LONGITUD_MAXIMA = {
+    campo: LONGITUD_MAXIMA_CORTO if campo in CAMPOS_CORTOS else LONGITUD_MAXIMA_NOTA
+    for campo in CAMPOS_CLINICOS
+}
+
+
+def validar_datos_clinicos(datos_clinicos, permitir_desconocidos=False):
+    """
+    Valida datos_clinicos contra el esquema: llaves conocidas, valores de texto y tamaños.
+
+    Retorna un diccionario {campo: [mensajes]} vacío si la estructura es válida. El
+    tamaño total se acumula mientras se recorre y la validación se corta en cuanto se
+    supera, de modo que un JSON desproporcionado nunca llega a la base de datos.
+    """
+    if not isinstance(datos_clinicos, dict):
+        return {'datos_clinicos': ['Error: Los datos clínicos deben ser un objeto JSON']}
+
+    errores = {}
+    tamano = 0
+    for campo, valor in datos_clinicos.items():
+        # Objetos y listas anidados cuentan por su tamaño serializado
+        tamano += len(campo) + (len(valor) if isinstance(valor, str) else len(json.dumps(valor, ensure_ascii=False)))
+        if tamano > TAMANO_MAXIMO_DATOS_CLINICOS:
+            return {'datos_clinicos': [
+                f'Error: Los datos clínicos superan el tamaño máximo de {TAMANO_MAXIMO_DATOS_CLINICOS} caracteres'
+            ]}
+
+        limite = LONGITUD_MAXIMA.get(campo)
+        if limite is None:
+            if not permitir_desconocidos:
+                errores[campo] = ['Error: Campo clínico no reconocido']
+            continue
+        if not isinstance(valor, str):
+            errores[campo] = ['Error: El valor debe ser texto']
+        elif len(valor) > limite:
+            errores[campo] = [f'Error: El texto no puede superar {limite} caracteres']
+    return errores
+
+
+def campos_desconocidos(datos_clinicos):
+    """Llaves de datos_clinicos que no forman parte del esquema"""
+    return [campo for campo in datos_clinicos if campo not in CAMPOS_CLINICOS]
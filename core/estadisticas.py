@@ -0,0 +1,205 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, Q, Sum, Value, When
+from django.utils import timezone
+
+from users.models import Sucursal
+from .models import (
+    BloqueoEstadisticaDiaria, Diagnostico, EstadisticaControlesDiaria, EstadisticaDiagnosticosDiaria,
+)
+
+DIAS_PROXIMOS_CONTROLES = 30
+# Campos de Diagnostico de los que dependen las tablas de estadísticas
+CAMPOS_ESTADISTICAS = {
+    'activo', 'sucursal', 'tipo_lente', 'remision_oftalmologica', 'proximo_control', 'recordatorio_enviado',
+}
+
+
+def _rangos_continuos(fechas):
+    """Agrupa fechas ordenadas en rangos [inicio, fin] de días consecutivos"""
+    rangos = []
+    for fecha in fechas:
+        if rangos and fecha - rangos[-1][1] == timedelta(days=1):
+            rangos[-1][1] = fecha
+        else:
+            rangos.append([fecha, fecha])
+    return rangos
+
+
+def _inicio_dia(fecha):
+    return timezone.make_aware(datetime.combine(fecha, time.min))
+
+
+def bloquear_dias(fechas, sucursales=None):
+    """
+    Bloquea (SELECT ... FOR UPDATE) las filas de BloqueoEstadisticaDiaria de cada sucursal
+    y fecha, creándolas si faltan, en un único orden (sucursal, fecha).
+
+    Serializa los recálculos de los mismos días sin tocar la fila de la sucursal, que
+    bloquea la agenda: el siguiente espera a que el anterior confirme y, con READ COMMITTED
+    (el aislamiento por defecto de Django en MySQL), su conteo ya incluye esos cambios en
+    lugar de reemplazarlos con uno viejo. `sucursales=None` son todas. Debe llamarse
+    dentro de transaction.atomic().
+    """
+    fechas = sorted({fecha for fecha in fechas if fecha})
+    if sucursales is None:
+        sucursales = Sucursal.objects.values_list('pk', flat=True)
+    sucursales = sorted(set(sucursales))
+    if not fechas or not sucursales:
+        return
+    BloqueoEstadisticaDiaria.objects.bulk_create(
+        [BloqueoEstadisticaDiaria(sucursal_id=sucursal, fecha=fecha) for sucursal in sucursales for fecha in fechas],
+        ignore_conflicts=True,
+    )
+    list(
+        BloqueoEstadisticaDiaria.objects.select_for_update()
+        .filter(sucursal_id__in=sucursales, fecha__in=fechas)
+        .order_by('sucursal_id', 'fecha').values_list('pk', flat=True)
+    )
+
+
+def recalcular_diagnosticos_diarios(fechas, sucursales=None):
+    """
+    Recalcula las filas de los días de creación indicados, para `sucursales` (todas si es None).
+
+    Cada rango de días consecutivos es un rango sobre el índice de creado_en y el
+    conteo es un único GROUP BY; el día de cada diagnóstico se asigna con límites
+    calculados en Python, así que no depende de las tablas de zonas horarias de MySQL.
+    Las filas se leen y reemplazan completas con los días bloqueados, así que
+    también se corrigen los diagnósticos que cambiaron de sucursal o tipo de lente.
+    """
+    fechas = sorted(set(fechas))
+    if not fechas:
+        return 0
+
+    condicion = Q()
+    for inicio, fin in _rangos_continuos(fechas):
+        condicion |= Q(creado_en__gte=_inicio_dia(inicio), creado_en__lt=_inicio_dia(fin + timedelta(days=1)))
+    dia = Case(
+        *[
+            When(creado_en__gte=_inicio_dia(fecha), creado_en__lt=_inicio_dia(fecha + timedelta(days=1)),
+                 then=Value(fecha))
+            for fecha in fechas
+        ],
+        output_field=DateField(),
+    )
+
+    with transaction.atomic():
+        bloquear_dias(fechas, sucursales)
+        diagnosticos = Diagnostico.objects.filter(condicion, activo=True)
+        existentes = EstadisticaDiagnosticosDiaria.objects.filter(fecha__in=fechas)
+        if sucursales is not None:
+            diagnosticos = diagnosticos.filter(sucursal_id__in=sucursales)
+            existentes = existentes.filter(sucursal_id__in=sucursales)
+
+        filas = (
+            diagnosticos.annotate(fecha=dia)
+            .values('sucursal_id', 'fecha', 'tipo_lente')
+            .annotate(total=Count('id'), total_remisiones=Count('id', filter=Q(remision_oftalmologica=True)))
+            .order_by()
+        )
+        estadisticas = [
+            EstadisticaDiagnosticosDiaria(
+                sucursal_id=fila['sucursal_id'], fecha=fila['fecha'], tipo_lente=fila['tipo_lente'],
+                diagnosticos=fila['total'], remisiones=fila['total_remisiones'],
+            )
+            for fila in filas
+        ]
+        existentes.delete()
+        EstadisticaDiagnosticosDiaria.objects.bulk_create(estadisticas)
+    return len(estadisticas)
+
+
+def recalcular_controles_diarios(fechas, sucursales=None):
+    """Recalcula las filas de controles de las fechas indicadas con un GROUP BY sobre el índice de proximo_control"""
+    fechas = sorted({fecha for fecha in fechas if fecha})
+    if not fechas:
+        return 0
+
+    with transaction.atomic():
+        bloquear_dias(fechas, sucursales)
+        diagnosticos = Diagnostico.objects.filter(activo=True, proximo_control__in=fechas)
+        existentes = EstadisticaControlesDiaria.objects.filter(fecha__in=fechas)
+        if sucursales is not None:
+            diagnosticos = diagnosticos.filter(sucursal_id__in=sucursales)
+            existentes = existentes.filter(sucursal_id__in=sucursales)
+
+        filas = (
+            diagnosticos.values('sucursal_id', 'proximo_control')
+            .annotate(total=Count('id'), pendientes=Count('id', filter=Q(recordatorio_enviado=False)))
+            .order_by()
+        )
+        estadisticas = [
+            EstadisticaControlesDiaria(
+                sucursal_id=fila['sucursal_id'], fecha=fila['proximo_control'],
+                controles=fila['total'], recordatorios_pendientes=fila['pendientes'],
+            )
+            for fila in filas
+        ]
+        existentes.delete()
+        EstadisticaControlesDiaria.objects.bulk_create(estadisticas)
+    return len(estadisticas)
+
+
+def recalcular_controles_de(ids):
+    """Recalcula los días de control de los diagnósticos indicados (tras un UPDATE en lote)"""
+    filas = set(Diagnostico.objects.filter(pk__in=ids).values_list('sucursal_id', 'proximo_control').distinct())
+    return recalcular_controles_diarios(
+        [fecha for _, fecha in filas], sucursales={sucursal for sucursal, _ in filas}
+    )
+
+
+def actualizar_estadisticas_diagnostico(diagnostico):
+    """
+    Mantiene al día las filas de un diagnóstico guardado: su día de creación y su día de
+    control, tanto los valores actuales como los cargados de la base (from_db), para
+    descontarlo del día y la sucursal anteriores si el control se movió o se borró.
+    """
+    sucursales = {diagnostico.sucursal_id, getattr(diagnostico, '_sucursal_id_original', None)} - {None}
+    creacion = [timezone.localtime(diagnostico.creado_en).date()]
+    controles = [diagnostico.proximo_control, getattr(diagnostico, '_proximo_control_original', None)]
+    with transaction.atomic():
+        # Todos los días de una vez y en orden, para no cruzar bloqueos con otro guardado
+        bloquear_dias(creacion + controles, sucursales)
+        recalcular_diagnosticos_diarios(creacion, sucursales)
+        recalcular_controles_diarios(controles, sucursales)
+
+
+def dias_entre(desde, hasta):
+    return [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+
+
+def resumen_estadisticas(sucursal_id=None, dias_recordatorio=7):
+    """Estadísticas de diagnósticos leídas de las tablas diarias (decenas de filas, no la tabla completa)"""
+    hoy = timezone.localdate()
+    diagnosticos = EstadisticaDiagnosticosDiaria.objects.all()
+    controles = EstadisticaControlesDiaria.objects.filter(
+        fecha__gte=hoy, fecha__lte=hoy + timedelta(days=DIAS_PROXIMOS_CONTROLES)
+    )
+    if sucursal_id:
+        diagnosticos = diagnosticos.filter(sucursal_id=sucursal_id)
+        controles = controles.filter(sucursal_id=sucursal_id)
+
+    totales = diagnosticos.aggregate(
+        total=Sum('diagnosticos'),
+        este_mes=Sum('diagnosticos', filter=Q(fecha__gte=hoy.replace(day=1))),
+        remisiones=Sum('remisiones'),
+    )
+    totales_controles = controles.aggregate(
+        proximos=Sum('controles'),
+        pendientes=Sum('recordatorios_pendientes', filter=Q(fecha__lte=hoy + timedelta(days=dias_recordatorio))),
+    )
+    tipos_lentes = (
+        diagnosticos.exclude(tipo_lente='').values('tipo_lente')
+        .annotate(count=Sum('diagnosticos')).order_by('-count')[:5]
+    )
+
+    return {
+        'total_diagnosticos': totales['total'] or 0,
+        'diagnosticos_este_mes': totales['este_mes'] or 0,
+        'proximos_controles': totales_controles['proximos'] or 0,
+        'recordatorios_pendientes': totales_controles['pendientes'] or 0,
+        'tipos_lentes_mas_comunes': list(tipos_lentes),
+        'remisiones_oftalmologicas': totales['remisiones'] or 0,
+    }
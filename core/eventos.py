@@ -0,0 +1,113 @@
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+TAMANO_COLA = 100
+INTERVALO_KEEPALIVE = 15
+
+_broker = None
+
+
+class Suscripcion:
+    """Cola de eventos de un cliente conectado, ligada al event loop donde se creó"""
+
+    def __init__(self, sucursal_id):
+        self.sucursal_id = sucursal_id
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=TAMANO_COLA)
+
+    def entregar(self, evento):
+        # Un cliente lento pierde eventos en lugar de acumular memoria
+        if not self.cola.full():
+            self.cola.put_nowait(evento)
+
+    async def siguiente(self, timeout=None):
+        return await asyncio.wait_for(self.cola.get(), timeout)
+
+
+class BrokerLocal:
+    """
+    Broker en memoria del proceso: reparte los eventos a los clientes de la misma sucursal.
+
+    Publicar es seguro desde cualquier hilo (las vistas síncronas corren en un hilo
+    aparte bajo ASGI); la entrega se agenda en el event loop de cada suscripción.
+    Con varios procesos hay que configurar en AGENDA_BROKER un broker compartido
+    que implemente la misma interfaz (suscribir, cancelar, publicar).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscripciones = {}
+
+    def suscribir(self, sucursal_id):
+        suscripcion = Suscripcion(sucursal_id)
+        with self._lock:
+            self._suscripciones.setdefault(sucursal_id, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(suscripcion.sucursal_id, set())
+            suscripciones.discard(suscripcion)
+            if not suscripciones:
+                self._suscripciones.pop(suscripcion.sucursal_id, None)
+
+    def publicar(self, sucursal_id, evento):
+        with self._lock:
+            suscripciones = list(self._suscripciones.get(sucursal_id, ()))
+        for suscripcion in suscripciones:
+            if not suscripcion.loop.is_closed():
+                suscripcion.loop.call_soon_threadsafe(suscripcion.entregar, evento)
+
+
+def obtener_broker():
+    """Instancia única del broker configurado en settings.AGENDA_BROKER"""
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'AGENDA_BROKER', 'core.eventos.BrokerLocal'))()
+    return _broker
+
+
+def publicar_evento(sucursal_id, tipo, datos):
+    """Publica el evento cuando la transacción actual se confirma (nunca cambios revertidos)"""
+    evento = {'tipo': tipo, 'datos': datos}
+    transaction.on_commit(lambda: obtener_broker().publicar(sucursal_id, evento))
+
+
+def publicar_cita(cita, tipo):
+    """Publica la cita con el formato de CitaMedicaListSerializer"""
+    from .serializers import CitaMedicaListSerializer
+    publicar_evento(cita.sucursal_id, tipo, CitaMedicaListSerializer(cita).data)
+
+
+def formatear_sse(evento):
+    """Serializa un evento en el formato text/event-stream"""
+    datos = json.dumps(evento['datos'], cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f"event: {evento['tipo']}\ndata: {datos}\n\n"
+
+
+async def flujo_eventos(sucursal_id):
+    """
+    Generador asíncrono de Server-Sent Events para una sucursal.
+
+    Mantiene la conexión abierta sin ocupar un hilo (requiere servir con ASGI) y envía
+    un comentario de keepalive cuando no hay eventos para que los proxies no la corten.
+    """
+    broker = obtener_broker()
+    suscripcion = broker.suscribir(sucursal_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                evento = await suscripcion.siguiente(timeout=INTERVALO_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield formatear_sse(evento)
+    finally:
+        broker.cancelar(suscripcion)
@@ -0,0 +1,146 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Diagnostico
+
+FORMATOS_EXPORTACION = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+TAMANO_BLOQUE = 2000
+
+# (encabezado, ruta para values())
+COLUMNAS_PACIENTES = [
+    ('id', 'id'),
+    ('codigo_paciente', 'codigo_paciente'),
+    ('nombre_completo', 'nombre_completo'),
+    ('fecha_nacimiento', 'fecha_nacimiento'),
+    ('genero', 'genero'),
+    ('telefono', 'telefono'),
+    ('correo', 'correo'),
+    ('direccion', 'direccion'),
+    ('sucursal', 'sucursal_id'),
+    ('sucursal_nombre', 'sucursal__nombre'),
+    ('usuario_registro_nombre', 'usuario_registro__nombre_completo'),
+    ('activo', 'activo'),
+    ('creado_en', 'creado_en'),
+    ('actualizado_en', 'actualizado_en'),
+]
+
+COLUMNAS_CITAS = [
+    ('id', 'id'),
+    ('paciente', 'paciente_id'),
+    ('paciente_codigo', 'paciente__codigo_paciente'),
+    ('paciente_nombre', 'paciente__nombre_completo'),
+    ('fecha_hora', 'fecha_hora'),
+    ('duracion_minutos', 'duracion_minutos'),
+    ('estado', 'estado'),
+    ('comentarios', 'comentarios'),
+    ('doctor_asignado', 'doctor_asignado_id'),
+    ('doctor_nombre', 'doctor_asignado__nombre_completo'),
+    ('sucursal', 'sucursal_id'),
+    ('sucursal_nombre', 'sucursal__nombre'),
+    ('usuario_creacion_nombre', 'usuario_creacion__nombre_completo'),
+    ('creado_en', 'creado_en'),
+    ('actualizado_en', 'actualizado_en'),
+]
+
+COLUMNAS_DIAGNOSTICOS = [
+    ('id', 'id'),
+    ('paciente', 'paciente_id'),
+    ('paciente_codigo', 'paciente__codigo_paciente'),
+    ('paciente_nombre', 'paciente__nombre_completo'),
+    ('fecha_hora_consulta', 'fecha_hora_consulta'),
+    ('tipo_lente', 'tipo_lente'),
+    ('material_lente', 'material_lente'),
+    ('filtro_lente', 'filtro_lente'),
+    ('proximo_control', 'proximo_control'),
+    ('recordatorio_enviado', 'recordatorio_enviado'),
+    ('remision_oftalmologica', 'remision_oftalmologica'),
+    ('observaciones_adicionales', 'observaciones_adicionales'),
+    ('comentario', 'comentario'),
+    ('sucursal', 'sucursal_id'),
+    ('sucursal_nombre', 'sucursal__nombre'),
+    ('usuario_creacion_nombre', 'usuario_creacion__nombre_completo'),
+    ('creado_en', 'creado_en'),
+    ('datos_clinicos', 'datos_clinicos'),
+]
+
+
+class _Eco:
+    """Pseudo-buffer para csv.writer: retorna cada línea en lugar de acumularla"""
+
+    def write(self, valor):
+        return valor
+
+
+def _formatear_valor(valor):
+    if valor is None:
+        return ''
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return valor
+
+
+def _registros(queryset, rutas):
+    """
+    Recorre el queryset por llave (id > último ORDER BY id LIMIT n).
+
+    Con mysqlclient `.iterator()` no transmite por partes (el driver carga el resultado
+    completo), así que cada bloque es una consulta acotada sobre la llave primaria.
+    """
+    queryset = queryset.order_by('id')
+    ultimo_id = None
+    while True:
+        bloque = queryset if ultimo_id is None else queryset.filter(id__gt=ultimo_id)
+        registros = list(bloque.values('id', *rutas)[:TAMANO_BLOQUE])
+        yield from registros
+        if len(registros) < TAMANO_BLOQUE:
+            return
+        ultimo_id = registros[-1]['id']
+
+
+def _filas(queryset, columnas, aplanar_clinicos):
+    """Recorre el queryset por bloques y genera diccionarios planos con los encabezados como llaves"""
+    rutas = [ruta for _, ruta in columnas]
+    campos_clinicos = Diagnostico.get_campos_clinicos_disponibles() if aplanar_clinicos else []
+
+    for registro in _registros(queryset, rutas):
+        fila = {encabezado: registro[ruta] for encabezado, ruta in columnas}
+        if aplanar_clinicos:
+            datos_clinicos = fila.pop('datos_clinicos') or {}
+            for campo in campos_clinicos:
+                fila[campo] = datos_clinicos.get(campo, '')
+        yield fila
+
+
+def encabezados(columnas, aplanar_clinicos=False):
+    """Nombres de columna; con datos clínicos aplanados, cada campo clínico es una columna"""
+    nombres = [encabezado for encabezado, _ in columnas]
+    if aplanar_clinicos:
+        nombres.remove('datos_clinicos')
+        nombres += Diagnostico.get_campos_clinicos_disponibles()
+    return nombres
+
+
+def generar_csv(queryset, columnas, aplanar_clinicos=False):
+    """Genera el CSV línea por línea; el primer byte sale antes de terminar la consulta"""
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(encabezados(columnas, aplanar_clinicos))
+    for fila in _filas(queryset, columnas, aplanar_clinicos):
+        yield escritor.writerow([_formatear_valor(valor) for valor in fila.values()])
+
+
+def generar_ndjson(queryset, columnas, aplanar_clinicos=False):
+    """Genera un objeto JSON por línea"""
+    for fila in _filas(queryset, columnas, aplanar_clinicos):
+        yield json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def generar_exportacion(queryset, columnas, formato, aplanar_clinicos=False):
+    """Retorna el generador correspondiente al formato solicitado"""
+    if formato == 'ndjson':
+        return generar_ndjson(queryset, columnas, aplanar_clinicos)
+    return generar_csv(queryset, columnas, aplanar_clinicos)
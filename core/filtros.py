@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .busqueda import buscar_diagnosticos, buscar_pacientes, filtrar_por_contacto
+from .recordatorios import filtro_necesita_recordatorio
+from .refraccion import filtrar_por_refraccion
+
+
+def filtrar_pacientes(queryset, params):
+    """Aplica a un queryset de pacientes los filtros recibidos en los parámetros de consulta"""
+    # Filtros de búsqueda
+    search = params.get('search', None)
+    if search:
+        queryset = buscar_pacientes(queryset, search)
+    
+    # Búsqueda exacta por teléfono o correo (identificador de llamada, validaciones)
+    telefono = params.get('telefono', None)
+    correo = params.get('correo', None)
+    if telefono or correo:
+        queryset = filtrar_por_contacto(queryset, telefono=telefono, correo=correo)
+    
+    # Filtro por sucursal
+    sucursal_id = params.get('sucursal', None)
+    if sucursal_id:
+        queryset = queryset.filter(sucursal_id=sucursal_id)
+    
+    # Filtro por género
+    genero = params.get('genero', None)
+    if genero:
+        queryset = queryset.filter(genero=genero)
+    
+    return queryset
+
+
+def filtrar_citas(queryset, params):
+    """Aplica a un queryset de citas médicas los filtros recibidos en los parámetros de consulta"""
+    # Filtros de búsqueda
+    search = params.get('search', None)
+    if search:
+        queryset = queryset.filter(
+            Q(paciente__nombre_completo__icontains=search) |
+            Q(paciente__codigo_paciente__icontains=search) |
+            Q(doctor_asignado__nombre_completo__icontains=search)
+        )
+    
+    # Filtro por estado
+    estado = params.get('estado', None)
+    if estado:
+        queryset = queryset.filter(estado=estado)
+    
+    # Filtro por sucursal
+    sucursal_id = params.get('sucursal', None)
+    if sucursal_id:
+        queryset = queryset.filter(sucursal_id=sucursal_id)
+    
+    # Filtro por doctor
+    doctor_id = params.get('doctor', None)
+    if doctor_id:
+        queryset = queryset.filter(doctor_asignado_id=doctor_id)
+    
+    # Filtro por paciente
+    paciente_id = params.get('paciente', None)
+    if paciente_id:
+        queryset = queryset.filter(paciente_id=paciente_id)
+    
+    # Filtro por fecha
+    fecha_desde = params.get('fecha_desde', None)
+    fecha_hasta = params.get('fecha_hasta', None)
+    if fecha_desde:
+        queryset = queryset.filter(fecha_hora__gte=fecha_desde)
+    if fecha_hasta:
+        queryset = queryset.filter(fecha_hora__lte=fecha_hasta)
+    
+    return queryset
+
+
+def filtrar_diagnosticos(queryset, params):
+    """Aplica a un queryset de diagnósticos los filtros recibidos en los parámetros de consulta"""
+    # Filtros de búsqueda
+    search = params.get('search', None)
+    if search:
+        queryset = buscar_diagnosticos(queryset, search)
+    
+    # Filtro por sucursal
+    sucursal_id = params.get('sucursal', None)
+    if sucursal_id:
+        queryset = queryset.filter(sucursal_id=sucursal_id)
+    
+    # Filtro por paciente
+    paciente_id = params.get('paciente', None)
+    if paciente_id:
+        queryset = queryset.filter(paciente_id=paciente_id)
+    
+    # Filtro por tipo de lente
+    tipo_lente = params.get('tipo_lente', None)
+    if tipo_lente:
+        queryset = queryset.filter(tipo_lente=tipo_lente)
+    
+    # Filtro por remisión oftalmológica
+    remision = params.get('remision_oftalmologica', None)
+    if remision:
+        queryset = queryset.filter(remision_oftalmologica=remision.lower() == 'true')
+    
+    # Filtro por fecha de consulta
+    fecha_desde = params.get('fecha_desde', None)
+    fecha_hasta = params.get('fecha_hasta', None)
+    if fecha_desde:
+        queryset = queryset.filter(fecha_hora_consulta__gte=fecha_desde)
+    if fecha_hasta:
+        queryset = queryset.filter(fecha_hora_consulta__lte=fecha_hasta)
+    
+    # Filtros numéricos de la prescripción (?cilindro_hasta=-2.00)
+    queryset = filtrar_por_refraccion(queryset, params)
+    
+    # Filtro por próximos controles
+    proximos_controles = params.get('proximos_controles', None)
+    if proximos_controles:
+        fecha_limite = timezone.now().date() + timedelta(days=30)
+        queryset = queryset.filter(
+            proximo_control__lte=fecha_limite,
+            proximo_control__gte=timezone.now().date()
+        )
+    
+    # Controles dentro de los próximos N días (?proximo_control_dias=15)
+    proximo_control_dias = params.get('proximo_control_dias', None)
+    if proximo_control_dias and proximo_control_dias.isdigit():
+        hoy = timezone.localdate()
+        queryset = queryset.filter(
+            proximo_control__gte=hoy,
+            proximo_control__lte=hoy + timedelta(days=int(proximo_control_dias))
+        )
+    
+    # Diagnósticos que necesitan (o no) recordatorio, con la misma regla que la propiedad del modelo
+    necesita_recordatorio = params.get('necesita_recordatorio', None)
+    if necesita_recordatorio:
+        filtro = filtro_necesita_recordatorio()
+        if necesita_recordatorio.lower() == 'true':
+            queryset = queryset.filter(filtro)
+        else:
+            queryset = queryset.exclude(filtro)
+    
+    return queryset
@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+
+from users.models import Sucursal
+from .busqueda import indexar_pacientes
+from .models import Paciente
+from .serializers import PacienteImportSerializer
+
+FORMATOS_IMPORTACION = ('csv', 'ndjson')
+TAMANO_LOTE_DEFECTO = 500
+
+
+class FormatoInvalido(ValueError):
+    """El archivo de importación no tiene un formato soportado"""
+
+
+def detectar_formato(nombre_archivo, formato=None):
+    """Determina el formato a partir del parámetro explícito o de la extensión del archivo"""
+    if formato:
+        formato = formato.lower()
+    elif nombre_archivo and '.' in nombre_archivo:
+        formato = nombre_archivo.rsplit('.', 1)[1].lower()
+        if formato in ('jsonl', 'json'):
+            formato = 'ndjson'
+    if formato not in FORMATOS_IMPORTACION:
+        raise FormatoInvalido(
+            f"Formato no soportado. Use uno de: {', '.join(FORMATOS_IMPORTACION)}"
+        )
+    return formato
+
+
+def leer_filas(archivo, formato):
+    """
+    Genera (número de fila, datos) leyendo el archivo de forma incremental.
+
+    `archivo` es un archivo binario; nunca se carga completo en memoria.
+    """
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    try:
+        if formato == 'csv':
+            for numero, fila in enumerate(csv.DictReader(texto), start=2):
+                # Las celdas vacías se tratan como campos no enviados
+                yield numero, {k.strip(): v for k, v in fila.items() if k and v not in (None, '')}
+        else:
+            for numero, linea in enumerate(texto, start=1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    datos = json.loads(linea)
+                except ValueError:
+                    yield numero, None
+                    continue
+                yield numero, datos if isinstance(datos, dict) else None
+    finally:
+        # Evitar que el wrapper cierre el archivo original
+        texto.detach()
+
+
+def _en_lotes(filas, tamano_lote):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _procesar_lote(lote, sucursales_validas, usuario, sucursal_defecto, errores):
+    validos = []
+    correos_lote = {}
+
+    for numero, datos in lote:
+        if datos is None:
+            errores.append({'fila': numero, 'errores': {'fila': ['Error: La fila no es un objeto JSON válido']}})
+            continue
+
+        serializer = PacienteImportSerializer(data=datos)
+        if not serializer.is_valid():
+            errores.append({'fila': numero, 'errores': serializer.errors})
+            continue
+
+        validated_data = serializer.validated_data
+        sucursal_id = validated_data.pop('sucursal', None) or sucursal_defecto
+        if sucursal_id and sucursal_id not in sucursales_validas:
+            errores.append({'fila': numero, 'errores': {'sucursal': ['Error: La sucursal no existe']}})
+            continue
+
+        paciente = Paciente(**validated_data, sucursal_id=sucursal_id, usuario_registro=usuario)
+        paciente.normalizar_contacto()
+
+        if paciente.correo_normalizado:
+            if paciente.correo_normalizado in correos_lote:
+                errores.append({
+                    'fila': numero,
+                    'errores': {'correo': ['Error: El correo está repetido en el archivo']}
+                })
+                continue
+            correos_lote[paciente.correo_normalizado] = numero
+
+        validos.append((numero, paciente))
+
+    # Una sola consulta por lote para la unicidad del correo
+    if correos_lote:
+        existentes = set(
+            Paciente.objects.filter(
+                correo_normalizado__in=list(correos_lote)
+            ).values_list('correo_normalizado', flat=True)
+        )
+        if existentes:
+            filtrados = []
+            for numero, paciente in validos:
+                if paciente.correo_normalizado in existentes:
+                    errores.append({
+                        'fila': numero,
+                        'errores': {'correo': ['Error: Ya existe un paciente con este correo electrónico']}
+                    })
+                else:
+                    filtrados.append((numero, paciente))
+            validos = filtrados
+
+    if not validos:
+        return 0
+
+    pacientes = [paciente for _, paciente in validos]
+    with transaction.atomic():
+        codigos = Paciente.reservar_codigos_paciente(len(pacientes))
+        for paciente, codigo in zip(pacientes, codigos):
+            paciente.codigo_paciente = codigo
+
+        Paciente.objects.bulk_create(pacientes)
+
+        # Algunos motores (MySQL) no devuelven los ids generados por bulk_create
+        if any(paciente.pk is None for paciente in pacientes):
+            ids = dict(
+                Paciente.objects.filter(codigo_paciente__in=codigos).values_list('codigo_paciente', 'id')
+            )
+            for paciente in pacientes:
+                paciente.pk = ids[paciente.codigo_paciente]
+
+        indexar_pacientes(pacientes, reemplazar=False)
+
+    return len(pacientes)
+
+
+def importar_pacientes(filas, usuario=None, sucursal_defecto=None, tamano_lote=TAMANO_LOTE_DEFECTO):
+    """
+    Importa pacientes desde un iterable de (número de fila, datos).
+
+    Las filas se validan y se insertan por lotes: una consulta de unicidad de correo,
+    una reserva de códigos y un bulk_create por lote, de modo que la memoria usada
+    depende del tamaño del lote y no del archivo. Retorna el resumen con los errores
+    de cada fila rechazada.
+    """
+    sucursales_validas = set(Sucursal.objects.values_list('id', flat=True))
+    errores = []
+    total_filas = 0
+    importados = 0
+
+    for lote in _en_lotes(filas, tamano_lote):
+        total_filas += len(lote)
+        importados += _procesar_lote(lote, sucursales_validas, usuario, sucursal_defecto, errores)
+
+    return {
+        'total_filas': total_filas,
+        'importados': importados,
+        'con_errores': len(errores),
+        'errores': errores,
+    }
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from core.estadisticas import (
+    DIAS_PROXIMOS_CONTROLES, dias_entre, recalcular_controles_diarios, recalcular_diagnosticos_diarios,
+)
+from core.models import Diagnostico
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula las tablas de estadísticas diarias: los últimos días de creación y la ventana '
+        'de próximos controles (ejecución periódica), o todo el historial con --completo'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=2,
+            help='Días de creación recientes que se recalculan'
+        )
+        parser.add_argument(
+            '--completo',
+            action='store_true',
+            help='Recalcula todas las fechas con diagnósticos'
+        )
+        parser.add_argument(
+            '--bloque',
+            type=int,
+            default=31,
+            help='Días recalculados por consulta en modo completo'
+        )
+
+    def _por_bloques(self, fechas, bloque):
+        for i in range(0, len(fechas), bloque):
+            yield fechas[i:i + bloque]
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+
+        if options['completo']:
+            limites = Diagnostico.objects.aggregate(
+                primero=Min('creado_en'), ultimo=Max('creado_en'),
+                primer_control=Min('proximo_control'), ultimo_control=Max('proximo_control'),
+            )
+            fechas_creacion = []
+            if limites['primero']:
+                fechas_creacion = dias_entre(
+                    timezone.localtime(limites['primero']).date(), timezone.localtime(limites['ultimo']).date()
+                )
+            fechas_control = []
+            if limites['primer_control']:
+                fechas_control = dias_entre(limites['primer_control'], limites['ultimo_control'])
+        else:
+            fechas_creacion = dias_entre(hoy - timedelta(days=max(options['dias'] - 1, 0)), hoy)
+            # Cubre los cambios que no pasan por save() y los controles que se movieron de fecha
+            fechas_control = dias_entre(hoy, hoy + timedelta(days=DIAS_PROXIMOS_CONTROLES))
+
+        filas_diagnosticos = sum(
+            recalcular_diagnosticos_diarios(bloque) for bloque in self._por_bloques(fechas_creacion, options['bloque'])
+        )
+        filas_controles = sum(
+            recalcular_controles_diarios(bloque) for bloque in self._por_bloques(fechas_control, options['bloque'])
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Estadísticas recalculadas: {len(fechas_creacion)} días de creación ({filas_diagnosticos} filas), '
+            f'{len(fechas_control)} días de control ({filas_controles} filas)'
+        ))
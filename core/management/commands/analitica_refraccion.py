@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.analitica import (
+    AGRUPACIONES, VARIABLES, ParametroInvalido, distribucion_refraccion, parametros_analisis
+)
+from core.refraccion import CAMPOS_REFRACCION
+
+
+class Command(BaseCommand):
+    help = 'Calcula (y deja en caché) la distribución de esfera, cilindro o adición por grupo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variable', choices=VARIABLES, default='esfera')
+        parser.add_argument('--agrupar-por', choices=list(AGRUPACIONES), default='rango_edad')
+        parser.add_argument('--campo', choices=CAMPOS_REFRACCION, default='rx_final')
+        parser.add_argument('--ojo', choices=['OD', 'OI'])
+        parser.add_argument('--sucursal', help='ID de la sucursal')
+        parser.add_argument('--fecha-desde', help='Fecha de consulta inicial (AAAA-MM-DD)')
+        parser.add_argument('--fecha-hasta', help='Fecha de consulta final (AAAA-MM-DD)')
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Calcula todas las combinaciones de variable y agrupación (precalentar la caché)'
+        )
+
+    def handle(self, *args, **options):
+        base = {
+            'campo': options['campo'],
+            'ojo': options['ojo'],
+            'sucursal': options['sucursal'],
+            'fecha_desde': options['fecha_desde'],
+            'fecha_hasta': options['fecha_hasta'],
+        }
+        if options['todas']:
+            combinaciones = [(v, a) for v in VARIABLES for a in AGRUPACIONES]
+        else:
+            combinaciones = [(options['variable'], options['agrupar_por'])]
+
+        for variable, agrupar_por in combinaciones:
+            try:
+                parametros = parametros_analisis(dict(base, variable=variable, agrupar_por=agrupar_por))
+            except ParametroInvalido as e:
+                raise CommandError(str(e))
+            resultado = distribucion_refraccion(parametros, usar_cache=False)
+            if options['todas']:
+                self.stdout.write(f'{variable} por {agrupar_por}: {resultado["total"]} valores')
+            else:
+                self.stdout.write(json.dumps(resultado, ensure_ascii=False, indent=2))
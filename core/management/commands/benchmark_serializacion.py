@@ -0,0 +1,76 @@
+import timeit
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework import serializers
+
+from core.models import Diagnostico, Paciente
+from core.serializers import DiagnosticoListSerializer, DiagnosticoSerializer
+from users.models import Sucursal, Usuario
+
+
+def diagnosticos_de_prueba(cantidad):
+    """Diagnósticos en memoria (sin base de datos) con todos los datos clínicos llenos"""
+    sucursal = Sucursal(id=1, nombre='Sucursal Centro')
+    usuario = Usuario(id=1, nombre_completo='Doctor de Prueba')
+    ahora = timezone.now()
+    diagnosticos = []
+    for i in range(cantidad):
+        paciente = Paciente(id=i + 1, nombre_completo=f'Paciente {i}', codigo_paciente=f'VOR-{i:05d}')
+        diagnosticos.append(Diagnostico(
+            id=i + 1,
+            paciente=paciente,
+            sucursal=sucursal,
+            usuario_creacion=usuario,
+            fecha_hora_consulta=ahora,
+            tipo_lente='progresivo',
+            material_lente='policarbonato',
+            filtro_lente='antireflejo',
+            proximo_control=date.today() + timedelta(days=i % 30),
+            comentario='Control anual',
+            datos_clinicos={
+                campo: f'{campo} del paciente {i}: OD +2.25 -0.75 x 90 ADD +1.50'
+                for campo in Diagnostico.get_campos_clinicos_disponibles()
+            },
+            creado_en=ahora,
+            actualizado_en=ahora,
+        ))
+    return diagnosticos
+
+
+class Command(BaseCommand):
+    help = 'Compara el costo por fila de la serialización rápida de diagnósticos contra la de DRF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=1000, help='Diagnósticos por repetición')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Repeticiones de cada medición')
+
+    def _medir(self, funcion, filas, repeticiones):
+        mejor = min(timeit.repeat(funcion, number=1, repeat=repeticiones))
+        return mejor / filas * 1_000_000
+
+    def handle(self, *args, **options):
+        filas = options['filas']
+        repeticiones = options['repeticiones']
+        diagnosticos = diagnosticos_de_prueba(filas)
+
+        casos = [
+            # El detalle excluye las refracciones para no consultar la base de datos
+            ('DiagnosticoSerializer', DiagnosticoSerializer(excluir=['refracciones'])),
+            ('DiagnosticoListSerializer', DiagnosticoListSerializer()),
+        ]
+        for nombre, serializer in casos:
+            def drf():
+                return [serializers.Serializer.to_representation(serializer, d) for d in diagnosticos]
+
+            def rapido():
+                return [serializer.to_representation(d) for d in diagnosticos]
+
+            assert drf() == rapido(), f'{nombre}: la serialización rápida no coincide con la de DRF'
+            tiempo_drf = self._medir(drf, filas, repeticiones)
+            tiempo_rapido = self._medir(rapido, filas, repeticiones)
+            self.stdout.write(
+                f'{nombre}: DRF {tiempo_drf:.1f} µs/fila, rápida {tiempo_rapido:.1f} µs/fila '
+                f'({tiempo_drf / tiempo_rapido:.1f}x)'
+            )
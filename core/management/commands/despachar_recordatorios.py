@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.recordatorios import (
+    MAXIMO_INTENTOS_DEFECTO, TAMANO_LOTE_DEFECTO, despachar_recordatorios, encolar_recordatorios,
+    obtener_backend,
+)
+
+
+class Command(BaseCommand):
+    help = 'Encola los recordatorios de próximo control pendientes y los envía por lotes con el backend configurado'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=TAMANO_LOTE_DEFECTO,
+            help='Cantidad de recordatorios enviados por lote'
+        )
+        parser.add_argument(
+            '--por-segundo',
+            type=float,
+            default=None,
+            help='Máximo de recordatorios enviados por segundo'
+        )
+        parser.add_argument(
+            '--max-intentos',
+            type=int,
+            default=MAXIMO_INTENTOS_DEFECTO,
+            help='Intentos antes de marcar un recordatorio como fallido'
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Se mantiene en ejecución y repite el ciclo cada --intervalo segundos'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=60,
+            help='Segundos entre ciclos en modo continuo'
+        )
+
+    def handle(self, *args, **options):
+        backend = obtener_backend()
+        while True:
+            encolados = encolar_recordatorios(backend=backend)
+            resumen = despachar_recordatorios(
+                backend=backend,
+                tamano_lote=options['lote'],
+                por_segundo=options['por_segundo'],
+                maximo_intentos=options['max_intentos'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Encolados: {encolados}, enviados: {resumen['enviados']}, "
+                f"reintentos: {resumen['reintentos']}, fallidos: {resumen['fallidos']}"
+            ))
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
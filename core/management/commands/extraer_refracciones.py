@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Diagnostico
+from core.refraccion import actualizar_refracciones
+
+
+class Command(BaseCommand):
+    help = 'Extrae esfera, cilindro, eje y adición de las prescripciones de los diagnósticos existentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Cantidad de diagnósticos procesados por lote'
+        )
+
+    def _procesar_lote(self, diagnosticos):
+        with transaction.atomic():
+            return actualizar_refracciones(diagnosticos)
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        pendientes = []
+        total_diagnosticos = 0
+        total_refracciones = 0
+
+        queryset = Diagnostico.objects.only('id', 'datos_clinicos').order_by('id')
+
+        for diagnostico in queryset.iterator(chunk_size=lote):
+            pendientes.append(diagnostico)
+            if len(pendientes) >= lote:
+                total_refracciones += self._procesar_lote(pendientes)
+                total_diagnosticos += len(pendientes)
+                pendientes = []
+
+        if pendientes:
+            total_refracciones += self._procesar_lote(pendientes)
+            total_diagnosticos += len(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Diagnósticos procesados: {total_diagnosticos} ({total_refracciones} refracciones)'
+        ))
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importacion import (
+    FormatoInvalido,
+    TAMANO_LOTE_DEFECTO,
+    detectar_formato,
+    importar_pacientes,
+    leer_filas,
+)
+
+Usuario = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Importa pacientes de forma masiva desde un archivo CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo a importar')
+        parser.add_argument('--formato', choices=['csv', 'ndjson'], help='Formato del archivo (por defecto según la extensión)')
+        parser.add_argument('--sucursal', type=int, help='Sucursal asignada a las filas que no indiquen una')
+        parser.add_argument('--usuario', help='Nombre de usuario registrado como responsable de la importación')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE_DEFECTO, help='Cantidad de filas por lote')
+
+    def handle(self, *args, **options):
+        try:
+            formato = detectar_formato(options['archivo'], options['formato'])
+        except FormatoInvalido as e:
+            raise CommandError(str(e))
+
+        usuario = None
+        if options['usuario']:
+            try:
+                usuario = Usuario.objects.get(username=options['usuario'])
+            except Usuario.DoesNotExist:
+                raise CommandError(f"El usuario {options['usuario']} no existe")
+
+        with open(options['archivo'], 'rb') as archivo:
+            resultado = importar_pacientes(
+                leer_filas(archivo, formato),
+                usuario=usuario,
+                sucursal_defecto=options['sucursal'],
+                tamano_lote=options['lote']
+            )
+
+        for error in resultado['errores']:
+            self.stderr.write(f"Fila {error['fila']}: {error['errores']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Filas procesadas: {resultado['total_filas']}, "
+            f"importadas: {resultado['importados']}, "
+            f"con errores: {resultado['con_errores']}"
+        ))
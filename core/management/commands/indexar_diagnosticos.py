@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from core.busqueda import indexar_diagnosticos
+from core.models import Diagnostico
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de palabras de los datos clínicos buscables de los diagnósticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Cantidad de diagnósticos procesados por lote'
+        )
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        pendientes = []
+        total_diagnosticos = 0
+        total_terminos = 0
+
+        queryset = Diagnostico.objects.only('id', 'datos_clinicos', 'comentario').order_by('id')
+
+        for diagnostico in queryset.iterator(chunk_size=lote):
+            pendientes.append(diagnostico)
+            if len(pendientes) >= lote:
+                total_terminos += indexar_diagnosticos(pendientes)
+                total_diagnosticos += len(pendientes)
+                pendientes = []
+
+        if pendientes:
+            total_terminos += indexar_diagnosticos(pendientes)
+            total_diagnosticos += len(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Diagnósticos indexados: {total_diagnosticos} ({total_terminos} términos)'
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from core.busqueda import indexar_pacientes
+from core.models import Paciente
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda por trigramas y los contactos normalizados de los pacientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Cantidad de pacientes procesados por lote'
+        )
+
+    def _procesar_lote(self, pacientes):
+        for paciente in pacientes:
+            paciente.normalizar_contacto()
+        Paciente.objects.bulk_update(pacientes, ['telefono_normalizado', 'correo_normalizado'])
+        return indexar_pacientes(pacientes)
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        pendientes = []
+        total_pacientes = 0
+        total_trigramas = 0
+
+        queryset = Paciente.objects.only(
+            'id', 'nombre_completo', 'codigo_paciente', 'correo', 'telefono'
+        ).order_by('id')
+
+        for paciente in queryset.iterator(chunk_size=lote):
+            pendientes.append(paciente)
+            if len(pendientes) >= lote:
+                total_trigramas += self._procesar_lote(pendientes)
+                total_pacientes += len(pendientes)
+                pendientes = []
+
+        if pendientes:
+            total_trigramas += self._procesar_lote(pendientes)
+            total_pacientes += len(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Pacientes indexados: {total_pacientes} ({total_trigramas} trigramas)'
+        ))
@@ -1,16 +1,58 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from users.models import Sucursal
 
 Usuario = get_user_model()
 
+class SecuenciaCodigo(models.Model):
+    """Contador por prefijo para asignar códigos consecutivos sin recorrer la tabla"""
+    nombre = models.CharField(_('nombre'), max_length=20, unique=True)
+    valor = models.BigIntegerField(_('último valor asignado'), default=0)
+
+    class Meta:
+        verbose_name = _('secuencia de código')
+        verbose_name_plural = _('secuencias de código')
+
+    def __str__(self):
+        return f"{self.nombre}: {self.valor}"
+
+    @classmethod
+    def reservar(cls, nombre, cantidad=1, valor_inicial=None):
+        """
+        Reserva `cantidad` números consecutivos de la secuencia y retorna su rango.
+        
+        La fila del contador se bloquea (SELECT ... FOR UPDATE) solo durante la
+        reserva, así que registros concurrentes nunca obtienen el mismo número.
+        `valor_inicial` es un callable que se usa una única vez, cuando la
+        secuencia todavía no existe.
+        """
+        if cantidad < 1:
+            return range(0)
+        
+        with transaction.atomic():
+            try:
+                secuencia = cls.objects.select_for_update().get(nombre=nombre)
+            except cls.DoesNotExist:
+                inicial = valor_inicial() if valor_inicial else 0
+                cls.objects.get_or_create(nombre=nombre, defaults={'valor': inicial})
+                secuencia = cls.objects.select_for_update().get(nombre=nombre)
+            
+            inicio = secuencia.valor + 1
+            secuencia.valor += cantidad
+            secuencia.save(update_fields=['valor'])
+        
+        return range(inicio, inicio + cantidad)
+
+
 class Paciente(models.Model):
     GENERO_CHOICES = [
         ('M', 'Masculino'),
         ('F', 'Femenino'),
         ('O', 'Otro'),
     ]
+    PREFIJO_CODIGO = 'VOR'
     
     nombre_completo = models.CharField(_('nombre completo'), max_length=255)
     direccion = models.TextField(_('dirección'), blank=True)
@@ -18,6 +60,12 @@ class Paciente(models.Model):
     genero = models.CharField(_('género'), max_length=1, choices=GENERO_CHOICES, blank=True)
     telefono = models.CharField(_('teléfono'), max_length=20, blank=True)
     correo = models.EmailField(_('correo electrónico'), blank=True)
+    telefono_normalizado = models.CharField(
+        _('teléfono normalizado'), max_length=20, blank=True, editable=False, db_index=True
+    )
+    correo_normalizado = models.CharField(
+        _('correo normalizado'), max_length=254, blank=True, editable=False, db_index=True
+    )
     codigo_paciente = models.CharField(_('código de paciente'), max_length=20, unique=True, blank=True)
     usuario_registro = models.ForeignKey(
         Usuario,
@@ -41,36 +89,97 @@ class Paciente(models.Model):
         verbose_name = _('paciente')
         verbose_name_plural = _('pacientes')
         ordering = ['-creado_en']
+        indexes = [
+            models.Index(fields=['creado_en', 'id']),
+            models.Index(fields=['actualizado_en', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.codigo_paciente} - {self.nombre_completo}"
 
-    def _generar_codigo_paciente(self):
-        """Genera un código único para el paciente"""
-        from django.db.models import Max
+    @classmethod
+    def _ultimo_numero_codigo(cls):
+        """Obtiene el mayor número de código existente (solo al inicializar la secuencia)"""
+        from django.db.models.functions import Length
         
-        # Obtener el último código numérico
-        ultimo_paciente = Paciente.objects.aggregate(
-            Max('codigo_paciente')
-        )['codigo_paciente__max']
+        # Ordenar por longitud primero: "VOR-100000" es mayor que "VOR-99999"
+        ultimo_codigo = cls.objects.filter(
+            codigo_paciente__startswith=f"{cls.PREFIJO_CODIGO}-"
+        ).annotate(
+            longitud=Length('codigo_paciente')
+        ).order_by('-longitud', '-codigo_paciente').values_list('codigo_paciente', flat=True).first()
         
-        if ultimo_paciente:
+        if ultimo_codigo:
             try:
                 # Extraer el número del código (ej: VOR-00001 -> 1)
-                numero = int(ultimo_paciente.split('-')[1])
-                nuevo_numero = numero + 1
+                return int(ultimo_codigo.split('-')[1])
             except (ValueError, IndexError):
-                nuevo_numero = 1
-        else:
-            nuevo_numero = 1
-        
+                return 0
+        return 0
+
+    @classmethod
+    def reservar_codigos_paciente(cls, cantidad=1):
+        """Reserva un bloque de códigos consecutivos en O(1), seguro ante registros concurrentes"""
+        numeros = SecuenciaCodigo.reservar(
+            cls.PREFIJO_CODIGO,
+            cantidad=cantidad,
+            valor_inicial=cls._ultimo_numero_codigo
+        )
         # Formatear el código con padding de ceros
-        return f"VOR-{nuevo_numero:05d}"
+        return [f"{cls.PREFIJO_CODIGO}-{numero:05d}" for numero in numeros]
+
+    def _generar_codigo_paciente(self):
+        """Genera un código único para el paciente"""
+        return self.reservar_codigos_paciente(1)[0]
+
+    def normalizar_contacto(self):
+        """Actualiza las formas normalizadas de teléfono y correo usadas en búsquedas exactas"""
+        from .busqueda import normalizar_telefono, normalizar_correo
+        self.telefono_normalizado = normalizar_telefono(self.telefono)
+        self.correo_normalizado = normalizar_correo(self.correo)
 
     def save(self, *args, **kwargs):
+        from .busqueda import CAMPOS_BUSQUEDA_PACIENTE, indexar_paciente
+        
         if not self.codigo_paciente:
             self.codigo_paciente = self._generar_codigo_paciente()
+        self.normalizar_contacto()
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'telefono' in update_fields:
+                update_fields.add('telefono_normalizado')
+            if 'correo' in update_fields:
+                update_fields.add('correo_normalizado')
+            kwargs['update_fields'] = update_fields
         super().save(*args, **kwargs)
+        
+        # Mantener actualizado el índice de búsqueda
+        if update_fields is None or update_fields & set(CAMPOS_BUSQUEDA_PACIENTE):
+            indexar_paciente(self)
+
+
+class TrigramaPaciente(models.Model):
+    """Índice de búsqueda por trigramas normalizados (sin acentos ni mayúsculas) de cada paciente"""
+    paciente = models.ForeignKey(
+        Paciente,
+        verbose_name=_('paciente'),
+        on_delete=models.CASCADE,
+        related_name='trigramas'
+    )
+    trigrama = models.CharField(_('trigrama'), max_length=3)
+
+    class Meta:
+        verbose_name = _('trigrama de paciente')
+        verbose_name_plural = _('trigramas de pacientes')
+        unique_together = [('paciente', 'trigrama')]
+        indexes = [
+            models.Index(fields=['trigrama', 'paciente']),
+        ]
+
+    def __str__(self):
+        return f"{self.trigrama} - {self.paciente_id}"
 
 
 class CitaMedica(models.Model):
@@ -82,6 +191,16 @@ class CitaMedica(models.Model):
         ('en_progreso', 'En progreso'),
         ('finalizada', 'Finalizada'),
     ]
+    # Tabla de transiciones: estado destino -> estados de origen permitidos y acción
+    TRANSICIONES = {
+        'confirmada': {'desde': ('creada', 'reagendada'), 'accion': 'confirmar'},
+        'reagendada': {'desde': ('creada', 'confirmada'), 'accion': 'reagendar'},
+        'cancelada': {'desde': ('creada', 'confirmada', 'reagendada'), 'accion': 'cancelar'},
+        'en_progreso': {'desde': ('confirmada',), 'accion': 'iniciar'},
+        'finalizada': {'desde': ('en_progreso',), 'accion': 'finalizar'},
+    }
+    DURACION_DEFECTO_MINUTOS = 30
+    DURACION_MAXIMA_MINUTOS = 240
     
     paciente = models.ForeignKey(
         Paciente,
@@ -90,6 +209,11 @@ class CitaMedica(models.Model):
         related_name='citas'
     )
     fecha_hora = models.DateTimeField(_('fecha y hora'))
+    duracion_minutos = models.PositiveSmallIntegerField(
+        _('duración (minutos)'),
+        default=DURACION_DEFECTO_MINUTOS,
+        validators=[MinValueValidator(5), MaxValueValidator(DURACION_MAXIMA_MINUTOS)]
+    )
     estado = models.CharField(
         _('estado de la cita'),
         max_length=20,
@@ -127,38 +251,65 @@ class CitaMedica(models.Model):
         verbose_name_plural = _('citas médicas')
         ordering = ['-fecha_hora']
         indexes = [
-            models.Index(fields=['fecha_hora']),
+            models.Index(fields=['fecha_hora', 'id']),
+            models.Index(fields=['actualizado_en', 'id']),
             models.Index(fields=['estado']),
             models.Index(fields=['paciente', 'fecha_hora']),
+            models.Index(fields=['doctor_asignado', 'fecha_hora']),
+            models.Index(fields=['sucursal', 'fecha_hora']),
         ]
 
     def __str__(self):
         return f"Cita - {self.paciente.nombre_completo} - {self.fecha_hora.strftime('%d/%m/%Y %H:%M')}"
 
+    @classmethod
+    def estados_origen(cls, nuevo_estado):
+        """Estados desde los que se permite pasar a `nuevo_estado` según TRANSICIONES"""
+        transicion = cls.TRANSICIONES.get(nuevo_estado)
+        return transicion['desde'] if transicion else ()
+
+    def puede_cambiar_a(self, nuevo_estado):
+        """Verifica en la tabla de transiciones si la cita puede pasar a `nuevo_estado`"""
+        return self.estado in self.estados_origen(nuevo_estado)
+
     @property
     def puede_confirmar(self):
         """Verifica si la cita puede ser confirmada"""
-        return self.estado in ['creada', 'reagendada']
+        return self.puede_cambiar_a('confirmada')
 
     @property
     def puede_reagendar(self):
         """Verifica si la cita puede ser reagendada"""
-        return self.estado in ['creada', 'confirmada']
+        return self.puede_cambiar_a('reagendada')
 
     @property
     def puede_cancelar(self):
         """Verifica si la cita puede ser cancelada"""
-        return self.estado in ['creada', 'confirmada', 'reagendada']
+        return self.puede_cambiar_a('cancelada')
 
     @property
     def puede_iniciar(self):
         """Verifica si la cita puede iniciarse"""
-        return self.estado == 'confirmada'
+        return self.puede_cambiar_a('en_progreso')
 
     @property
     def puede_finalizar(self):
         """Verifica si la cita puede finalizarse"""
-        return self.estado == 'en_progreso'
+        return self.puede_cambiar_a('finalizada')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Fecha cargada, para invalidar también el mes anterior de los reportes si la cita se mueve
+        instancia._fecha_hora_original = instancia.__dict__.get('fecha_hora')
+        return instancia
+
+    def save(self, *args, **kwargs):
+        from .reportes import invalidar_reportes
+        
+        super().save(*args, **kwargs)
+        invalidar_reportes('citas', [self.fecha_hora, getattr(self, '_fecha_hora_original', None)])
+        self._fecha_hora_original = self.fecha_hora
 
 
 class Diagnostico(models.Model):
@@ -251,8 +402,10 @@ class Diagnostico(models.Model):
         ordering = ['-fecha_hora_consulta']
         indexes = [
             models.Index(fields=['fecha_hora_consulta']),
+            models.Index(fields=['actualizado_en', 'id']),
             models.Index(fields=['paciente', 'fecha_hora_consulta']),
             models.Index(fields=['proximo_control']),
+            models.Index(fields=['creado_en']),
         ]
 
     def __str__(self):
@@ -261,6 +414,10 @@ class Diagnostico(models.Model):
     @property
     def necesita_recordatorio(self):
         """Verifica si necesita enviar recordatorio para próximo control"""
+        # Valor calculado en la base por recordatorios.anotar_recordatorio
+        if '_necesita_recordatorio' in self.__dict__:
+            return self.__dict__['_necesita_recordatorio']
+        
         from django.utils import timezone
         from datetime import timedelta
         
@@ -269,18 +426,29 @@ class Diagnostico(models.Model):
         
         # Enviar recordatorio 7 días antes de la fecha del próximo control
         fecha_recordatorio = self.proximo_control - timedelta(days=7)
-        return timezone.now().date() >= fecha_recordatorio
+        return timezone.localdate() >= fecha_recordatorio
+
+    @necesita_recordatorio.setter
+    def necesita_recordatorio(self, valor):
+        self.__dict__['_necesita_recordatorio'] = valor
 
     @property
     def dias_hasta_proximo_control(self):
         """Calcula los días hasta el próximo control"""
+        if '_dias_hasta_proximo_control' in self.__dict__:
+            return self.__dict__['_dias_hasta_proximo_control']
+        
         if not self.proximo_control:
             return None
         
         from django.utils import timezone
-        diferencia = self.proximo_control - timezone.now().date()
+        diferencia = self.proximo_control - timezone.localdate()
         return diferencia.days
 
+    @dias_hasta_proximo_control.setter
+    def dias_hasta_proximo_control(self, valor):
+        self.__dict__['_dias_hasta_proximo_control'] = valor
+
     def get_dato_clinico(self, campo, default=''):
         """Obtiene un dato clínico específico del JSON"""
         return self.datos_clinicos.get(campo, default)
@@ -379,4 +547,201 @@ class Diagnostico(models.Model):
             estructura[campo] = self.get_dato_clinico(campo)
         return estructura
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Fecha cargada, para invalidar también el mes anterior de los reportes si la consulta se mueve
+        instancia._fecha_hora_consulta_original = instancia.__dict__.get('fecha_hora_consulta')
+        # Control y sucursal cargados, para recalcular también el día de control anterior
+        instancia._proximo_control_original = instancia.__dict__.get('proximo_control')
+        instancia._sucursal_id_original = instancia.__dict__.get('sucursal_id')
+        return instancia
+
+    def save(self, *args, **kwargs):
+        from .busqueda import indexar_diagnostico
+        from .estadisticas import CAMPOS_ESTADISTICAS, actualizar_estadisticas_diagnostico
+        from .refraccion import actualizar_refracciones
+        from .reportes import invalidar_reportes
+        
+        super().save(*args, **kwargs)
+        
+        # Mantener actualizados el índice de búsqueda, las refracciones numéricas y las estadísticas diarias
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'datos_clinicos', 'comentario'} & set(update_fields):
+            indexar_diagnostico(self)
+        if update_fields is None or 'datos_clinicos' in update_fields:
+            actualizar_refracciones([self])
+        if update_fields is None or CAMPOS_ESTADISTICAS & set(update_fields):
+            actualizar_estadisticas_diagnostico(self)
+            self._proximo_control_original = self.proximo_control
+            self._sucursal_id_original = self.sucursal_id
+        invalidar_reportes(
+            'diagnosticos', [self.fecha_hora_consulta, getattr(self, '_fecha_hora_consulta_original', None)]
+        )
+        self._fecha_hora_consulta_original = self.fecha_hora_consulta
+
+
+class TerminoDiagnostico(models.Model):
+    """Índice invertido de palabras normalizadas de los datos clínicos buscables de cada diagnóstico"""
+    diagnostico = models.ForeignKey(
+        Diagnostico,
+        verbose_name=_('diagnóstico'),
+        on_delete=models.CASCADE,
+        related_name='terminos'
+    )
+    termino = models.CharField(_('término'), max_length=40)
+
+    class Meta:
+        verbose_name = _('término de diagnóstico')
+        verbose_name_plural = _('términos de diagnósticos')
+        unique_together = [('diagnostico', 'termino')]
+        indexes = [
+            models.Index(fields=['termino', 'diagnostico']),
+        ]
+
+    def __str__(self):
+        return f"{self.termino} - {self.diagnostico_id}"
+
+
+class RefraccionDiagnostico(models.Model):
+    """Valores numéricos de una prescripción (rx_final, rx_en_uso, retinoscopia) de un diagnóstico, por ojo"""
+    OJO_CHOICES = [
+        ('OD', 'Ojo derecho'),
+        ('OI', 'Ojo izquierdo'),
+    ]
+    
+    diagnostico = models.ForeignKey(
+        Diagnostico,
+        verbose_name=_('diagnóstico'),
+        on_delete=models.CASCADE,
+        related_name='refracciones'
+    )
+    campo = models.CharField(_('campo clínico'), max_length=30)
+    ojo = models.CharField(_('ojo'), max_length=2, choices=OJO_CHOICES)
+    esfera = models.DecimalField(_('esfera'), max_digits=5, decimal_places=2, null=True, blank=True)
+    cilindro = models.DecimalField(_('cilindro'), max_digits=5, decimal_places=2, null=True, blank=True)
+    eje = models.PositiveSmallIntegerField(_('eje'), null=True, blank=True)
+    adicion = models.DecimalField(_('adición'), max_digits=4, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('refracción de diagnóstico')
+        verbose_name_plural = _('refracciones de diagnósticos')
+        unique_together = [('diagnostico', 'campo', 'ojo')]
+        indexes = [
+            models.Index(fields=['campo', 'esfera']),
+            models.Index(fields=['campo', 'cilindro']),
+            models.Index(fields=['campo', 'adicion']),
+        ]
+
+    def __str__(self):
+        return f"{self.campo} {self.ojo} - {self.diagnostico_id}"
+
 # Create your models here.
+
+
+class RecordatorioSaliente(models.Model):
+    """Bandeja de salida de recordatorios de próximo control; cada diagnóstico se encola una sola vez"""
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('enviado', 'Enviado'),
+        ('fallido', 'Fallido'),
+    ]
+    CANAL_CHOICES = [
+        ('correo', 'Correo electrónico'),
+        ('telefono', 'Teléfono'),
+    ]
+    
+    diagnostico = models.OneToOneField(
+        Diagnostico,
+        verbose_name=_('diagnóstico'),
+        on_delete=models.CASCADE,
+        related_name='recordatorio_saliente'
+    )
+    canal = models.CharField(_('canal'), max_length=10, choices=CANAL_CHOICES)
+    destinatario = models.CharField(_('destinatario'), max_length=254)
+    asunto = models.CharField(_('asunto'), max_length=200)
+    mensaje = models.TextField(_('mensaje'))
+    estado = models.CharField(_('estado'), max_length=10, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(_('intentos'), default=0)
+    siguiente_intento = models.DateTimeField(_('siguiente intento'))
+    ultimo_error = models.TextField(_('último error'), blank=True)
+    creado_en = models.DateTimeField(_('fecha de creación'), auto_now_add=True)
+    enviado_en = models.DateTimeField(_('fecha de envío'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('recordatorio saliente')
+        verbose_name_plural = _('recordatorios salientes')
+        indexes = [
+            models.Index(fields=['estado', 'siguiente_intento']),
+        ]
+
+    def __str__(self):
+        return f"{self.destinatario} - {self.estado}"
+
+
+class EstadisticaDiagnosticosDiaria(models.Model):
+    """Diagnósticos activos creados por día, sucursal y tipo de lente (ver core/estadisticas.py)"""
+    sucursal = models.ForeignKey(
+        Sucursal,
+        verbose_name=_('sucursal'),
+        on_delete=models.CASCADE,
+        related_name='estadisticas_diagnosticos'
+    )
+    fecha = models.DateField(_('fecha de creación'))
+    tipo_lente = models.CharField(_('tipo de lente'), max_length=20, blank=True)
+    diagnosticos = models.PositiveIntegerField(_('diagnósticos'), default=0)
+    remisiones = models.PositiveIntegerField(_('remisiones oftalmológicas'), default=0)
+
+    class Meta:
+        verbose_name = _('estadística diaria de diagnósticos')
+        verbose_name_plural = _('estadísticas diarias de diagnósticos')
+        unique_together = [('sucursal', 'fecha', 'tipo_lente')]
+        indexes = [
+            models.Index(fields=['fecha']),
+        ]
+
+    def __str__(self):
+        return f"{self.sucursal_id} - {self.fecha} - {self.tipo_lente}: {self.diagnosticos}"
+
+
+class EstadisticaControlesDiaria(models.Model):
+    """Controles programados por día y sucursal, con los que aún no tienen recordatorio enviado"""
+    sucursal = models.ForeignKey(
+        Sucursal,
+        verbose_name=_('sucursal'),
+        on_delete=models.CASCADE,
+        related_name='estadisticas_controles'
+    )
+    fecha = models.DateField(_('fecha del control'))
+    controles = models.PositiveIntegerField(_('controles'), default=0)
+    recordatorios_pendientes = models.PositiveIntegerField(_('recordatorios pendientes'), default=0)
+
+    class Meta:
+        verbose_name = _('estadística diaria de controles')
+        verbose_name_plural = _('estadísticas diarias de controles')
+        unique_together = [('sucursal', 'fecha')]
+        indexes = [
+            models.Index(fields=['fecha']),
+        ]
+
+    def __str__(self):
+        return f"{self.sucursal_id} - {self.fecha}: {self.controles}"
+
+
+class BloqueoEstadisticaDiaria(models.Model):
+    """Fila por sucursal y día que se bloquea (SELECT ... FOR UPDATE) mientras se recalculan sus estadísticas"""
+    sucursal = models.ForeignKey(
+        Sucursal,
+        verbose_name=_('sucursal'),
+        on_delete=models.CASCADE,
+        related_name='bloqueos_estadisticas'
+    )
+    fecha = models.DateField(_('fecha'))
+
+    class Meta:
+        verbose_name = _('bloqueo de estadística diaria')
+        verbose_name_plural = _('bloqueos de estadísticas diarias')
+        unique_together = [('sucursal', 'fecha')]
+
+    def __str__(self):
+        return f"{self.sucursal_id} - {self.fecha}"
@@ -0,0 +1,160 @@
+import base64
+import json
+
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import F, Q
+
+PAGE_SIZE_DEFECTO = 10
+PAGE_SIZE_MAXIMO = 100
+
+
+class CursorInvalido(ValueError):
+    """El cursor recibido no se puede decodificar o no corresponde al orden solicitado"""
+
+
+def obtener_page_size(request):
+    """Obtiene el tamaño de página solicitado respetando el límite máximo"""
+    page_size = request.query_params.get('page_size', PAGE_SIZE_DEFECTO)
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        return PAGE_SIZE_DEFECTO
+    if page_size < 1:
+        return PAGE_SIZE_DEFECTO
+    return min(page_size, PAGE_SIZE_MAXIMO)
+
+
+def usa_paginacion_cursor(request):
+    """Indica si el cliente pidió paginación por cursor (?paginacion=cursor o ?cursor=...)"""
+    return (
+        request.query_params.get('paginacion') == 'cursor'
+        or 'cursor' in request.query_params
+    )
+
+
+def paginar_por_pagina(queryset, request):
+    """Paginación clásica por número de página (requiere COUNT y OFFSET)"""
+    page = request.query_params.get('page', 1)
+    page_size = obtener_page_size(request)
+
+    paginator = Paginator(queryset, page_size)
+
+    try:
+        pagina = paginator.page(page)
+    except PageNotAnInteger:
+        pagina = paginator.page(1)
+    except EmptyPage:
+        pagina = paginator.page(paginator.num_pages)
+
+    return pagina, {
+        'current_page': pagina.number,
+        'total_pages': paginator.num_pages,
+        'total_items': paginator.count,
+        'page_size': page_size,
+        'has_next': pagina.has_next(),
+        'has_previous': pagina.has_previous(),
+    }
+
+
+def codificar_cursor(campo, valor, pk, anterior):
+    """Codifica la posición (valor de la columna de orden, id) en un cursor opaco"""
+    if hasattr(valor, 'isoformat'):
+        valor = valor.isoformat()
+    datos = {'c': campo, 'v': valor, 'id': pk, 'a': anterior}
+    crudo = json.dumps(datos, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, campo, model_field):
+    """Decodifica un cursor; lanza CursorInvalido si no corresponde a `campo`"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if datos['c'] != campo:
+            raise CursorInvalido('El cursor no corresponde al orden solicitado')
+        valor = model_field.to_python(datos['v'])
+        pk = int(datos['id'])
+        anterior = bool(datos['a'])
+    except CursorInvalido:
+        raise
+    except Exception as exc:
+        raise CursorInvalido('Cursor inválido') from exc
+    return valor, pk, anterior
+
+
+def paginar_por_cursor(queryset, request, orden_defecto, ordenes_permitidos=None):
+    """
+    Paginación por llave (keyset) sobre (columna de orden, id).
+
+    Evita el COUNT(*) y el OFFSET de la paginación por página: cada página es un
+    rango sobre el índice de la columna de orden, sin importar qué tan profunda sea.
+    Los cursores son opacos y codifican el último valor visto y la dirección.
+    """
+    ordenes_permitidos = ordenes_permitidos or [orden_defecto]
+    orden = request.query_params.get('ordering', orden_defecto)
+    if orden not in ordenes_permitidos:
+        orden = orden_defecto
+
+    descendente = orden.startswith('-')
+    campo = orden.lstrip('-')
+    model_field = queryset.model._meta.get_field(campo)
+    page_size = obtener_page_size(request)
+
+    cursor = request.query_params.get('cursor')
+    anterior = False
+    if cursor:
+        valor, pk, anterior = decodificar_cursor(cursor, campo, model_field)
+        # Para la página anterior se recorre el índice en sentido contrario
+        hacia_menores = descendente != anterior
+        if hacia_menores:
+            filtro = Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, 'id__lt': pk})
+        else:
+            filtro = Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor, 'id__gt': pk})
+        queryset = queryset.filter(filtro)
+
+    # El valor del cursor se lee de una anotación para no depender de columnas diferidas con only()
+    queryset = queryset.annotate(valor_cursor=F(campo))
+    invertir = descendente != anterior
+    if invertir:
+        queryset = queryset.order_by(f'-{campo}', '-id')
+    else:
+        queryset = queryset.order_by(campo, 'id')
+
+    # Se pide un registro extra para saber si hay más páginas sin hacer COUNT
+    items = list(queryset[:page_size + 1])
+    hay_mas = len(items) > page_size
+    items = items[:page_size]
+    if anterior:
+        items.reverse()
+
+    if anterior:
+        has_next = bool(cursor)
+        has_previous = hay_mas
+    else:
+        has_next = hay_mas
+        has_previous = bool(cursor)
+
+    next_cursor = None
+    previous_cursor = None
+    if items and has_next:
+        ultimo = items[-1]
+        next_cursor = codificar_cursor(campo, ultimo.valor_cursor, ultimo.pk, False)
+    if items and has_previous:
+        primero = items[0]
+        previous_cursor = codificar_cursor(campo, primero.valor_cursor, primero.pk, True)
+
+    return items, {
+        'ordering': orden,
+        'page_size': page_size,
+        'has_next': has_next,
+        'has_previous': has_previous,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+    }
+
+
+def paginar(queryset, request, orden_defecto, ordenes_permitidos=None):
+    """Aplica paginación por cursor si el cliente la pidió, o por página en caso contrario"""
+    if usa_paginacion_cursor(request):
+        return paginar_por_cursor(queryset, request, orden_defecto, ordenes_permitidos)
+    return paginar_por_pagina(queryset, request)
@@ -0,0 +1,112 @@
+from datetime import date
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Window
+from django.db.models.functions import Lag
+
+from .models import RefraccionDiagnostico
+
+VALORES_REFRACCION = ['esfera', 'cilindro', 'eje', 'adicion']
+VALORES_CON_DELTA = ['esfera', 'cilindro', 'adicion']
+LIMITE_DEFECTO = 500
+LIMITE_MAXIMO = 5000
+
+
+def _anterior(expresion):
+    """LAG de la expresión dentro de la historia del mismo paciente y ojo, en orden de consulta"""
+    return Window(
+        expression=Lag(expresion),
+        partition_by=[F('diagnostico__paciente_id'), F('ojo')],
+        order_by=[F('diagnostico__fecha_hora_consulta').asc(), F('diagnostico_id').asc()],
+    )
+
+
+def progresion_refraccion(campo='rx_final', ojo=None, **filtros):
+    """
+    Visitas con sus valores de refracción y la diferencia contra la visita anterior.
+
+    Las diferencias se calculan en la base de datos con LAG particionado por
+    (paciente, ojo) y ordenado por fecha de consulta, de modo que una cohorte completa
+    se resuelve en una sola consulta. Los `filtros` deben restringir pacientes (no
+    visitas) para no alterar cuál es la visita anterior.
+    """
+    queryset = RefraccionDiagnostico.objects.filter(
+        campo=campo, diagnostico__activo=True, **filtros
+    )
+    if ojo:
+        queryset = queryset.filter(ojo=ojo)
+
+    anotaciones = {
+        'fecha_anterior': _anterior('diagnostico__fecha_hora_consulta'),
+        'eje_anterior': _anterior('eje'),
+    }
+    for valor in VALORES_CON_DELTA:
+        anotaciones[f'{valor}_anterior'] = _anterior(valor)
+        anotaciones[f'delta_{valor}'] = ExpressionWrapper(
+            F(valor) - _anterior(valor),
+            output_field=DecimalField(max_digits=5, decimal_places=2)
+        )
+
+    return queryset.annotate(
+        paciente=F('diagnostico__paciente_id'),
+        fecha=F('diagnostico__fecha_hora_consulta'),
+        **anotaciones
+    ).order_by(
+        'diagnostico__paciente_id', 'ojo', 'diagnostico__fecha_hora_consulta', 'diagnostico_id'
+    ).values(
+        'paciente', 'diagnostico_id', 'fecha', 'ojo', *VALORES_REFRACCION,
+        'fecha_anterior', 'eje_anterior',
+        *[f'{valor}_anterior' for valor in VALORES_CON_DELTA],
+        *[f'delta_{valor}' for valor in VALORES_CON_DELTA],
+    )
+
+
+def formatear_visita(fila):
+    """Agrega los días transcurridos desde la visita anterior"""
+    fila = dict(fila)
+    fila['dias_desde_anterior'] = (
+        (fila['fecha'] - fila['fecha_anterior']).days if fila['fecha_anterior'] else None
+    )
+    return fila
+
+
+def fecha_nacimiento_para_edad(edad, hoy=None):
+    """Fecha de nacimiento de quien cumple `edad` años hoy (para filtrar por rango de edad)"""
+    hoy = hoy or date.today()
+    try:
+        return hoy.replace(year=hoy.year - edad)
+    except ValueError:
+        # 29 de febrero en un año no bisiesto
+        return hoy.replace(year=hoy.year - edad, day=28)
+
+
+def resumen_cohorte(filas, limite=LIMITE_DEFECTO):
+    """
+    Recorre la progresión de una cohorte y calcula el cambio promedio por ojo.
+
+    Solo conserva las primeras `limite` visitas para la respuesta; el resumen se
+    calcula con todas. El cambio anual normaliza cada delta por el tiempo entre visitas.
+    """
+    visitas = []
+    pacientes = set()
+    acumulado = {}
+    for fila in filas:
+        fila = formatear_visita(fila)
+        pacientes.add(fila['paciente'])
+        if len(visitas) < limite:
+            visitas.append(fila)
+        if fila['delta_esfera'] is None or not fila['dias_desde_anterior']:
+            continue
+        datos = acumulado.setdefault(fila['ojo'], {'intervalos': 0, 'delta_esfera': 0.0, 'anual': 0.0})
+        datos['intervalos'] += 1
+        datos['delta_esfera'] += float(fila['delta_esfera'])
+        datos['anual'] += float(fila['delta_esfera']) * 365.25 / fila['dias_desde_anterior']
+
+    resumen = {
+        ojo: {
+            'intervalos': datos['intervalos'],
+            'delta_esfera_promedio': round(datos['delta_esfera'] / datos['intervalos'], 2),
+            'delta_esfera_anual_promedio': round(datos['anual'] / datos['intervalos'], 2),
+        }
+        for ojo, datos in sorted(acumulado.items())
+    }
+    return {'pacientes': len(pacientes), 'resumen': resumen, 'visitas': visitas}
@@ -0,0 +1,358 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import BooleanField, Case, DateField, F, Func, IntegerField, Q, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .estadisticas import recalcular_controles_de
+from .models import Diagnostico, RecordatorioSaliente
+
+DIAS_ANTICIPACION = 7
+TAMANO_LOTE_DEFECTO = 50
+MAXIMO_INTENTOS_DEFECTO = 5
+ESPERA_BASE_SEGUNDOS = 60
+# Tiempo durante el que un lote tomado por un despachador no lo toma otro
+PLAZO_RECLAMO = timedelta(minutes=5)
+MAXIMO_CONFIRMACIONES = 5000
+
+
+class DiasHasta(Func):
+    """Días enteros desde `fecha` hasta la columna de fecha (negativo si ya pasó); NULL si la columna es NULL"""
+    function = 'DATEDIFF'
+    output_field = IntegerField()
+
+    def __init__(self, expresion, fecha, **extra):
+        super().__init__(expresion, Value(fecha, output_field=DateField()), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra):
+        return self.as_sql(
+            compiler, connection, template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(', **extra
+        )
+
+    def as_postgresql(self, compiler, connection, **extra):
+        # date - date ya es un entero de días en PostgreSQL
+        return self.as_sql(compiler, connection, template='(%(expressions)s)', arg_joiner=' - ', **extra)
+
+
+def filtro_necesita_recordatorio(fecha=None):
+    """Condición equivalente a Diagnostico.necesita_recordatorio; se resuelve con el índice de proximo_control"""
+    fecha = fecha or timezone.localdate()
+    return Q(
+        proximo_control__isnull=False,
+        proximo_control__lte=fecha + timedelta(days=DIAS_ANTICIPACION),
+        recordatorio_enviado=False,
+    )
+
+
+def anotar_recordatorio(queryset, fecha=None):
+    """
+    Anota necesita_recordatorio y dias_hasta_proximo_control calculados en la base.
+
+    Las propiedades del modelo devuelven el valor anotado si existe, así que los
+    serializers no llaman a timezone.now() por fila, y las anotaciones se pueden usar
+    en filter(), order_by() y values().
+    """
+    fecha = fecha or timezone.localdate()
+    return queryset.annotate(
+        necesita_recordatorio=Case(
+            When(filtro_necesita_recordatorio(fecha), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ),
+        dias_hasta_proximo_control=DiasHasta('proximo_control', fecha),
+    )
+
+
+class ErrorPermanente(str):
+    """Mensaje de error de un backend que no se resuelve reintentando (p. ej. sin dirección)"""
+
+
+class BackendCorreo:
+    """Envía los recordatorios por correo usando la conexión de Django (EMAIL_HOST/EMAIL_PORT)"""
+
+    # Canales que el backend puede entregar; solo esos se encolan
+    CANALES = ('correo',)
+
+    def __init__(self):
+        self.remitente = settings.DEFAULT_FROM_EMAIL
+
+    def enviar(self, recordatorios):
+        errores = {}
+        correos = []
+        for recordatorio in recordatorios:
+            if recordatorio.canal != 'correo' or not recordatorio.destinatario:
+                errores[recordatorio.id] = ErrorPermanente('El paciente no tiene correo electrónico')
+            else:
+                correos.append(recordatorio)
+        if not correos:
+            return errores
+
+        # Una sola sesión SMTP por lote
+        conexion = get_connection(fail_silently=False)
+        try:
+            conexion.open()
+        except Exception as exc:
+            errores.update({recordatorio.id: str(exc) for recordatorio in correos})
+            return errores
+        try:
+            for recordatorio in correos:
+                correo = EmailMessage(
+                    recordatorio.asunto, recordatorio.mensaje, self.remitente,
+                    [recordatorio.destinatario], connection=conexion
+                )
+                try:
+                    correo.send()
+                except Exception as exc:
+                    errores[recordatorio.id] = str(exc)
+        finally:
+            conexion.close()
+        return errores
+
+
+class BackendArchivo:
+    """Escribe cada recordatorio como una línea JSON en RECORDATORIOS_ARCHIVO (desarrollo y pruebas)"""
+
+    CANALES = ('correo', 'telefono')
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or settings.RECORDATORIOS_ARCHIVO
+
+    def enviar(self, recordatorios):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            for recordatorio in recordatorios:
+                archivo.write(json.dumps({
+                    'id': recordatorio.id,
+                    'diagnostico': recordatorio.diagnostico_id,
+                    'canal': recordatorio.canal,
+                    'destinatario': recordatorio.destinatario,
+                    'asunto': recordatorio.asunto,
+                    'mensaje': recordatorio.mensaje,
+                    'enviado_en': timezone.now(),
+                }, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+        return {}
+
+
+def obtener_backend():
+    """Instancia del backend configurado en settings.RECORDATORIOS_BACKEND"""
+    return import_string(settings.RECORDATORIOS_BACKEND)()
+
+
+def diagnosticos_por_recordar(fecha=None):
+    """Diagnósticos con próximo control dentro de los próximos días que aún no tienen recordatorio"""
+    fecha = fecha or timezone.localdate()
+    return Diagnostico.objects.filter(
+        proximo_control__gte=fecha,
+        proximo_control__lte=fecha + timedelta(days=DIAS_ANTICIPACION),
+        recordatorio_enviado=False,
+        activo=True,
+        recordatorio_saliente__isnull=True,
+    )
+
+
+def _recordatorio(fila, ahora):
+    correo = fila['paciente__correo']
+    return RecordatorioSaliente(
+        diagnostico_id=fila['id'],
+        canal='correo' if correo else 'telefono',
+        destinatario=correo or fila['paciente__telefono'],
+        asunto=f"Recordatorio de control - {fila['sucursal__nombre']}",
+        mensaje=(
+            f"Hola {fila['paciente__nombre_completo']}, le recordamos que su próximo control "
+            f"en {fila['sucursal__nombre']} es el {fila['proximo_control'].strftime('%d/%m/%Y')}."
+        ),
+        siguiente_intento=ahora,
+    )
+
+
+def encolar_recordatorios(tamano_lote=500, fecha=None, backend=None):
+    """
+    Copia a la bandeja de salida los diagnósticos que necesitan recordatorio.
+
+    Solo se encolan pacientes con un contacto que el backend puede entregar (CANALES);
+    el resto queda pendiente y sigue apareciendo en recordatorios_pendientes. Se leen
+    solo las columnas del mensaje y se insertan por bloques con bulk_create; la
+    restricción única por diagnóstico evita duplicados si dos procesos encolan a la vez.
+    Retorna las filas que insertó esta llamada, no las que otro proceso ya había encolado.
+    """
+    canales = getattr(backend or obtener_backend(), 'CANALES', ('correo', 'telefono'))
+    entregables = Q(pk__in=[])
+    if 'correo' in canales:
+        entregables |= ~Q(paciente__correo='')
+    if 'telefono' in canales:
+        entregables |= ~Q(paciente__telefono='')
+    filas = diagnosticos_por_recordar(fecha).filter(entregables).order_by('id').values(
+        'id', 'proximo_control', 'paciente__nombre_completo', 'paciente__correo',
+        'paciente__telefono', 'sucursal__nombre'
+    )
+    ahora = timezone.now()
+
+    def insertar(bloque):
+        RecordatorioSaliente.objects.bulk_create(bloque, ignore_conflicts=True)
+        # ignore_conflicts omite en silencio los ya encolados; las filas de esta llamada
+        # son las del bloque que conservan su siguiente_intento
+        return RecordatorioSaliente.objects.filter(
+            diagnostico_id__in=[recordatorio.diagnostico_id for recordatorio in bloque], siguiente_intento=ahora
+        ).count()
+
+    encolados = 0
+    bloque = []
+    for fila in filas.iterator(chunk_size=tamano_lote):
+        bloque.append(_recordatorio(fila, ahora))
+        if len(bloque) >= tamano_lote:
+            encolados += insertar(bloque)
+            bloque = []
+    if bloque:
+        encolados += insertar(bloque)
+    return encolados
+
+
+def marcar_recordatorios_enviados(ids):
+    """
+    Confirma el envío de recordatorios hecho por un sistema externo.
+
+    Se leen solo (id, recordatorio_enviado) para reportar el resultado de cada id y el
+    cambio es un único UPDATE ... WHERE id IN (...) AND activo, sin cargar datos_clinicos
+    ni ejecutar save(). Los pendientes de la bandeja de salida de esos diagnósticos se
+    dan por enviados para que el despachador no los repita. Retorna (marcados, resultados).
+    """
+    ids = list(dict.fromkeys(ids))
+    ahora = timezone.now()
+
+    with transaction.atomic():
+        enviados = dict(
+            Diagnostico.objects.filter(pk__in=ids, activo=True).values_list('id', 'recordatorio_enviado')
+        )
+        por_marcar = [pk for pk in ids if enviados.get(pk) is False]
+        marcados = 0
+        if por_marcar:
+            marcados = Diagnostico.objects.filter(
+                pk__in=por_marcar, activo=True, recordatorio_enviado=False
+            ).update(recordatorio_enviado=True, actualizado_en=ahora)
+            RecordatorioSaliente.objects.filter(
+                diagnostico_id__in=por_marcar, estado='pendiente'
+            ).update(estado='enviado', enviado_en=ahora)
+            recalcular_controles_de(por_marcar)
+
+    resultados = []
+    for pk in ids:
+        if pk not in enviados:
+            resultados.append({'id': pk, 'resultado': 'no_encontrado'})
+        elif enviados[pk]:
+            resultados.append({'id': pk, 'resultado': 'ya_enviado'})
+        else:
+            resultados.append({'id': pk, 'resultado': 'marcado'})
+    return marcados, resultados
+
+
+def ids_por_filtro(filtro, limite):
+    """Ids (hasta `limite`) de los diagnósticos activos sin recordatorio que cumplen el filtro"""
+    queryset = Diagnostico.objects.filter(activo=True, recordatorio_enviado=False)
+    if filtro.get('sucursal'):
+        queryset = queryset.filter(sucursal_id=filtro['sucursal'])
+    if filtro.get('proximo_control_desde'):
+        queryset = queryset.filter(proximo_control__gte=filtro['proximo_control_desde'])
+    if filtro.get('proximo_control_hasta'):
+        queryset = queryset.filter(proximo_control__lte=filtro['proximo_control_hasta'])
+    ids = list(queryset.order_by('id').values_list('id', flat=True)[:limite + 1])
+    return ids[:limite], len(ids) > limite
+
+
+def _reclamar_lote(tamano_lote, ahora):
+    """Toma un lote de recordatorios vencidos y lo aparta durante PLAZO_RECLAMO"""
+    with transaction.atomic():
+        lote = list(
+            RecordatorioSaliente.objects.select_for_update(skip_locked=True)
+            .filter(estado='pendiente', siguiente_intento__lte=ahora)
+            .order_by('siguiente_intento', 'id')[:tamano_lote]
+        )
+        if lote:
+            RecordatorioSaliente.objects.filter(pk__in=[r.pk for r in lote]).update(
+                siguiente_intento=ahora + PLAZO_RECLAMO
+            )
+    return lote
+
+
+def _registrar_resultado(lote, errores, maximo_intentos, ahora):
+    """Marca los enviados y reprograma los fallidos con UPDATEs por lote"""
+    enviados = [r for r in lote if r.id not in errores]
+    reintentos = 0
+    fallidos = 0
+
+    with transaction.atomic():
+        if enviados:
+            RecordatorioSaliente.objects.filter(pk__in=[r.id for r in enviados]).update(
+                estado='enviado', enviado_en=ahora, intentos=F('intentos') + 1, ultimo_error=''
+            )
+            ids_diagnosticos = [r.diagnostico_id for r in enviados]
+            Diagnostico.objects.filter(pk__in=ids_diagnosticos).update(
+                recordatorio_enviado=True, actualizado_en=ahora
+            )
+            recalcular_controles_de(ids_diagnosticos)
+
+        # Los fallos con el mismo número de intentos y el mismo error se actualizan juntos;
+        # ante una caída del servidor de correo todo el lote es un solo UPDATE
+        grupos = {}
+        for recordatorio in lote:
+            if recordatorio.id in errores:
+                error = errores[recordatorio.id]
+                llave = (recordatorio.intentos + 1, error[:1000], isinstance(error, ErrorPermanente))
+                grupos.setdefault(llave, []).append(recordatorio.id)
+        for (intentos, error, permanente), ids in grupos.items():
+            cambios = {'intentos': intentos, 'ultimo_error': error}
+            # Un error permanente no se reintenta
+            if permanente or intentos >= maximo_intentos:
+                cambios['estado'] = 'fallido'
+                fallidos += len(ids)
+            else:
+                cambios['siguiente_intento'] = ahora + timedelta(seconds=ESPERA_BASE_SEGUNDOS * 2 ** (intentos - 1))
+                reintentos += len(ids)
+            RecordatorioSaliente.objects.filter(pk__in=ids).update(**cambios)
+
+    return len(enviados), reintentos, fallidos
+
+
+def despachar_recordatorios(backend=None, tamano_lote=TAMANO_LOTE_DEFECTO, por_segundo=None,
+                            maximo_intentos=MAXIMO_INTENTOS_DEFECTO, dormir=time.sleep):
+    """
+    Envía los recordatorios pendientes de la bandeja de salida por lotes.
+
+    Cada lote se aparta con SELECT ... FOR UPDATE SKIP LOCKED (varios despachadores no
+    envían el mismo mensaje), se entrega al backend en una sola llamada y su resultado se
+    registra con UPDATEs por lote, incluido `recordatorio_enviado` de los diagnósticos.
+    Los fallos se reintentan con espera exponencial hasta `maximo_intentos`; los
+    ErrorPermanente se marcan fallidos de inmediato.
+    `por_segundo` limita la tasa de envío.
+    """
+    backend = backend or obtener_backend()
+    resumen = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+
+    while True:
+        inicio = time.monotonic()
+        ahora = timezone.now()
+        lote = _reclamar_lote(tamano_lote, ahora)
+        if not lote:
+            break
+
+        try:
+            errores = backend.enviar(lote)
+        except Exception as exc:
+            errores = {recordatorio.id: str(exc) for recordatorio in lote}
+
+        enviados, reintentos, fallidos = _registrar_resultado(lote, errores, maximo_intentos, timezone.now())
+        resumen['enviados'] += enviados
+        resumen['reintentos'] += reintentos
+        resumen['fallidos'] += fallidos
+
+        if por_segundo:
+            espera = len(lote) / por_segundo - (time.monotonic() - inicio)
+            if espera > 0:
+                dormir(espera)
+
+    return resumen
@@ -0,0 +1,151 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from .models import RefraccionDiagnostico
+
+# Llaves de datos_clinicos que contienen una prescripción
+CAMPOS_REFRACCION = ['rx_final', 'rx_en_uso', 'retinoscopia']
+
+RANGO_ESFERA = (Decimal('-30'), Decimal('30'))
+RANGO_CILINDRO = (Decimal('-10'), Decimal('10'))
+RANGO_ADICION = (Decimal('0'), Decimal('4'))
+
+_OJO = re.compile(r'\b(OD|OI|OS|AO|OU)\b\s*[:.\-]?')
+_ADICION = re.compile(r'\bADD?\b\s*[:.]?\s*([+-]?\d+(?:\.\d+)?)')
+_EJE = re.compile(r'[X×*]\s*(\d{1,3})\b')
+_AGUDEZA = re.compile(r'\b\d+/\d+\b')
+_VALOR = re.compile(r'(?<![\w.])([+-]?\d+(?:\.\d+)?|PLANO|PL|NEUTRO|N)(?![\w.])')
+
+OJOS = {'OD': ['OD'], 'OI': ['OI'], 'OS': ['OI'], 'AO': ['OD', 'OI'], 'OU': ['OD', 'OI']}
+
+
+def _decimal(texto, rango):
+    if texto in ('PLANO', 'PL', 'NEUTRO', 'N'):
+        return Decimal('0.00')
+    try:
+        valor = Decimal(texto).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+    return valor if rango[0] <= valor <= rango[1] else None
+
+
+def _analizar_segmento(segmento):
+    """Esfera, cilindro, eje y adición de la prescripción de un ojo"""
+    datos = {'esfera': None, 'cilindro': None, 'eje': None, 'adicion': None}
+
+    adicion = _ADICION.search(segmento)
+    if adicion:
+        datos['adicion'] = _decimal(adicion.group(1), RANGO_ADICION)
+        segmento = segmento[:adicion.start()] + ' ' + segmento[adicion.end():]
+
+    eje = _EJE.search(segmento)
+    if eje:
+        grados = int(eje.group(1))
+        datos['eje'] = grados if 0 <= grados <= 180 else None
+        segmento = segmento[:eje.start()] + ' ' + segmento[eje.end():]
+
+    valores = _VALOR.findall(_AGUDEZA.sub(' ', segmento))
+    if valores:
+        datos['esfera'] = _decimal(valores[0], RANGO_ESFERA)
+    if len(valores) > 1:
+        datos['cilindro'] = _decimal(valores[1], RANGO_CILINDRO)
+    return datos
+
+
+def analizar_prescripcion(texto):
+    """
+    Extrae los valores numéricos de una prescripción en texto libre.
+
+    Acepta formatos como "OD: +2.25 -0.75 x 90° ADD +1.50 / OI: plano -0.50 x 180".
+    Retorna {ojo: {esfera, cilindro, eje, adicion}} con 'OD' y/o 'OI'; los valores
+    que no se reconocen o están fuera de rango quedan en None. Una adición escrita
+    una sola vez al final se aplica a ambos ojos.
+    """
+    if not isinstance(texto, str) or not texto.strip():
+        return {}
+    texto = texto.upper().replace(',', '.').replace('°', ' ').replace('º', ' ')
+
+    marcas = list(_OJO.finditer(texto))
+    resultado = {}
+    for i, marca in enumerate(marcas):
+        fin = marcas[i + 1].start() if i + 1 < len(marcas) else len(texto)
+        datos = _analizar_segmento(texto[marca.end():fin])
+        if datos['esfera'] is None and datos['cilindro'] is None and datos['adicion'] is None:
+            continue
+        for ojo in OJOS[marca.group(1)]:
+            resultado[ojo] = dict(datos)
+
+    adiciones = {datos['adicion'] for datos in resultado.values() if datos['adicion'] is not None}
+    if len(adiciones) == 1:
+        for datos in resultado.values():
+            datos['adicion'] = datos['adicion'] if datos['adicion'] is not None else next(iter(adiciones))
+    return resultado
+
+
+def refracciones_diagnostico(diagnostico):
+    """Instancias (sin guardar) de RefraccionDiagnostico para las prescripciones de un diagnóstico"""
+    datos_clinicos = diagnostico.datos_clinicos or {}
+    refracciones = []
+    for campo in CAMPOS_REFRACCION:
+        for ojo, valores in analizar_prescripcion(datos_clinicos.get(campo)).items():
+            refracciones.append(RefraccionDiagnostico(
+                diagnostico_id=diagnostico.pk, campo=campo, ojo=ojo, **valores
+            ))
+    return refracciones
+
+
+def actualizar_refracciones(diagnosticos, reemplazar=True):
+    """Recalcula las refracciones de un lote de diagnósticos con un DELETE y un INSERT masivo"""
+    diagnosticos = [d for d in diagnosticos if d.pk]
+    if not diagnosticos:
+        return 0
+    if reemplazar:
+        RefraccionDiagnostico.objects.filter(diagnostico__in=[d.pk for d in diagnosticos]).delete()
+    registros = [
+        refraccion
+        for diagnostico in diagnosticos
+        for refraccion in refracciones_diagnostico(diagnostico)
+    ]
+    RefraccionDiagnostico.objects.bulk_create(registros, batch_size=1000)
+    return len(registros)
+
+
+# (parámetro de consulta, lookup sobre RefraccionDiagnostico)
+FILTROS_REFRACCION = [
+    ('esfera_desde', 'esfera__gte'),
+    ('esfera_hasta', 'esfera__lte'),
+    ('cilindro_desde', 'cilindro__gte'),
+    ('cilindro_hasta', 'cilindro__lte'),
+    ('adicion_desde', 'adicion__gte'),
+    ('adicion_hasta', 'adicion__lte'),
+]
+
+
+def filtrar_por_refraccion(queryset, params):
+    """
+    Filtra diagnósticos por rangos numéricos de su prescripción (?cilindro_hasta=-2 ...).
+
+    Por defecto se compara la rx_final; ?rx_campo= permite usar rx_en_uso o retinoscopia
+    y ?ojo= limitar a OD u OI. Cada filtro es un rango sobre los índices de
+    RefraccionDiagnostico.
+    """
+    condiciones = {}
+    for parametro, lookup in FILTROS_REFRACCION:
+        valor = params.get(parametro, None)
+        if valor in (None, ''):
+            continue
+        try:
+            condiciones[lookup] = Decimal(valor)
+        except InvalidOperation:
+            continue
+    if not condiciones:
+        return queryset
+
+    campo = params.get('rx_campo', 'rx_final')
+    condiciones['campo'] = campo if campo in CAMPOS_REFRACCION else 'rx_final'
+    ojo = params.get('ojo', None)
+    if ojo in ('OD', 'OI'):
+        condiciones['ojo'] = ojo
+    return queryset.filter(
+        id__in=RefraccionDiagnostico.objects.filter(**condiciones).values('diagnostico_id')
+    )
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, DateField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import CitaMedica, Diagnostico
+
+MAXIMO_MESES = 36
+MESES_DEFECTO = 12
+
+# Lista blanca por entidad: dimensiones de agrupación (columnas de values()) y filtros (campo del modelo)
+REPORTES = {
+    'citas': {
+        'modelo': CitaMedica,
+        'campo_fecha': 'fecha_hora',
+        'dimensiones': {
+            'sucursal': ('sucursal_id', 'sucursal__nombre'),
+            'doctor': ('doctor_asignado_id', 'doctor_asignado__nombre_completo'),
+            'mes': ('mes',),
+            'estado': ('estado',),
+        },
+        'filtros': {
+            'sucursal': 'sucursal_id',
+            'doctor': 'doctor_asignado_id',
+            'estado': 'estado',
+        },
+    },
+    'diagnosticos': {
+        'modelo': Diagnostico,
+        'campo_fecha': 'fecha_hora_consulta',
+        'dimensiones': {
+            'sucursal': ('sucursal_id', 'sucursal__nombre'),
+            'mes': ('mes',),
+            'tipo_lente': ('tipo_lente',),
+            'material_lente': ('material_lente',),
+            'filtro_lente': ('filtro_lente',),
+        },
+        'filtros': {
+            'sucursal': 'sucursal_id',
+            'tipo_lente': 'tipo_lente',
+            'material_lente': 'material_lente',
+            'filtro_lente': 'filtro_lente',
+        },
+    },
+}
+# Nombre de la columna de values() -> nombre en la respuesta
+NOMBRES_COLUMNAS = {
+    'sucursal_id': 'sucursal',
+    'sucursal__nombre': 'sucursal_nombre',
+    'doctor_asignado_id': 'doctor',
+    'doctor_asignado__nombre_completo': 'doctor_nombre',
+}
+
+
+class ParametroInvalido(ValueError):
+    """Los parámetros del reporte no son válidos"""
+
+
+def _primer_dia_mes(fecha):
+    return fecha.replace(day=1)
+
+
+def _siguiente_mes(mes):
+    return (mes + timedelta(days=32)).replace(day=1)
+
+
+def _inicio_dia(fecha):
+    return timezone.make_aware(datetime.combine(fecha, datetime.min.time()))
+
+
+def meses_entre(desde, hasta):
+    """Primer día de cada mes entre dos fechas, inclusive"""
+    meses = []
+    mes = _primer_dia_mes(desde)
+    while mes <= hasta:
+        meses.append(mes)
+        mes = _siguiente_mes(mes)
+    return meses
+
+
+def parametros_reporte(entidad, params):
+    """Valida la entidad, las dimensiones y los filtros contra la lista blanca; el resultado es también la llave de caché"""
+    if entidad not in REPORTES:
+        raise ParametroInvalido(f"El reporte debe ser uno de: {', '.join(REPORTES)}")
+    definicion = REPORTES[entidad]
+    modelo = definicion['modelo']
+
+    agrupar = [d.strip() for d in params.get('agrupar', '').split(',') if d.strip()]
+    if not agrupar:
+        raise ParametroInvalido("Se requiere al menos una dimensión en agrupar")
+    invalidas = [d for d in agrupar if d not in definicion['dimensiones']]
+    if invalidas:
+        raise ParametroInvalido(
+            f"Dimensiones no permitidas: {', '.join(invalidas)}. "
+            f"Use: {', '.join(definicion['dimensiones'])}"
+        )
+
+    filtros = {}
+    for nombre, campo in definicion['filtros'].items():
+        valor = params.get(nombre)
+        if not valor:
+            continue
+        campo_modelo = modelo._meta.get_field(campo)
+        if campo_modelo.choices:
+            if valor not in dict(campo_modelo.flatchoices):
+                raise ParametroInvalido(f"Valor no permitido para {nombre}: {valor}")
+        elif not valor.isdigit():
+            raise ParametroInvalido(f"{nombre} debe ser un ID numérico")
+        filtros[nombre] = valor
+
+    hoy = timezone.localdate()
+    fechas = {}
+    for nombre in ('desde', 'hasta'):
+        valor = params.get(nombre)
+        if valor and not parse_date(valor):
+            raise ParametroInvalido(f"{nombre} debe tener el formato AAAA-MM-DD")
+        fechas[nombre] = parse_date(valor) if valor else None
+    hasta = fechas['hasta'] or hoy
+    if fechas['desde']:
+        desde = fechas['desde']
+    else:
+        # Primer día del mes MESES_DEFECTO - 1 meses antes de `hasta`
+        indice = hasta.year * 12 + hasta.month - MESES_DEFECTO
+        desde = date(indice // 12, indice % 12 + 1, 1)
+    if desde > hasta:
+        raise ParametroInvalido("desde no puede ser posterior a hasta")
+    if len(meses_entre(desde, hasta)) > MAXIMO_MESES:
+        raise ParametroInvalido(f"El rango no puede abarcar más de {MAXIMO_MESES} meses")
+
+    return {
+        'entidad': entidad,
+        'agrupar': agrupar,
+        'filtros': filtros,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+    }
+
+
+def calcular_reporte(parametros):
+    """Conteos agrupados por las dimensiones pedidas con una sola consulta GROUP BY"""
+    definicion = REPORTES[parametros['entidad']]
+    campo_fecha = definicion['campo_fecha']
+    desde = _inicio_dia(date.fromisoformat(parametros['desde']))
+    hasta = _inicio_dia(date.fromisoformat(parametros['hasta']) + timedelta(days=1))
+
+    queryset = definicion['modelo'].objects.filter(
+        activo=True, **{f'{campo_fecha}__gte': desde, f'{campo_fecha}__lt': hasta}
+    )
+    queryset = queryset.filter(**{
+        definicion['filtros'][nombre]: valor for nombre, valor in parametros['filtros'].items()
+    })
+    if 'mes' in parametros['agrupar']:
+        # Límites de cada mes calculados en Python: no depende de las tablas de zonas horarias de MySQL
+        meses = meses_entre(date.fromisoformat(parametros['desde']), date.fromisoformat(parametros['hasta']))
+        queryset = queryset.annotate(mes=Case(
+            *[
+                When(
+                    **{f'{campo_fecha}__gte': _inicio_dia(mes), f'{campo_fecha}__lt': _inicio_dia(_siguiente_mes(mes))},
+                    then=Value(mes),
+                )
+                for mes in meses
+            ],
+            output_field=DateField(),
+        ))
+
+    columnas = [c for d in parametros['agrupar'] for c in definicion['dimensiones'][d]]
+    filas = queryset.values(*columnas).annotate(total=Count('id')).order_by(*columnas)
+
+    resultado = []
+    for fila in filas:
+        salida = {NOMBRES_COLUMNAS.get(columna, columna): fila[columna] for columna in columnas}
+        if 'mes' in salida and salida['mes'] is not None:
+            salida['mes'] = salida['mes'].strftime('%Y-%m')
+        salida['total'] = fila['total']
+        resultado.append(salida)
+
+    return {
+        **parametros,
+        'total': sum(fila['total'] for fila in resultado),
+        'filas': resultado,
+    }
+
+
+def _llave_version(entidad, mes):
+    return f'reportes:{entidad}:version:{mes.strftime("%Y-%m")}'
+
+
+def _versiones(entidad, meses):
+    """
+    Versión de cada mes del rango; cambia cuando se escribe un registro de ese mes.
+
+    Una versión ausente (nunca escrita o desalojada del caché) se inicializa con un
+    valor nuevo, así nunca coincide con la llave de un resultado anterior. Las versiones
+    viven en el caché de Django: con varios procesos, settings.CACHES debe apuntar a un
+    caché compartido (Redis, Memcached); con LocMemCache la invalidación solo alcanza
+    al proceso que hizo la escritura y los demás sirven reportes viejos hasta que vencen.
+    """
+    llaves = [_llave_version(entidad, mes) for mes in meses]
+    versiones = cache.get_many(llaves)
+    for llave in llaves:
+        if llave not in versiones:
+            cache.add(llave, time.time_ns(), None)
+            versiones[llave] = cache.get(llave)
+    return [versiones[llave] for llave in llaves]
+
+
+def llave_cache(parametros):
+    """Llave de caché de los parámetros más las versiones de los meses que abarca el reporte"""
+    meses = meses_entre(date.fromisoformat(parametros['desde']), date.fromisoformat(parametros['hasta']))
+    crudo = json.dumps([parametros, _versiones(parametros['entidad'], meses)], sort_keys=True)
+    return 'reportes:' + hashlib.md5(crudo.encode()).hexdigest()
+
+
+def reporte(parametros, usar_cache=True):
+    """Reporte cacheado (settings.REPORTES_CACHE_SEGUNDOS) hasta que cambie algún mes de su rango"""
+    llave = llave_cache(parametros)
+    if usar_cache:
+        resultado = cache.get(llave)
+        if resultado is not None:
+            return resultado
+    resultado = calcular_reporte(parametros)
+    cache.set(llave, resultado, getattr(settings, 'REPORTES_CACHE_SEGUNDOS', 300))
+    return resultado
+
+
+def _invalidar_meses(entidad, meses):
+    def incrementar():
+        for mes in meses:
+            try:
+                cache.incr(_llave_version(entidad, mes))
+            except ValueError:
+                # Sin versión guardada: la próxima lectura crea una nueva
+                pass
+
+    # Solo después de confirmar, para no cachear de nuevo datos previos a la escritura
+    transaction.on_commit(incrementar)
+
+
+def invalidar_reportes(entidad, fechas):
+    """Cambia la versión de los meses de `fechas` (fechas y horas) cuando la transacción se confirma"""
+    meses = {_primer_dia_mes(timezone.localtime(fecha).date()) for fecha in fechas if fecha}
+    if meses:
+        _invalidar_meses(entidad, meses)
+
+
+def invalidar_reportes_rango(entidad, desde, hasta):
+    """Invalida todos los meses entre dos fechas y horas"""
+    _invalidar_meses(entidad, meses_entre(timezone.localtime(desde).date(), timezone.localtime(hasta).date()))
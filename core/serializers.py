@@ -1,14 +1,26 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
 from django.contrib.auth import get_user_model
-from .models import Paciente, CitaMedica, Diagnostico
+from .models import Paciente, CitaMedica, Diagnostico, RefraccionDiagnostico
+from .busqueda import normalizar_correo
+from .esquema_clinico import validar_datos_clinicos
+from .agenda import ConflictoAgenda, bloquear_agenda, verificar_disponibilidad
+from .recordatorios import MAXIMO_CONFIRMACIONES
+from .transiciones import MAXIMO_CITAS_POR_LOTE
 from users.models import Sucursal
+from users.campos_dinamicos import CamposDinamicosMixin
 from django.core.validators import RegexValidator
+from django.db import transaction
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 
 Usuario = get_user_model()
 
-class PacienteSerializer(serializers.ModelSerializer):
+class PacienteSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     usuario_registro_nombre = serializers.CharField(source='usuario_registro.nombre_completo', read_only=True)
     sucursal_nombre = serializers.CharField(source='sucursal.nombre', read_only=True)
     genero_display = serializers.CharField(source='get_genero_display', read_only=True)
@@ -44,7 +56,7 @@ class PacienteSerializer(serializers.ModelSerializer):
         return value
 
     def validate_correo(self, value):
-        if value and Paciente.objects.filter(correo=value).exclude(id=self.instance.id if self.instance else None).exists():
+        if value and Paciente.objects.filter(correo_normalizado=normalizar_correo(value)).exclude(id=self.instance.id if self.instance else None).exists():
             raise serializers.ValidationError("Error: Ya existe un paciente con este correo electrónico")
         return value
 
@@ -82,7 +94,7 @@ class PacienteCreateSerializer(serializers.ModelSerializer):
         return value
 
     def validate_correo(self, value):
-        if value and Paciente.objects.filter(correo=value).exists():
+        if value and Paciente.objects.filter(correo_normalizado=normalizar_correo(value)).exists():
             raise serializers.ValidationError("Error: Ya existe un paciente con este correo electrónico")
         return value
 
@@ -99,7 +111,15 @@ class PacienteCreateSerializer(serializers.ModelSerializer):
         
         return super().create(validated_data)
 
-class PacienteListSerializer(serializers.ModelSerializer):
+class PacienteImportSerializer(PacienteCreateSerializer):
+    """Serializer para filas de importación masiva; la sucursal y el correo se validan por lote"""
+    sucursal = serializers.IntegerField(required=False, allow_null=True)
+
+    def validate_correo(self, value):
+        # La unicidad se verifica con una sola consulta por lote en core.importacion
+        return value
+
+class PacienteListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     usuario_registro_nombre = serializers.CharField(source='usuario_registro.nombre_completo', read_only=True)
     sucursal_nombre = serializers.CharField(source='sucursal.nombre', read_only=True)
     genero_display = serializers.CharField(source='get_genero_display', read_only=True)
@@ -113,7 +133,34 @@ class PacienteListSerializer(serializers.ModelSerializer):
         ]
 
 
-class CitaMedicaSerializer(serializers.ModelSerializer):
+CAMPOS_AGENDA_CITA = ('fecha_hora', 'duracion_minutos', 'doctor_asignado', 'sucursal')
+
+def validar_horario_cita(data, instance=None, bloquear=False):
+    """Verifica que el horario de la cita no se cruce con la agenda del doctor ni exceda la sucursal"""
+    def valor(campo):
+        if campo in data:
+            return data[campo]
+        return getattr(instance, campo, None) if instance else None
+    
+    fecha_hora = valor('fecha_hora')
+    if not fecha_hora:
+        return
+    duracion = valor('duracion_minutos') or CitaMedica.DURACION_DEFECTO_MINUTOS
+    doctor = valor('doctor_asignado')
+    sucursal = valor('sucursal')
+    
+    if bloquear:
+        bloquear_agenda(doctor, sucursal)
+    try:
+        verificar_disponibilidad(
+            fecha_hora, duracion, doctor=doctor, sucursal=sucursal,
+            excluir_id=instance.pk if instance else None
+        )
+    except ConflictoAgenda as e:
+        raise serializers.ValidationError({'fecha_hora': str(e)})
+
+
+class CitaMedicaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     paciente_nombre = serializers.CharField(source='paciente.nombre_completo', read_only=True)
     paciente_codigo = serializers.CharField(source='paciente.codigo_paciente', read_only=True)
     doctor_nombre = serializers.CharField(source='doctor_asignado.nombre_completo', read_only=True)
@@ -132,7 +179,7 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
         model = CitaMedica
         fields = [
             'id', 'paciente', 'paciente_nombre', 'paciente_codigo',
-            'fecha_hora', 'estado', 'estado_display', 'comentarios',
+            'fecha_hora', 'duracion_minutos', 'estado', 'estado_display', 'comentarios',
             'doctor_asignado', 'doctor_nombre', 'usuario_creacion', 
             'usuario_creacion_nombre', 'sucursal', 'sucursal_nombre',
             'puede_confirmar', 'puede_reagendar', 'puede_cancelar', 
@@ -140,6 +187,13 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
             'creado_en', 'actualizado_en'
         ]
         read_only_fields = ['creado_en', 'actualizado_en']
+        campos_dependientes = {
+            'puede_confirmar': ['estado'],
+            'puede_reagendar': ['estado'],
+            'puede_cancelar': ['estado'],
+            'puede_iniciar': ['estado'],
+            'puede_finalizar': ['estado'],
+        }
         extra_kwargs = {
             'fecha_hora': {
                 'error_messages': {
@@ -167,14 +221,27 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
                 'doctor_asignado': 'Error: No se puede asignar un doctor inactivo'
             })
         
+        # Validar que el nuevo horario no se cruce con otra cita
+        if any(campo in data for campo in CAMPOS_AGENDA_CITA):
+            validar_horario_cita(data, self.instance)
+        
         return data
 
+    def update(self, instance, validated_data):
+        if not any(campo in validated_data for campo in CAMPOS_AGENDA_CITA):
+            return super().update(instance, validated_data)
+        
+        # Repetir la verificación con la agenda bloqueada para evitar reservas simultáneas
+        with transaction.atomic():
+            validar_horario_cita(validated_data, instance, bloquear=True)
+            return super().update(instance, validated_data)
+
 
 class CitaMedicaCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = CitaMedica
         fields = [
-            'paciente', 'fecha_hora', 'comentarios', 
+            'paciente', 'fecha_hora', 'duracion_minutos', 'comentarios', 
             'doctor_asignado', 'sucursal'
         ]
         extra_kwargs = {
@@ -204,6 +271,9 @@ class CitaMedicaCreateSerializer(serializers.ModelSerializer):
                 'doctor_asignado': 'Error: No se puede asignar un doctor inactivo'
             })
         
+        # Validar que el horario no se cruce con otra cita
+        validar_horario_cita(data)
+        
         return data
 
     def create(self, validated_data):
@@ -212,10 +282,13 @@ class CitaMedicaCreateSerializer(serializers.ModelSerializer):
         if request and request.user:
             validated_data['usuario_creacion'] = request.user
         
-        return super().create(validated_data)
+        # Repetir la verificación con la agenda bloqueada para evitar reservas simultáneas
+        with transaction.atomic():
+            validar_horario_cita(validated_data, bloquear=True)
+            return super().create(validated_data)
 
 
-class CitaMedicaListSerializer(serializers.ModelSerializer):
+class CitaMedicaListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     paciente_nombre = serializers.CharField(source='paciente.nombre_completo', read_only=True)
     paciente_codigo = serializers.CharField(source='paciente.codigo_paciente', read_only=True)
     doctor_nombre = serializers.CharField(source='doctor_asignado.nombre_completo', read_only=True)
@@ -225,7 +298,7 @@ class CitaMedicaListSerializer(serializers.ModelSerializer):
     class Meta:
         model = CitaMedica
         fields = [
-            'id', 'paciente_nombre', 'paciente_codigo', 'fecha_hora',
+            'id', 'paciente_nombre', 'paciente_codigo', 'fecha_hora', 'duracion_minutos',
             'estado', 'estado_display', 'doctor_nombre', 'sucursal_nombre',
             'creado_en'
         ]
@@ -259,7 +332,193 @@ class CitaMedicaCambioEstadoSerializer(serializers.Serializer):
         return data
 
 
-class DiagnosticoSerializer(serializers.ModelSerializer):
+class CitaMedicaCambioEstadoMasivoSerializer(serializers.Serializer):
+    """Serializer para aplicar un mismo cambio de estado a varias citas"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=MAXIMO_CITAS_POR_LOTE
+    )
+    # Reagendar requiere una fecha distinta por cita, por eso no se permite en lote
+    nuevo_estado = serializers.ChoiceField(
+        choices=[estado for estado in CitaMedica.TRANSICIONES if estado != 'reagendada']
+    )
+    comentarios = serializers.CharField(required=False, allow_blank=True)
+
+
+class RecordatorioConfirmacionMasivaSerializer(serializers.Serializer):
+    """Serializer para confirmar el envío de varios recordatorios por ids o por filtro"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=MAXIMO_CONFIRMACIONES,
+        required=False
+    )
+    sucursal = serializers.IntegerField(min_value=1, required=False)
+    proximo_control_desde = serializers.DateField(required=False)
+    proximo_control_hasta = serializers.DateField(required=False)
+
+    def validate(self, data):
+        filtros = {'sucursal', 'proximo_control_desde', 'proximo_control_hasta'} & set(data)
+        if 'ids' in data and filtros:
+            raise serializers.ValidationError("Envíe una lista de ids o un filtro, no ambos")
+        if 'ids' not in data and not filtros:
+            raise serializers.ValidationError("Se requiere una lista de ids o al menos un filtro")
+        return data
+
+
+class CitaMedicaReprogramacionSerializer(serializers.Serializer):
+    """Serializer para mover en bloque las citas de un doctor a otro doctor u horario"""
+    doctor = serializers.PrimaryKeyRelatedField(queryset=Usuario.objects.all())
+    sucursal = serializers.PrimaryKeyRelatedField(queryset=Sucursal.objects.all())
+    desde = serializers.DateTimeField()
+    hasta = serializers.DateTimeField()
+    nuevo_doctor = serializers.PrimaryKeyRelatedField(
+        queryset=Usuario.objects.filter(is_active=True),
+        required=False,
+        allow_null=True
+    )
+    desplazamiento_minutos = serializers.IntegerField(
+        required=False,
+        min_value=-60 * 24 * 31,
+        max_value=60 * 24 * 31
+    )
+
+    def validate(self, data):
+        if not data.get('nuevo_doctor') and not data.get('desplazamiento_minutos'):
+            raise serializers.ValidationError(
+                "Error: Debe indicar un nuevo doctor o un desplazamiento en minutos"
+            )
+        if data.get('nuevo_doctor') == data['doctor']:
+            raise serializers.ValidationError({
+                'nuevo_doctor': 'Error: El nuevo doctor debe ser distinto al actual'
+            })
+        if data['hasta'] < data['desde']:
+            raise serializers.ValidationError({
+                'hasta': 'Error: La fecha final debe ser posterior a la inicial'
+            })
+        if data['hasta'] - data['desde'] > timedelta(days=31):
+            raise serializers.ValidationError({
+                'hasta': 'Error: El rango no puede ser mayor a 31 días'
+            })
+        return data
+
+
+class RepresentacionRapidaMixin:
+    """
+    Serialización de diagnósticos sin recorrer la maquinaria de DRF campo por campo.
+
+    La primera vez que se serializa se compila un plan con los campos legibles: las
+    llaves de datos_clinicos se leen del diccionario en una sola pasada (sin pasar por
+    las propiedades del modelo), las columnas y relaciones con getattr directo, los
+    get_*_display con un diccionario de etiquetas (sin inspect.signature por fila) y
+    solo los campos calculados usan get_attribute de DRF. El resultado es idéntico al
+    de `Serializer.to_representation`.
+    """
+
+    CONVERSORES_DIRECTOS = {
+        serializers.CharField: str,
+        serializers.BooleanField: bool,
+        serializers.IntegerField: int,
+    }
+
+    def _conversor(self, field):
+        return self.CONVERSORES_DIRECTOS.get(type(field), field.to_representation)
+
+    def _campo_concreto(self, model, nombre):
+        try:
+            campo = model._meta.get_field(nombre)
+        except FieldDoesNotExist:
+            return None
+        return campo if campo.concrete and not campo.many_to_many else None
+
+    def _compilar_campo(self, field, campos_clinicos):
+        nombre = field.field_name
+        model = self.Meta.model
+        attrs = field.source_attrs
+
+        if nombre in campos_clinicos and field.source == nombre:
+            return ('clinico', nombre, None, None)
+
+        if len(attrs) == 1 and attrs[0].startswith('get_') and attrs[0].endswith('_display'):
+            campo = self._campo_concreto(model, attrs[0][len('get_'):-len('_display')])
+            if campo is not None and campo.choices and type(field) is serializers.CharField:
+                etiquetas = {valor: str(etiqueta) for valor, etiqueta in campo.flatchoices}
+                return ('etiqueta', nombre, campo.attname, etiquetas)
+            return ('drf', nombre, field, None)
+
+        # Recorrer la cadena de relaciones hasta una columna concreta
+        campo = None
+        for attr in attrs:
+            campo = self._campo_concreto(model, attr)
+            if campo is None:
+                return ('drf', nombre, field, None)
+            if attr != attrs[-1]:
+                if not campo.is_relation:
+                    return ('drf', nombre, field, None)
+                model = campo.related_model
+
+        if len(attrs) == 1 and campo.is_relation:
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                # El id ya está en la columna *_id; no hace falta cargar la relación
+                return ('directo', nombre, campo.attname, None)
+            return ('drf', nombre, field, None)
+        if campo.is_relation:
+            return ('drf', nombre, field, None)
+        if len(attrs) == 1:
+            return ('directo', nombre, campo.attname, self._conversor(field))
+        return ('anidado', nombre, attrs, self._conversor(field))
+
+    def _compilar_plan(self):
+        campos_clinicos = set(Diagnostico.get_campos_clinicos_disponibles())
+        return [self._compilar_campo(field, campos_clinicos) for field in self._readable_fields]
+
+    def to_representation(self, instance):
+        plan = getattr(self, '_plan_representacion', None)
+        if plan is None:
+            plan = self._plan_representacion = self._compilar_plan()
+
+        datos_clinicos = instance.__dict__.get('datos_clinicos')
+        ret = OrderedDict()
+        for tipo, nombre, origen, extra in plan:
+            if tipo == 'clinico' and isinstance(datos_clinicos, dict):
+                valor = datos_clinicos.get(nombre, '')
+                ret[nombre] = None if valor is None else str(valor)
+            elif tipo == 'directo':
+                valor = getattr(instance, origen)
+                ret[nombre] = valor if valor is None or extra is None else extra(valor)
+            elif tipo == 'etiqueta':
+                valor = getattr(instance, origen)
+                ret[nombre] = None if valor is None else str(extra.get(valor, valor))
+            elif tipo == 'anidado':
+                valor = instance
+                try:
+                    for attr in origen:
+                        valor = getattr(valor, attr)
+                except ObjectDoesNotExist:
+                    valor = None
+                except AttributeError:
+                    # Relación nula en medio de la cadena: DRF omite el campo
+                    continue
+                ret[nombre] = None if valor is None else extra(valor)
+            else:
+                field = origen if tipo == 'drf' else self.fields[nombre]
+                try:
+                    atributo = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                valor = atributo.pk if isinstance(atributo, PKOnlyObject) else atributo
+                ret[nombre] = None if valor is None else field.to_representation(atributo)
+        return ret
+
+
+class RefraccionDiagnosticoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RefraccionDiagnostico
+        fields = ['campo', 'ojo', 'esfera', 'cilindro', 'eje', 'adicion']
+
+
+class DiagnosticoSerializer(RepresentacionRapidaMixin, CamposDinamicosMixin, serializers.ModelSerializer):
     paciente_nombre = serializers.CharField(source='paciente.nombre_completo', read_only=True)
     paciente_codigo = serializers.CharField(source='paciente.codigo_paciente', read_only=True)
     usuario_creacion_nombre = serializers.CharField(source='usuario_creacion.nombre_completo', read_only=True)
@@ -273,21 +532,24 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
     dias_hasta_proximo_control = serializers.IntegerField(read_only=True)
     
     # Campos individuales de datos clínicos (para compatibilidad)
-    rx_en_uso = serializers.CharField(source='rx_en_uso', read_only=True)
-    antecedentes_medicos = serializers.CharField(source='antecedentes_medicos', read_only=True)
-    sintomas_signos = serializers.CharField(source='sintomas_signos', read_only=True)
-    analisis_panoramico = serializers.CharField(source='analisis_panoramico', read_only=True)
-    examen_ojo_derecho = serializers.CharField(source='examen_ojo_derecho', read_only=True)
-    examen_ojo_izquierdo = serializers.CharField(source='examen_ojo_izquierdo', read_only=True)
-    analisis_pantoscopico = serializers.CharField(source='analisis_pantoscopico', read_only=True)
-    analisis_vertice = serializers.CharField(source='analisis_vertice', read_only=True)
-    anamnesis_paciente = serializers.CharField(source='anamnesis_paciente', read_only=True)
-    hallazgos_encontrados = serializers.CharField(source='hallazgos_encontrados', read_only=True)
-    diagnostico_tratamiento = serializers.CharField(source='diagnostico_tratamiento', read_only=True)
-    retinoscopia = serializers.CharField(source='retinoscopia', read_only=True)
-    agudeza_visual = serializers.CharField(source='agudeza_visual', read_only=True)
-    afinacion_subjetiva = serializers.CharField(source='afinacion_subjetiva', read_only=True)
-    rx_final = serializers.CharField(source='rx_final', read_only=True)
+    rx_en_uso = serializers.CharField(read_only=True)
+    antecedentes_medicos = serializers.CharField(read_only=True)
+    sintomas_signos = serializers.CharField(read_only=True)
+    analisis_panoramico = serializers.CharField(read_only=True)
+    examen_ojo_derecho = serializers.CharField(read_only=True)
+    examen_ojo_izquierdo = serializers.CharField(read_only=True)
+    analisis_pantoscopico = serializers.CharField(read_only=True)
+    analisis_vertice = serializers.CharField(read_only=True)
+    anamnesis_paciente = serializers.CharField(read_only=True)
+    hallazgos_encontrados = serializers.CharField(read_only=True)
+    diagnostico_tratamiento = serializers.CharField(read_only=True)
+    retinoscopia = serializers.CharField(read_only=True)
+    agudeza_visual = serializers.CharField(read_only=True)
+    afinacion_subjetiva = serializers.CharField(read_only=True)
+    rx_final = serializers.CharField(read_only=True)
+    
+    # Valores numéricos extraídos de las prescripciones
+    refracciones = RefraccionDiagnosticoSerializer(many=True, read_only=True)
     
     class Meta:
         model = Diagnostico
@@ -295,7 +557,7 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
             'id', 'paciente', 'paciente_nombre', 'paciente_codigo',
             
             # Campo JSON principal
-            'datos_clinicos',
+            'datos_clinicos', 'refracciones',
             
             # Campos individuales (solo lectura para compatibilidad)
             'rx_en_uso', 'antecedentes_medicos', 'sintomas_signos', 'analisis_panoramico',
@@ -316,6 +578,11 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
             'sucursal', 'sucursal_nombre', 'activo', 'creado_en', 'actualizado_en'
         ]
         read_only_fields = ['creado_en', 'actualizado_en']
+        campos_dependientes = dict(
+            {campo: ['datos_clinicos'] for campo in Diagnostico.get_campos_clinicos_disponibles()},
+            necesita_recordatorio=['proximo_control', 'recordatorio_enviado'],
+            dias_hasta_proximo_control=['proximo_control'],
+        )
         extra_kwargs = {
             'fecha_hora_consulta': {
                 'error_messages': {
@@ -328,6 +595,12 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
             }
         }
 
+    def validate_datos_clinicos(self, value):
+        errores = validar_datos_clinicos(value)
+        if errores:
+            raise serializers.ValidationError(errores)
+        return value
+
     def validate(self, data):
         # Validar que el paciente esté activo
         if 'paciente' in data and not data['paciente'].activo:
@@ -338,7 +611,31 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
         return data
 
 
+class RelacionPrecargadaField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField que busca primero en context['precargados'][campo] ({id: instancia}).
+
+    Permite validar un lote con una consulta por tipo de referencia en lugar de una por
+    elemento; sin ese contexto se comporta igual que PrimaryKeyRelatedField.
+    """
+
+    def to_internal_value(self, data):
+        precargados = self.context.get('precargados', {}).get(self.field_name)
+        if precargados is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return precargados[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class DiagnosticoCreateSerializer(serializers.ModelSerializer):
+    serializer_related_field = RelacionPrecargadaField
+
     # Campos individuales opcionales para facilitar el uso
     rx_en_uso = serializers.CharField(required=False, allow_blank=True, write_only=True)
     antecedentes_medicos = serializers.CharField(required=False, allow_blank=True, write_only=True)
@@ -394,6 +691,16 @@ class DiagnosticoCreateSerializer(serializers.ModelSerializer):
                 'proximo_control': 'Error: La fecha del próximo control debe ser futura'
             })
         
+        # Validar el JSON resultante (datos_clinicos más los campos individuales) contra el esquema
+        datos_clinicos = data.get('datos_clinicos') or {}
+        if isinstance(datos_clinicos, dict):
+            datos_clinicos = dict(datos_clinicos, **{
+                campo: data[campo] for campo in Diagnostico.get_campos_clinicos_disponibles() if campo in data
+            })
+        errores = validar_datos_clinicos(datos_clinicos)
+        if errores:
+            raise serializers.ValidationError({'datos_clinicos': errores})
+        
         return data
 
     def create(self, validated_data):
@@ -423,7 +730,7 @@ class DiagnosticoCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class DiagnosticoListSerializer(serializers.ModelSerializer):
+class DiagnosticoListSerializer(RepresentacionRapidaMixin, CamposDinamicosMixin, serializers.ModelSerializer):
     paciente_nombre = serializers.CharField(source='paciente.nombre_completo', read_only=True)
     paciente_codigo = serializers.CharField(source='paciente.codigo_paciente', read_only=True)
     usuario_creacion_nombre = serializers.CharField(source='usuario_creacion.nombre_completo', read_only=True)
@@ -440,9 +747,14 @@ class DiagnosticoListSerializer(serializers.ModelSerializer):
             'dias_hasta_proximo_control', 'remision_oftalmologica', 'usuario_creacion_nombre',
             'sucursal_nombre', 'creado_en'
         ]
+        campos_dependientes = {
+            'rx_final': ['datos_clinicos'],
+            'necesita_recordatorio': ['proximo_control', 'recordatorio_enviado'],
+            'dias_hasta_proximo_control': ['proximo_control'],
+        }
 
 
-class DiagnosticoResumenSerializer(serializers.ModelSerializer):
+class DiagnosticoResumenSerializer(RepresentacionRapidaMixin, CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializer para mostrar resumen de diagnósticos en el perfil del paciente"""
     usuario_creacion_nombre = serializers.CharField(source='usuario_creacion.nombre_completo', read_only=True)
     tipo_lente_display = serializers.CharField(source='get_tipo_lente_display', read_only=True)
@@ -453,6 +765,9 @@ class DiagnosticoResumenSerializer(serializers.ModelSerializer):
             'id', 'fecha_hora_consulta', 'rx_final', 'tipo_lente_display',
             'proximo_control', 'remision_oftalmologica', 'usuario_creacion_nombre', 'creado_en'
         ]
+        campos_dependientes = {
+            'rx_final': ['datos_clinicos'],
+        }
 
 
 class RecordatorioSerializer(serializers.Serializer):
@@ -0,0 +1,91 @@
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+from .paginacion import CursorInvalido, codificar_cursor, decodificar_cursor
+
+CAMPO_CAMBIOS = 'actualizado_en'
+LIMITE_DEFECTO = 200
+LIMITE_MAXIMO = 1000
+
+
+def obtener_limite(request):
+    """Cantidad de cambios por respuesta respetando el límite máximo"""
+    try:
+        limite = int(request.query_params.get('limite', LIMITE_DEFECTO))
+    except (TypeError, ValueError):
+        return LIMITE_DEFECTO
+    if limite < 1:
+        return LIMITE_DEFECTO
+    return min(limite, LIMITE_MAXIMO)
+
+
+def posicion_inicial(queryset, request):
+    """
+    Posición (actualizado_en, id) desde la que se leen los cambios.
+
+    Se toma de ?cursor= (devuelto por una llamada anterior) o de ?desde=<fecha ISO>;
+    sin ninguno de los dos se sincroniza desde el principio.
+    """
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        model_field = queryset.model._meta.get_field(CAMPO_CAMBIOS)
+        valor, pk, _ = decodificar_cursor(cursor, CAMPO_CAMBIOS, model_field)
+        return valor, pk
+
+    desde = request.query_params.get('desde')
+    if desde:
+        valor = parse_datetime(desde.replace(' ', '+'))
+        if valor is None:
+            raise CursorInvalido('El parámetro desde debe ser una fecha y hora ISO 8601')
+        # Incluir todo lo modificado en el mismo instante de `desde` o después
+        return valor, 0
+    return None, None
+
+
+def cambios_desde(queryset, request):
+    """
+    Retorna (registros, cursor siguiente, hay_mas) con las filas modificadas después del cursor.
+
+    El recorrido es por llave sobre el índice (actualizado_en, id), sin COUNT ni OFFSET.
+    Incluye las filas dadas de baja (activo=False) para que el cliente las elimine.
+    El cursor siguiente se devuelve siempre, aunque no haya más cambios, para que el
+    cliente lo guarde y lo envíe en su próxima sincronización.
+    """
+    valor, pk = posicion_inicial(queryset, request)
+    limite = obtener_limite(request)
+
+    if valor is not None:
+        queryset = queryset.filter(
+            Q(**{f'{CAMPO_CAMBIOS}__gt': valor}) | Q(**{CAMPO_CAMBIOS: valor, 'id__gt': pk})
+        )
+
+    queryset = queryset.annotate(valor_cursor=F(CAMPO_CAMBIOS)).order_by(CAMPO_CAMBIOS, 'id')
+    registros = list(queryset[:limite + 1])
+    hay_mas = len(registros) > limite
+    registros = registros[:limite]
+
+    if registros:
+        ultimo = registros[-1]
+        siguiente = codificar_cursor(CAMPO_CAMBIOS, ultimo.valor_cursor, ultimo.pk, False)
+    elif valor is not None:
+        siguiente = codificar_cursor(CAMPO_CAMBIOS, valor, pk, False)
+    else:
+        siguiente = None
+    return registros, siguiente, hay_mas
+
+
+def serializar_cambios(registros, serializer_class, **kwargs):
+    """Serializa las filas activas completas y las dadas de baja como marcas de eliminación"""
+    activos = [registro for registro in registros if registro.activo]
+    datos = iter(serializer_class(activos, many=True, **kwargs).data)
+    cambios = []
+    for registro in registros:
+        if registro.activo:
+            cambios.append(next(datos))
+        else:
+            cambios.append({
+                'id': registro.pk,
+                'eliminado': True,
+                CAMPO_CAMBIOS: registro.valor_cursor,
+            })
+    return cambios
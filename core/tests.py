@@ -1,3 +1,1115 @@
+import asyncio
+import json
+from decimal import Decimal
+from io import StringIO
+from datetime import datetime, time, timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from users.models import Sucursal
+from .models import Paciente, CitaMedica, Diagnostico, SecuenciaCodigo, TerminoDiagnostico
+from rest_framework import serializers
+from .serializers import CitaMedicaListSerializer, DiagnosticoSerializer, DiagnosticoListSerializer
+from .agenda import restar_intervalos
+from .eventos import BrokerLocal, formatear_sse, obtener_broker
+from .refraccion import analizar_prescripcion
+from .analitica import distribucion_refraccion, parametros_analisis
+
+Usuario = get_user_model()
+
+
+class CoreTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.sucursal = Sucursal.objects.create(
+            nombre='Sucursal Centro',
+            direccion='Av. Principal 123',
+            telefono='5512345678'
+        )
+        self.usuario = Usuario.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            email='test@example.com',
+            nombre_completo='Usuario de Prueba',
+            sucursal=self.sucursal
+        )
+        response = self.client.post('/api/users/token/', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        })
+        self.token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def crear_paciente(self, **kwargs):
+        datos = {'nombre_completo': 'Paciente de Prueba', 'sucursal': self.sucursal}
+        datos.update(kwargs)
+        return Paciente.objects.create(**datos)
+
+
+class PaginacionCursorTests(CoreTestCase):
+    def test_recorre_pacientes_con_cursor(self):
+        """Test para recorrer todos los pacientes con paginación por cursor en ambas direcciones"""
+        for i in range(5):
+            self.crear_paciente(nombre_completo=f'Paciente {i}')
+
+        vistos = []
+        response = self.client.get('/api/core/pacientes/', {'paginacion': 'cursor', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('total_items', response.data['pagination'])
+        vistos += [p['id'] for p in response.data['results']]
+        while response.data['pagination']['next_cursor']:
+            siguiente = response.data['pagination']['next_cursor']
+            response = self.client.get('/api/core/pacientes/', {'cursor': siguiente, 'page_size': 2})
+            vistos += [p['id'] for p in response.data['results']]
+
+        esperados = list(Paciente.objects.order_by('-creado_en', '-id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperados)
+
+        anterior = response.data['pagination']['previous_cursor']
+        response = self.client.get('/api/core/pacientes/', {'cursor': anterior, 'page_size': 2})
+        self.assertEqual([p['id'] for p in response.data['results']], esperados[2:4])
+
+    def test_cursor_invalido(self):
+        """Test para verificar que un cursor inválido devuelve error"""
+        response = self.client.get('/api/core/citas/', {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_paginacion_por_pagina_se_mantiene(self):
+        """Test para verificar que la paginación por página sigue disponible"""
+        self.crear_paciente()
+        response = self.client.get('/api/core/pacientes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pagination']['total_items'], 1)
+
+
+class CodigoPacienteTests(TestCase):
+    def test_codigos_consecutivos(self):
+        """Test para verificar que los códigos se asignan en orden consecutivo"""
+        primero = Paciente.objects.create(nombre_completo='Primero')
+        segundo = Paciente.objects.create(nombre_completo='Segundo')
+        self.assertEqual(primero.codigo_paciente, 'VOR-00001')
+        self.assertEqual(segundo.codigo_paciente, 'VOR-00002')
+
+    def test_secuencia_continua_despues_de_99999(self):
+        """Test para verificar que la secuencia inicial respeta el orden numérico y no el de texto"""
+        Paciente.objects.create(nombre_completo='Antiguo', codigo_paciente='VOR-99999')
+        Paciente.objects.create(nombre_completo='Reciente', codigo_paciente='VOR-100000')
+        nuevo = Paciente.objects.create(nombre_completo='Nuevo')
+        self.assertEqual(nuevo.codigo_paciente, 'VOR-100001')
+
+    def test_reservar_bloque_de_codigos(self):
+        """Test para reservar un bloque de códigos para inserciones masivas"""
+        codigos = Paciente.reservar_codigos_paciente(3)
+        self.assertEqual(codigos, ['VOR-00001', 'VOR-00002', 'VOR-00003'])
+        self.assertEqual(SecuenciaCodigo.objects.get(nombre='VOR').valor, 3)
+
+
+class BusquedaPacientesTests(CoreTestCase):
+    def test_busqueda_sin_acentos(self):
+        """Test para verificar que la búsqueda ignora acentos y mayúsculas"""
+        jose = self.crear_paciente(nombre_completo='José Pérez')
+        self.crear_paciente(nombre_completo='María López')
+        response = self.client.get('/api/core/pacientes/', {'search': 'jose perez'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in response.data['results']], [jose.id])
+
+    def test_busqueda_por_telefono(self):
+        """Test para buscar pacientes por los dígitos de su teléfono"""
+        paciente = self.crear_paciente(telefono='+52 55-1234-5678')
+        response = self.client.get('/api/core/pacientes/', {'search': '1234 5678'})
+        self.assertEqual([p['id'] for p in response.data['results']], [paciente.id])
+
+    def test_indice_se_actualiza_al_guardar(self):
+        """Test para verificar que el índice refleja los cambios del paciente"""
+        paciente = self.crear_paciente(nombre_completo='Ana Gómez')
+        paciente.nombre_completo = 'Ana Ruiz'
+        paciente.save()
+        response = self.client.get('/api/core/pacientes/', {'search': 'gomez'})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/core/pacientes/', {'search': 'ruiz'})
+        self.assertEqual([p['id'] for p in response.data['results']], [paciente.id])
+
+
+class ContactoNormalizadoTests(CoreTestCase):
+    def test_guarda_contacto_normalizado(self):
+        """Test para verificar que se guardan teléfono y correo normalizados"""
+        paciente = self.crear_paciente(telefono='+52 55-1234-5678', correo='Ana.Ruiz@Example.com')
+        self.assertEqual(paciente.telefono_normalizado, '525512345678')
+        self.assertEqual(paciente.correo_normalizado, 'ana.ruiz@example.com')
+
+    def test_busqueda_exacta_por_telefono(self):
+        """Test para buscar un paciente por teléfono exacto en cualquier formato"""
+        paciente = self.crear_paciente(telefono='55 1234 5678')
+        self.crear_paciente(telefono='55 1234 5679')
+        response = self.client.get('/api/core/pacientes/', {'telefono': '55-1234-5678'})
+        self.assertEqual([p['id'] for p in response.data['results']], [paciente.id])
+
+    def test_correo_duplicado_sin_importar_mayusculas(self):
+        """Test para verificar que no se repite un correo con distintas mayúsculas"""
+        self.crear_paciente(correo='ana@example.com')
+        response = self.client.post('/api/core/pacientes/crear/', {
+            'nombre_completo': 'Otra Ana',
+            'correo': 'ANA@example.com'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportacionPacientesTests(CoreTestCase):
+    def test_importar_csv(self):
+        """Test para importar pacientes desde CSV con reporte de errores por fila"""
+        self.crear_paciente(correo='existente@example.com')
+        contenido = (
+            'nombre_completo,telefono,correo,fecha_nacimiento\n'
+            'José Pérez,5512345678,jose@example.com,1980-05-01\n'
+            ',5512345678,,\n'
+            'Duplicado,,existente@example.com,\n'
+            'Ana Ruiz,,,\n'
+        ).encode()
+        archivo = SimpleUploadedFile('pacientes.csv', contenido, content_type='text/csv')
+        response = self.client.post(
+            '/api/core/pacientes/importar/',
+            {'archivo': archivo, 'sucursal': self.sucursal.id},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['importados'], 2)
+        self.assertEqual([e['fila'] for e in response.data['errores']], [3, 4])
+
+        jose = Paciente.objects.get(nombre_completo='José Pérez')
+        self.assertEqual(jose.codigo_paciente, 'VOR-00002')
+        self.assertEqual(jose.sucursal, self.sucursal)
+        self.assertTrue(jose.trigramas.exists())
+
+    def test_importar_ndjson(self):
+        """Test para importar pacientes desde NDJSON"""
+        contenido = (
+            '{"nombre_completo": "María López", "genero": "F"}\n'
+            'esto no es json\n'
+        ).encode()
+        archivo = SimpleUploadedFile('pacientes.ndjson', contenido)
+        response = self.client.post('/api/core/pacientes/importar/', {'archivo': archivo}, format='multipart')
+        self.assertEqual(response.data['importados'], 1)
+        self.assertEqual(response.data['errores'][0]['fila'], 2)
+
+
+class ExportacionTests(CoreTestCase):
+    def test_exportar_pacientes_csv(self):
+        """Test para exportar pacientes en CSV respetando los filtros del listado"""
+        self.crear_paciente(nombre_completo='Ana Ruiz', genero='F')
+        self.crear_paciente(nombre_completo='Luis Mora', genero='M')
+        response = self.client.get('/api/core/pacientes/exportar/', {'genero': 'F'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lineas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lineas[0].startswith('id,codigo_paciente,nombre_completo'))
+        self.assertEqual(len(lineas), 2)
+        self.assertIn('Ana Ruiz', lineas[1])
+
+    def test_exportar_diagnosticos_ndjson_aplana_datos_clinicos(self):
+        """Test para exportar diagnósticos con los datos clínicos como columnas"""
+        paciente = self.crear_paciente()
+        Diagnostico.objects.create(
+            paciente=paciente,
+            sucursal=self.sucursal,
+            fecha_hora_consulta=timezone.now(),
+            datos_clinicos={'rx_final': 'OD: -1.00'}
+        )
+        response = self.client.get('/api/core/diagnosticos/exportar/', {'formato': 'ndjson'})
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(filas[0]['rx_final'], 'OD: -1.00')
+        self.assertEqual(filas[0]['retinoscopia'], '')
+        self.assertNotIn('datos_clinicos', filas[0])
+
+    def test_exportar_recorre_bloques_por_llave(self):
+        """Test para exportar todos los registros cuando ocupan varios bloques"""
+        from unittest import mock
+
+        ids = [self.crear_paciente(nombre_completo=f'Paciente {i}').id for i in range(5)]
+        with mock.patch('core.exportacion.TAMANO_BLOQUE', 2):
+            response = self.client.get('/api/core/pacientes/exportar/', {'formato': 'ndjson'})
+            filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([fila['id'] for fila in filas], ids)
+
+
+class ResumenPacienteTests(CoreTestCase):
+    def test_resumen_con_consultas_fijas(self):
+        """Test para obtener el resumen del paciente con un número fijo de consultas"""
+        paciente = self.crear_paciente()
+        ahora = timezone.now()
+        for dias in range(1, 4):
+            CitaMedica.objects.create(
+                paciente=paciente, sucursal=self.sucursal,
+                fecha_hora=ahora + timedelta(days=dias), doctor_asignado=self.usuario
+            )
+            Diagnostico.objects.create(
+                paciente=paciente, sucursal=self.sucursal, usuario_creacion=self.usuario,
+                fecha_hora_consulta=ahora - timedelta(days=dias),
+                datos_clinicos={'rx_final': f'OD: -{dias}.00'},
+                proximo_control=(ahora + timedelta(days=30 * dias)).date()
+            )
+        CitaMedica.objects.create(
+            paciente=paciente, sucursal=self.sucursal,
+            fecha_hora=ahora + timedelta(days=5), estado='cancelada'
+        )
+
+        # 1 consulta de autenticación + paciente + citas + diagnósticos
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/core/pacientes/{paciente.id}/resumen/', {'limite': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['proximas_citas']), 2)
+        self.assertEqual(len(response.data['ultimos_diagnosticos']), 2)
+        self.assertEqual(response.data['ultima_rx_final'], 'OD: -1.00')
+        self.assertEqual(response.data['proximo_control_pendiente'], (ahora + timedelta(days=30)).date())
+
+
+class SeleccionCamposTests(CoreTestCase):
+    def test_fields_limita_la_respuesta(self):
+        """Test para seleccionar campos del listado de pacientes con ?fields="""
+        self.crear_paciente()
+        response = self.client.get('/api/core/pacientes/', {'fields': 'id,nombre_completo'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'nombre_completo'})
+
+    def test_exclude_en_detalle_de_diagnostico(self):
+        """Test para excluir campos del detalle de un diagnóstico con ?exclude="""
+        diagnostico = Diagnostico.objects.create(
+            paciente=self.crear_paciente(), sucursal=self.sucursal,
+            fecha_hora_consulta=timezone.now(), datos_clinicos={'rx_final': 'OD: -1.00'}
+        )
+        response = self.client.get(
+            f'/api/core/diagnosticos/{diagnostico.id}/',
+            {'exclude': 'datos_clinicos,paciente_nombre'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('datos_clinicos', response.data)
+        self.assertNotIn('paciente_nombre', response.data)
+        self.assertEqual(response.data['rx_final'], 'OD: -1.00')
+
+    def test_optimizar_queryset_omite_relaciones_no_solicitadas(self):
+        """Test para verificar que el SQL solo une las relaciones de los campos pedidos"""
+        queryset = CitaMedicaListSerializer.optimizar_queryset(
+            CitaMedica.objects.select_related('paciente', 'doctor_asignado', 'usuario_creacion', 'sucursal'),
+            campos=['id', 'estado', 'sucursal_nombre']
+        )
+        sql = str(queryset.query)
+        self.assertNotIn('core_paciente', sql)
+        self.assertIn('users_sucursal', sql)
+
+
+class AgendaDoctorTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.paciente = self.crear_paciente()
+        self.inicio = (timezone.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+        self.cita = CitaMedica.objects.create(
+            paciente=self.paciente, sucursal=self.sucursal,
+            fecha_hora=self.inicio, duracion_minutos=30, doctor_asignado=self.usuario
+        )
+
+    def crear_cita(self, fecha_hora, **kwargs):
+        datos = {
+            'paciente': self.paciente.id,
+            'sucursal': self.sucursal.id,
+            'doctor_asignado': self.usuario.id,
+            'fecha_hora': fecha_hora.isoformat(),
+        }
+        datos.update(kwargs)
+        return self.client.post('/api/core/citas/crear/', datos)
+
+    def test_rechaza_cita_superpuesta(self):
+        """Test para rechazar una cita que se cruza con otra del mismo doctor"""
+        response = self.crear_cita(self.inicio + timedelta(minutes=15))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fecha_hora', response.data['error'])
+
+    def test_acepta_cita_contigua(self):
+        """Test para aceptar una cita que empieza cuando termina la anterior"""
+        response = self.crear_cita(self.inicio + timedelta(minutes=30), duracion_minutos=45)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['duracion_minutos'], 45)
+
+    def test_cita_cancelada_libera_horario(self):
+        """Test para verificar que una cita cancelada no ocupa la agenda"""
+        self.cita.estado = 'cancelada'
+        self.cita.save()
+        response = self.crear_cita(self.inicio)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_reagendar_a_horario_ocupado(self):
+        """Test para rechazar el reagendado de una cita a un horario ocupado"""
+        otra = CitaMedica.objects.create(
+            paciente=self.paciente, sucursal=self.sucursal,
+            fecha_hora=self.inicio + timedelta(hours=2), doctor_asignado=self.usuario
+        )
+        response = self.client.post(f'/api/core/citas/{otra.id}/cambiar-estado/', {
+            'nuevo_estado': 'reagendada',
+            'nueva_fecha_hora': (self.inicio + timedelta(minutes=10)).isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReprogramacionCitasTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.paciente = self.crear_paciente()
+        self.suplente = Usuario.objects.create_user(
+            username='suplente', password='testpass123', email='suplente@example.com',
+            nombre_completo='Doctor Suplente', sucursal=self.sucursal
+        )
+        self.inicio = (timezone.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        self.citas = [
+            CitaMedica.objects.create(
+                paciente=self.paciente, sucursal=self.sucursal, doctor_asignado=self.usuario,
+                fecha_hora=self.inicio + timedelta(hours=i)
+            )
+            for i in range(3)
+        ]
+
+    def reprogramar(self, **kwargs):
+        datos = {
+            'doctor': self.usuario.id,
+            'sucursal': self.sucursal.id,
+            'desde': self.inicio.isoformat(),
+            'hasta': (self.inicio + timedelta(hours=12)).isoformat(),
+        }
+        datos.update(kwargs)
+        return self.client.post('/api/core/citas/reprogramar/', datos, format='json')
+
+    def test_reasigna_citas_a_otro_doctor(self):
+        """Test para pasar todas las citas del día a otro doctor"""
+        response = self.reprogramar(nuevo_doctor=self.suplente.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['citas_actualizadas'], 3)
+        self.assertEqual(CitaMedica.objects.filter(doctor_asignado=self.suplente).count(), 3)
+
+    def test_conflicto_no_modifica_ninguna_cita(self):
+        """Test para rechazar la reprogramación completa si una cita se cruza"""
+        ocupada = CitaMedica.objects.create(
+            paciente=self.paciente, sucursal=self.sucursal, doctor_asignado=self.suplente,
+            fecha_hora=self.inicio + timedelta(hours=2, minutes=15)
+        )
+        response = self.reprogramar(nuevo_doctor=self.suplente.id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['conflictos'], [{'cita': self.citas[2].id, 'se_cruza_con': ocupada.id}])
+        self.assertEqual(CitaMedica.objects.filter(doctor_asignado=self.usuario).count(), 3)
+
+    def test_conflicto_con_cita_larga_que_termina_al_final(self):
+        """Test para detectar cruces en el tramo de una cita previa más larga que la última"""
+        # Cita antigua traslapada (anterior a la validación de cruces): 10:00 a 13:00
+        CitaMedica.objects.filter(pk=self.citas[1].id).update(duracion_minutos=180)
+        ocupada = CitaMedica.objects.create(
+            paciente=self.paciente, sucursal=self.sucursal, doctor_asignado=self.suplente,
+            fecha_hora=self.inicio + timedelta(hours=3, minutes=30)
+        )
+        response = self.reprogramar(nuevo_doctor=self.suplente.id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['conflictos'], [{'cita': self.citas[1].id, 'se_cruza_con': ocupada.id}])
+
+    def test_desplaza_citas(self):
+        """Test para correr las citas un día y marcarlas como reagendadas"""
+        response = self.reprogramar(desplazamiento_minutos=24 * 60)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cita = CitaMedica.objects.get(pk=self.citas[0].id)
+        self.assertEqual(cita.fecha_hora, self.inicio + timedelta(days=1))
+        self.assertEqual(cita.estado, 'reagendada')
+
+class DisponibilidadTests(CoreTestCase):
+    def test_restar_intervalos(self):
+        """Test para restar citas ocupadas de las ventanas de atención"""
+        base = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        h = lambda horas: base + timedelta(hours=horas)
+        ventanas = [(h(9), h(13)), (h(33), h(37))]
+        ocupados = [(h(8), h(10)), (h(11), h(11.5)), (h(11.25), h(12)), (h(36), h(38))]
+        self.assertEqual(
+            restar_intervalos(ventanas, ocupados),
+            [(h(10), h(11)), (h(12), h(13)), (h(33), h(36))]
+        )
+
+    def test_disponibilidad_por_doctor(self):
+        """Test para obtener los horarios libres de un doctor excluyendo sus citas"""
+        manana = (timezone.localtime() + timedelta(days=1)).date()
+        while manana.weekday() == 6:
+            manana += timedelta(days=1)
+        inicio = timezone.make_aware(datetime.combine(manana, time(10, 0)))
+        CitaMedica.objects.create(
+            paciente=self.crear_paciente(), sucursal=self.sucursal,
+            fecha_hora=inicio, duracion_minutos=60, doctor_asignado=self.usuario
+        )
+        response = self.client.get('/api/core/citas/disponibilidad/', {
+            'doctor': self.usuario.id,
+            'fecha_desde': manana.isoformat(),
+            'duracion': 60,
+            'hora_inicio': '09:00',
+            'hora_fin': '12:00',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        horarios = response.data['doctores'][0]['horarios']
+        self.assertEqual(
+            [timezone.localtime(h['inicio']).hour for h in horarios],
+            [9, 11]
+        )
+
+
+class TransicionesCitaTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        paciente = self.crear_paciente()
+        inicio = timezone.now() + timedelta(days=2)
+        self.citas = [
+            CitaMedica.objects.create(
+                paciente=paciente, sucursal=self.sucursal,
+                fecha_hora=inicio + timedelta(hours=i), estado=estado
+            )
+            for i, estado in enumerate(['creada', 'reagendada', 'finalizada'])
+        ]
+
+    def test_cambio_estado_masivo(self):
+        """Test para confirmar varias citas con una sola actualización y reportar cada id"""
+        ids = [cita.id for cita in self.citas] + [999999]
+        response = self.client.post(
+            '/api/core/citas/cambiar-estado/',
+            {'ids': ids, 'nuevo_estado': 'confirmada'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['actualizadas'], 2)
+        self.assertEqual(
+            [r['resultado'] for r in response.data['resultados']],
+            ['actualizada', 'actualizada', 'transicion_invalida', 'no_encontrada']
+        )
+        self.assertEqual(
+            list(CitaMedica.objects.filter(id__in=ids).order_by('id').values_list('estado', flat=True)),
+            ['confirmada', 'confirmada', 'finalizada']
+        )
+
+    def test_transicion_invalida_individual(self):
+        """Test para rechazar una transición que no está en la tabla"""
+        response = self.client.post(
+            f'/api/core/citas/{self.citas[2].id}/cambiar-estado/',
+            {'nuevo_estado': 'cancelada'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'No se puede cancelar esta cita en su estado actual')
+
+
+class SincronizacionTests(CoreTestCase):
+    def test_cambios_incrementales_con_bajas(self):
+        """Test para sincronizar pacientes por cursor incluyendo los dados de baja"""
+        pacientes = [self.crear_paciente(nombre_completo=f'Paciente {i}') for i in range(3)]
+        response = self.client.get('/api/core/pacientes/cambios/', {'limite': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in response.data['results']], [pacientes[0].id, pacientes[1].id])
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get('/api/core/pacientes/cambios/', {'cursor': response.data['next_cursor']})
+        self.assertEqual([p['id'] for p in response.data['results']], [pacientes[2].id])
+        self.assertFalse(response.data['has_more'])
+        cursor = response.data['next_cursor']
+
+        pacientes[0].activo = False
+        pacientes[0].save()
+        response = self.client.get('/api/core/pacientes/cambios/', {'cursor': cursor})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], pacientes[0].id)
+        self.assertTrue(response.data['results'][0]['eliminado'])
+
+        response = self.client.get('/api/core/pacientes/cambios/', {'cursor': response.data['next_cursor']})
+        self.assertEqual(response.data['results'], [])
+
+    def test_cambios_desde_fecha(self):
+        """Test para sincronizar citas a partir de una fecha"""
+        cita = CitaMedica.objects.create(
+            paciente=self.crear_paciente(), sucursal=self.sucursal,
+            fecha_hora=timezone.now() + timedelta(days=1)
+        )
+        desde = (cita.actualizado_en - timedelta(seconds=1)).isoformat()
+        response = self.client.get('/api/core/citas/cambios/', {'desde': desde})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['id'] for c in response.data['results']], [cita.id])
+
+        response = self.client.get('/api/core/citas/cambios/', {'desde': 'ayer'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class EventosAgendaTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def suscribir(self, broker, sucursal_id):
+        async def crear():
+            return broker.suscribir(sucursal_id)
+        return self.loop.run_until_complete(crear())
+
+    def recibir(self, suscripcion):
+        return self.loop.run_until_complete(suscripcion.siguiente(timeout=1))
+
+    def test_broker_reparte_por_sucursal(self):
+        """Test para entregar los eventos solo a los clientes de la misma sucursal"""
+        broker = BrokerLocal()
+        propia = self.suscribir(broker, 1)
+        otra = self.suscribir(broker, 2)
+        broker.publicar(1, {'tipo': 'cita_creada', 'datos': {'id': 7}})
+        self.assertEqual(self.recibir(propia)['datos'], {'id': 7})
+        self.assertTrue(otra.cola.empty())
+        self.assertEqual(
+            formatear_sse({'tipo': 'cita_creada', 'datos': {'id': 7}}),
+            'event: cita_creada\ndata: {"id": 7}\n\n'
+        )
+
+    def test_cambio_estado_publica_evento(self):
+        """Test para publicar el cambio de estado de una cita al confirmarse la transacción"""
+        cita = CitaMedica.objects.create(
+            paciente=self.crear_paciente(), sucursal=self.sucursal,
+            fecha_hora=timezone.now() + timedelta(days=1)
+        )
+        broker = obtener_broker()
+        suscripcion = self.suscribir(broker, self.sucursal.id)
+        self.addCleanup(broker.cancelar, suscripcion)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/core/citas/{cita.id}/cambiar-estado/', {'nuevo_estado': 'confirmada'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        evento = self.recibir(suscripcion)
+        self.assertEqual(evento['tipo'], 'cita_actualizada')
+        self.assertEqual(evento['datos']['id'], cita.id)
+        self.assertEqual(evento['datos']['estado'], 'confirmada')
+
+    def test_editar_y_eliminar_cita_publican_evento(self):
+        """Test para publicar la edición y la eliminación de una cita en el tablero de su sucursal"""
+        cita = CitaMedica.objects.create(
+            paciente=self.crear_paciente(), sucursal=self.sucursal,
+            fecha_hora=timezone.now() + timedelta(days=1)
+        )
+        broker = obtener_broker()
+        suscripcion = self.suscribir(broker, self.sucursal.id)
+        self.addCleanup(broker.cancelar, suscripcion)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                f'/api/core/citas/{cita.id}/actualizar/', {'comentarios': 'Llega tarde'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        evento = self.recibir(suscripcion)
+        self.assertEqual((evento['tipo'], evento['datos']['id']), ('cita_actualizada', cita.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/core/citas/{cita.id}/eliminar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.recibir(suscripcion)['tipo'], 'cita_eliminada')
+
+
+
+class BusquedaDiagnosticosTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.paciente = self.crear_paciente(nombre_completo='Lucía Fernández')
+        self.diagnostico = Diagnostico.objects.create(
+            paciente=self.paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+            datos_clinicos={
+                'rx_final': 'OD: +2.25 -0.75 x 90°',
+                'diagnostico_tratamiento': 'Catarata incipiente en ojo izquierdo',
+            }
+        )
+
+    def buscar(self, termino):
+        response = self.client.get('/api/core/diagnosticos/', {'search': termino})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [d['id'] for d in response.data['results']]
+
+    def test_busca_por_datos_clinicos_indexados(self):
+        """Test para buscar por palabras y valores de los datos clínicos sin importar acentos"""
+        self.assertEqual(self.buscar('CATARATA izq'), [self.diagnostico.id])
+        self.assertEqual(self.buscar('2.25'), [self.diagnostico.id])
+        self.assertEqual(self.buscar('Fernández'), [self.diagnostico.id])
+        self.assertEqual(self.buscar('fernandez'), [self.diagnostico.id])
+        self.assertEqual(self.buscar('glaucoma'), [])
+
+    def test_indice_se_actualiza_al_editar(self):
+        """Test para mantener sincronizado el índice al modificar los datos clínicos"""
+        self.diagnostico.datos_clinicos['diagnostico_tratamiento'] = 'Glaucoma'
+        self.diagnostico.save(update_fields=['datos_clinicos'])
+        self.assertEqual(self.buscar('glaucoma'), [self.diagnostico.id])
+        self.assertEqual(self.buscar('catarata'), [])
+        self.assertIn('glaucoma', TerminoDiagnostico.objects.filter(
+            diagnostico=self.diagnostico
+        ).values_list('termino', flat=True))
+
+
+
+class RefraccionTests(CoreTestCase):
+    def test_analiza_prescripcion(self):
+        """Test para extraer esfera, cilindro, eje y adición de cada ojo"""
+        resultado = analizar_prescripcion('OD: +2.25 -0.75 x 90° / OI: plano -1,50 x 180 ADD +1.50')
+        self.assertEqual(resultado['OD'], {
+            'esfera': Decimal('2.25'), 'cilindro': Decimal('-0.75'), 'eje': 90, 'adicion': Decimal('1.50')
+        })
+        self.assertEqual(resultado['OI'], {
+            'esfera': Decimal('0.00'), 'cilindro': Decimal('-1.50'), 'eje': 180, 'adicion': Decimal('1.50')
+        })
+        self.assertEqual(set(analizar_prescripcion('AO -3.00')), {'OD', 'OI'})
+        self.assertEqual(analizar_prescripcion('Sin cambios'), {})
+
+    def test_filtra_por_cilindro(self):
+        """Test para filtrar diagnósticos por rango de cilindro de la rx final"""
+        paciente = self.crear_paciente()
+        alto = Diagnostico.objects.create(
+            paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+            datos_clinicos={'rx_final': 'OD: -1.00 -2.50 x 10 OI: -1.00 -0.50 x 170'}
+        )
+        Diagnostico.objects.create(
+            paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+            datos_clinicos={'rx_final': 'OD: -1.00 -0.25 x 10'}
+        )
+        response = self.client.get('/api/core/diagnosticos/', {'cilindro_hasta': '-2.00'})
+        self.assertEqual([d['id'] for d in response.data['results']], [alto.id])
+        self.assertEqual(alto.refracciones.count(), 2)
+
+
+
+class AnaliticaRefraccionTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        hoy = timezone.localdate()
+        joven = self.crear_paciente(fecha_nacimiento=hoy.replace(year=hoy.year - 25))
+        mayor = self.crear_paciente(fecha_nacimiento=hoy.replace(year=hoy.year - 65))
+        for paciente, rx in [(joven, 'OD: -2.00'), (joven, 'OD: -3.00'), (mayor, 'OD: +1.50 ADD +2.00')]:
+            Diagnostico.objects.create(
+                paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+                tipo_lente='monofocal', datos_clinicos={'rx_final': rx}
+            )
+
+    def test_distribucion_por_rango_edad(self):
+        """Test para calcular percentiles e histograma de la esfera por rango de edad"""
+        response = self.client.get('/api/core/diagnosticos/analitica/refraccion/', {'variable': 'esfera'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+        grupos = {g['grupo']: g for g in response.data['grupos']}
+        self.assertEqual(list(grupos), ['20-39', '60+'])
+        self.assertEqual(grupos['20-39']['cantidad'], 2)
+        self.assertEqual(grupos['20-39']['percentiles']['p50'], -2.5)
+        self.assertEqual(sum(b['cantidad'] for b in grupos['20-39']['histograma']), 2)
+
+    def test_resultado_en_cache_y_parametros_invalidos(self):
+        """Test para reutilizar el resultado en caché y rechazar parámetros desconocidos"""
+        cache.clear()
+        params = {'variable': 'adicion', 'agrupar_por': 'tipo_lente'}
+        primera = self.client.get('/api/core/diagnosticos/analitica/refraccion/', params)
+        with self.assertNumQueries(0):
+            segunda = distribucion_refraccion(parametros_analisis(params))
+        self.assertEqual(primera.data['grupos'], segunda['grupos'])
+        self.assertEqual(segunda['grupos'][0]['grupo_nombre'], 'Monofocal')
+
+        response = self.client.get('/api/core/diagnosticos/analitica/refraccion/', {'agrupar_por': 'color'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class RepresentacionRapidaTests(CoreTestCase):
+    def test_coincide_con_serializacion_drf(self):
+        """Test para verificar que la serialización rápida produce la misma salida que DRF"""
+        diagnosticos = [
+            Diagnostico.objects.create(
+                paciente=self.crear_paciente(), sucursal=self.sucursal, usuario_creacion=self.usuario,
+                fecha_hora_consulta=timezone.now(), tipo_lente='progresivo',
+                proximo_control=timezone.localdate() + timedelta(days=3),
+                datos_clinicos={'rx_final': 'OD: -1.00', 'agudeza_visual': None, 'retinoscopia': 2}
+            ),
+            # Sin usuario de creación ni datos clínicos: DRF omite el nombre del usuario
+            Diagnostico.objects.create(
+                paciente=self.crear_paciente(), sucursal=self.sucursal, fecha_hora_consulta=timezone.now()
+            ),
+        ]
+        serializadores = [
+            DiagnosticoSerializer(), DiagnosticoListSerializer(), DiagnosticoSerializer(campos=['id', 'rx_final'])
+        ]
+        for serializer in serializadores:
+            for diagnostico in Diagnostico.objects.filter(id__in=[d.id for d in diagnosticos]):
+                self.assertEqual(
+                    serializer.to_representation(diagnostico),
+                    serializers.Serializer.to_representation(serializer, diagnostico)
+                )
+
+
+
+class ProgresionRxTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        hoy = timezone.localdate()
+        self.nino = self.crear_paciente(fecha_nacimiento=hoy.replace(year=hoy.year - 10))
+        self.adulto = self.crear_paciente(fecha_nacimiento=hoy.replace(year=hoy.year - 40))
+        inicio = timezone.now() - timedelta(days=730)
+        for paciente, valores in [(self.nino, ['-1.00', '-1.50', '-2.25']), (self.adulto, ['-3.00', '-3.00'])]:
+            for i, esfera in enumerate(valores):
+                Diagnostico.objects.create(
+                    paciente=paciente, sucursal=self.sucursal,
+                    fecha_hora_consulta=inicio + timedelta(days=365 * i),
+                    datos_clinicos={'rx_final': f'OD: {esfera} -0.50 x 180'}
+                )
+
+    def test_progresion_paciente(self):
+        """Test para obtener la diferencia de esfera entre visitas consecutivas"""
+        response = self.client.get(f'/api/core/pacientes/{self.nino.id}/progresion-rx/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        visitas = response.data['visitas']
+        self.assertEqual([v['delta_esfera'] for v in visitas], [None, Decimal('-0.50'), Decimal('-0.75')])
+        self.assertEqual(visitas[1]['esfera_anterior'], Decimal('-1.00'))
+        self.assertEqual(visitas[1]['dias_desde_anterior'], 365)
+
+    def test_progresion_cohorte_por_edad(self):
+        """Test para resumir la progresión de una cohorte de niños miopes"""
+        response = self.client.get('/api/core/diagnosticos/progresion-rx/', {
+            'edad_max': 17, 'miopia': 'true', 'sucursal': self.sucursal.id
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pacientes'], 1)
+        self.assertEqual(response.data['resumen']['OD']['intervalos'], 2)
+        self.assertEqual(response.data['resumen']['OD']['delta_esfera_promedio'], -0.62)
+
+    def test_progresion_cohorte_sucursal_invalida(self):
+        """Test para rechazar una sucursal no numérica con 400 en lugar de un error del servidor"""
+        response = self.client.get('/api/core/diagnosticos/progresion-rx/', {'sucursal': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EsquemaClinicoTests(CoreTestCase):
+    def test_crear_diagnostico_rechaza_datos_clinicos_invalidos(self):
+        """Test para rechazar valores no textuales o demasiado largos en datos clínicos"""
+        paciente = self.crear_paciente()
+        response = self.client.post('/api/core/diagnosticos/crear/', {
+            'paciente': paciente.id,
+            'sucursal': self.sucursal.id,
+            'fecha_hora_consulta': timezone.now().isoformat(),
+            'datos_clinicos': {'rx_final': 'x' * 501, 'anamnesis': 5},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Diagnostico.objects.exists())
+
+    def test_validar_estructura_rechaza_subarbol_grande(self):
+        """Test para contar el tamaño real de los valores anidados en campos no reconocidos"""
+        response = self.client.post('/api/core/diagnosticos/validar-estructura/', {
+            'datos_clinicos': {'extra': [{'nota': 'x' * 1000}] * 40},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('datos_clinicos', response.data['errores'])
+
+    def test_validar_lote_diagnosticos(self):
+        """Test para validar un lote con resultados por índice"""
+        paciente = self.crear_paciente()
+        base = {'paciente': paciente.id, 'sucursal': self.sucursal.id, 'fecha_hora_consulta': timezone.now().isoformat()}
+        response = self.client.post('/api/core/diagnosticos/validar-lote/', {'diagnosticos': [
+            dict(base, datos_clinicos={'rx_final': 'OD: -1.00'}),
+            dict(base, paciente=99999),
+            dict(base, datos_clinicos={'campo_extra': 'x'}),
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['validos'], 1)
+        self.assertIn('paciente', response.data['resultados'][1]['errores'])
+        self.assertIn('campo_extra', response.data['resultados'][2]['errores'])
+
+    def test_validar_lote_usa_las_reglas_de_creacion(self):
+        """Test para aceptar IDs como texto y rechazar fechas y opciones inválidas como crear_diagnostico"""
+        paciente = self.crear_paciente()
+        base = {
+            'paciente': str(paciente.id), 'sucursal': str(self.sucursal.id),
+            'fecha_hora_consulta': timezone.now().isoformat(),
+        }
+        # Usuario autenticado, pacientes y sucursales del lote
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/core/diagnosticos/validar-lote/', {'diagnosticos': [
+                base,
+                dict(base, fecha_hora_consulta='no-es-fecha', tipo_lente='zzz'),
+            ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['resultados'][0]['valido'])
+        errores = response.data['resultados'][1]['errores']
+        self.assertIn('fecha_hora_consulta', errores)
+        self.assertIn('tipo_lente', errores)
+
+
+class DespachoRecordatoriosTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.diagnostico = Diagnostico.objects.create(
+            paciente=self.crear_paciente(correo='ana@example.com'), sucursal=self.sucursal,
+            fecha_hora_consulta=timezone.now(), proximo_control=timezone.localdate() + timedelta(days=3)
+        )
+
+    def test_despachar_envia_y_marca_recordatorio(self):
+        """Test para enviar los recordatorios vencidos una sola vez y marcar el diagnóstico"""
+        from django.core import mail
+        from .recordatorios import despachar_recordatorios, encolar_recordatorios
+
+        self.assertEqual(encolar_recordatorios(), 1)
+        self.assertEqual(encolar_recordatorios(), 0)
+        self.assertEqual(despachar_recordatorios()['enviados'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ana@example.com'])
+        self.diagnostico.refresh_from_db()
+        self.assertTrue(self.diagnostico.recordatorio_enviado)
+        self.assertEqual(despachar_recordatorios()['enviados'], 0)
+
+    def test_reintentos_con_espera_hasta_fallido(self):
+        """Test para reprogramar un envío fallido y marcarlo fallido al agotar los intentos"""
+        from .models import RecordatorioSaliente
+        from .recordatorios import despachar_recordatorios, encolar_recordatorios
+
+        class BackendCaido:
+            def enviar(self, recordatorios):
+                raise ConnectionError('SMTP no disponible')
+
+        encolar_recordatorios()
+        resumen = despachar_recordatorios(backend=BackendCaido(), maximo_intentos=2)
+        self.assertEqual(resumen['reintentos'], 1)
+        recordatorio = RecordatorioSaliente.objects.get()
+        self.assertEqual(recordatorio.intentos, 1)
+        self.assertGreater(recordatorio.siguiente_intento, timezone.now())
+
+        RecordatorioSaliente.objects.update(siguiente_intento=timezone.now())
+        self.assertEqual(despachar_recordatorios(backend=BackendCaido(), maximo_intentos=2)['fallidos'], 1)
+        self.assertEqual(RecordatorioSaliente.objects.get().estado, 'fallido')
+        self.diagnostico.refresh_from_db()
+        self.assertFalse(self.diagnostico.recordatorio_enviado)
+
+    def test_encolar_no_cuenta_los_ya_encolados_por_otro_proceso(self):
+        """Test para contar solo las filas insertadas cuando otro proceso encoló el mismo diagnóstico"""
+        from unittest import mock
+        from .models import RecordatorioSaliente
+        from .recordatorios import encolar_recordatorios
+
+        self.assertEqual(encolar_recordatorios(), 1)
+        # Simula que la consulta se leyó antes de que el otro proceso insertara
+        with mock.patch(
+            'core.recordatorios.diagnosticos_por_recordar', return_value=Diagnostico.objects.all()
+        ):
+            self.assertEqual(encolar_recordatorios(), 0)
+        self.assertEqual(RecordatorioSaliente.objects.count(), 1)
+
+    def test_sin_contacto_entregable_no_se_encola_ni_reintenta(self):
+        """Test para no encolar pacientes sin correo y marcar fallido sin reintentos un error permanente"""
+        from .models import RecordatorioSaliente
+        from .recordatorios import BackendCorreo, despachar_recordatorios, encolar_recordatorios
+
+        Diagnostico.objects.create(
+            paciente=self.crear_paciente(nombre_completo='Luis Sin Correo', telefono='5511112222'),
+            sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+            proximo_control=timezone.localdate() + timedelta(days=3)
+        )
+        self.assertEqual(encolar_recordatorios(backend=BackendCorreo()), 1)
+        self.assertEqual(RecordatorioSaliente.objects.get().destinatario, 'ana@example.com')
+
+        RecordatorioSaliente.objects.update(canal='telefono', destinatario='5511112222')
+        resumen = despachar_recordatorios(backend=BackendCorreo(), maximo_intentos=5)
+        self.assertEqual(resumen['fallidos'], 1)
+        self.assertEqual(resumen['reintentos'], 0)
+        self.assertEqual(RecordatorioSaliente.objects.get().estado, 'fallido')
+
+
+class ConfirmacionRecordatoriosTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        paciente = self.crear_paciente()
+        manana = timezone.localdate() + timedelta(days=1)
+        self.diagnosticos = [
+            Diagnostico.objects.create(
+                paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+                proximo_control=manana, recordatorio_enviado=enviado
+            )
+            for enviado in (False, False, True)
+        ]
+
+    def test_marcar_enviados_por_ids(self):
+        """Test para confirmar varios recordatorios con resultado por id"""
+        ids = [d.id for d in self.diagnosticos] + [99999]
+        response = self.client.post('/api/core/diagnosticos/recordatorios/marcar-enviados/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['marcados'], 2)
+        self.assertEqual(
+            [r['resultado'] for r in response.data['resultados']],
+            ['marcado', 'marcado', 'ya_enviado', 'no_encontrado']
+        )
+        self.assertFalse(Diagnostico.objects.filter(recordatorio_enviado=False).exists())
+
+    def test_marcar_enviados_por_filtro(self):
+        """Test para confirmar los recordatorios de una sucursal sin enviar la lista de ids"""
+        response = self.client.post(
+            '/api/core/diagnosticos/recordatorios/marcar-enviados/', {'sucursal': self.sucursal.id}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['marcados'], 2)
+        self.assertFalse(response.data['hay_mas'])
+
+
+class AnotacionRecordatorioTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        paciente = self.crear_paciente(telefono='5551234')
+        hoy = timezone.localdate()
+        for dias in (3, 20, -2):
+            Diagnostico.objects.create(
+                paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+                proximo_control=hoy + timedelta(days=dias)
+            )
+        Diagnostico.objects.create(paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now())
+
+    def test_anotaciones_coinciden_con_propiedades(self):
+        """Test para calcular en la base los mismos valores que las propiedades del modelo"""
+        from .recordatorios import anotar_recordatorio
+
+        for diagnostico in Diagnostico.objects.all():
+            anotado = anotar_recordatorio(Diagnostico.objects.all()).get(pk=diagnostico.pk)
+            self.assertEqual(anotado.necesita_recordatorio, diagnostico.necesita_recordatorio)
+            self.assertEqual(anotado.dias_hasta_proximo_control, diagnostico.dias_hasta_proximo_control)
+        self.assertEqual(
+            anotar_recordatorio(Diagnostico.objects.all()).filter(necesita_recordatorio=True).count(), 2
+        )
+
+    def test_recordatorios_pendientes_y_filtro_por_dias(self):
+        """Test para listar recordatorios ordenados y filtrar controles dentro de N días"""
+        response = self.client.get('/api/core/diagnosticos/recordatorios/', {'dias': 30})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['dias_restantes'] for r in response.data], [3, 20])
+        self.assertEqual(response.data[0]['contacto_paciente'], '5551234')
+
+        response = self.client.get('/api/core/diagnosticos/', {'proximo_control_dias': 7})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertTrue(response.data['results'][0]['necesita_recordatorio'])
+
+
+class EstadisticasDiariasTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        paciente = self.crear_paciente()
+        manana = timezone.localdate() + timedelta(days=1)
+        self.diagnosticos = [
+            Diagnostico.objects.create(
+                paciente=paciente, sucursal=self.sucursal, fecha_hora_consulta=timezone.now(),
+                tipo_lente=tipo_lente, remision_oftalmologica=remision, proximo_control=manana
+            )
+            for tipo_lente, remision in [('monofocal', False), ('monofocal', True), ('progresivo', False)]
+        ]
+
+    def test_estadisticas_se_mantienen_al_guardar(self):
+        """Test para reflejar en las estadísticas los cambios hechos con save() y con UPDATE en lote"""
+        response = self.client.get('/api/core/diagnosticos/estadisticas/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_diagnosticos'], 3)
+        self.assertEqual(response.data['remisiones_oftalmologicas'], 1)
+        self.assertEqual(response.data['recordatorios_pendientes'], 3)
+        self.assertEqual(response.data['tipos_lentes_mas_comunes'][0], {'tipo_lente': 'monofocal', 'count': 2})
+
+        eliminado = self.diagnosticos[0]
+        eliminado.activo = False
+        eliminado.save()
+        self.client.post(
+            '/api/core/diagnosticos/recordatorios/marcar-enviados/', {'ids': [self.diagnosticos[1].id]}, format='json'
+        )
+        response = self.client.get('/api/core/diagnosticos/estadisticas/')
+        self.assertEqual(response.data['total_diagnosticos'], 2)
+        self.assertEqual(response.data['proximos_controles'], 2)
+        self.assertEqual(response.data['recordatorios_pendientes'], 1)
+
+    def test_recalculo_en_lote_bloquea_solo_los_dias_tocados(self):
+        """Test para bloquear solo la sucursal y los días de los diagnósticos marcados, no la fila de la sucursal"""
+        from .models import BloqueoEstadisticaDiaria
+
+        Sucursal.objects.create(nombre='Sucursal Norte', direccion='Calle 2', telefono='5500000000')
+        BloqueoEstadisticaDiaria.objects.all().delete()
+        self.client.post(
+            '/api/core/diagnosticos/recordatorios/marcar-enviados/', {'ids': [self.diagnosticos[1].id]}, format='json'
+        )
+        self.assertEqual(
+            list(BloqueoEstadisticaDiaria.objects.values_list('sucursal_id', 'fecha')),
+            [(self.sucursal.id, timezone.localdate() + timedelta(days=1))]
+        )
+
+    def test_control_movido_o_borrado_descuenta_el_dia_anterior(self):
+        """Test para recalcular el día de control anterior cuando un save() lo mueve o lo borra"""
+        from .models import EstadisticaControlesDiaria
+
+        manana = timezone.localdate() + timedelta(days=1)
+        diagnostico = Diagnostico.objects.get(pk=self.diagnosticos[0].pk)
+        diagnostico.proximo_control = manana + timedelta(days=9)
+        diagnostico.save()
+        self.assertEqual(EstadisticaControlesDiaria.objects.get(fecha=manana).controles, 2)
+        self.assertEqual(EstadisticaControlesDiaria.objects.get(fecha=diagnostico.proximo_control).controles, 1)
+
+        diagnostico.proximo_control = None
+        diagnostico.save()
+        self.assertFalse(EstadisticaControlesDiaria.objects.filter(fecha=manana + timedelta(days=9)).exists())
+        response = self.client.get('/api/core/diagnosticos/estadisticas/')
+        self.assertEqual(response.data['proximos_controles'], 2)
+
+    def test_comando_reconstruye_estadisticas(self):
+        """Test para reconstruir las tablas diarias desde los diagnósticos"""
+        from django.core.management import call_command
+        from .models import EstadisticaControlesDiaria, EstadisticaDiagnosticosDiaria
+
+        Diagnostico.objects.filter(pk=self.diagnosticos[0].pk).update(tipo_lente='bifocal')
+        EstadisticaDiagnosticosDiaria.objects.all().delete()
+        EstadisticaControlesDiaria.objects.all().delete()
+        call_command('actualizar_estadisticas', '--completo', stdout=StringIO())
+
+        response = self.client.get('/api/core/diagnosticos/estadisticas/', {'sucursal': self.sucursal.id})
+        self.assertEqual(response.data['diagnosticos_este_mes'], 3)
+        self.assertEqual(response.data['proximos_controles'], 3)
+        self.assertEqual(len(response.data['tipos_lentes_mas_comunes']), 3)
+
+
+class ReportesTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.paciente = self.crear_paciente()
+        ahora = timezone.now()
+        for estado in ('creada', 'creada', 'cancelada'):
+            CitaMedica.objects.create(
+                paciente=self.paciente, sucursal=self.sucursal, doctor_asignado=self.usuario,
+                fecha_hora=ahora + timedelta(hours=1), estado=estado
+            )
+
+    def test_reporte_citas_agrupado(self):
+        """Test para contar citas por doctor y estado y rechazar dimensiones fuera de la lista blanca"""
+        manana = (timezone.localdate() + timedelta(days=1)).isoformat()
+        response = self.client.get('/api/core/reportes/citas/', {'agrupar': 'doctor,estado', 'hasta': manana})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(
+            [(f['doctor'], f['estado'], f['total']) for f in response.data['filas']],
+            [(self.usuario.id, 'cancelada', 1), (self.usuario.id, 'creada', 2)]
+        )
+
+        response = self.client.get('/api/core/reportes/citas/', {'agrupar': 'paciente'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/core/reportes/pacientes/', {'agrupar': 'sucursal'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reporte_agrupado_por_mes_local(self):
+        """Test para asignar cada cita al mes de su fecha en la zona horaria local"""
+        manana = (timezone.localdate() + timedelta(days=1)).isoformat()
+        response = self.client.get('/api/core/reportes/citas/', {'agrupar': 'mes', 'hasta': manana})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mes = timezone.localtime(CitaMedica.objects.first().fecha_hora).strftime('%Y-%m')
+        self.assertEqual(response.data['filas'], [{'mes': mes, 'total': 3}])
+
+    def test_reporte_cacheado_e_invalidado_al_escribir(self):
+        """Test para servir el reporte desde caché hasta que se escribe una cita del mismo mes"""
+        from .reportes import parametros_reporte, reporte
+
+        manana = (timezone.localdate() + timedelta(days=1)).isoformat()
+        parametros = parametros_reporte('citas', {'agrupar': 'sucursal,mes', 'hasta': manana})
+        self.assertEqual(reporte(parametros)['total'], 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(reporte(parametros)['total'], 3)
 
-# Create your tests here.
+        with self.captureOnCommitCallbacks(execute=True):
+            CitaMedica.objects.create(
+                paciente=self.paciente, sucursal=self.sucursal, fecha_hora=timezone.now() + timedelta(hours=3)
+            )
+        self.assertEqual(reporte(parametros)['total'], 4)
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .eventos import publicar_evento
+from .models import CitaMedica
+from .reportes import invalidar_reportes
+
+MAXIMO_CITAS_POR_LOTE = 500
+
+
+def cambiar_estado_citas(ids, nuevo_estado, comentarios=None):
+    """
+    Aplica la misma transición de estado a varias citas.
+
+    Las citas se leen una sola vez (con bloqueo de fila) para reportar el resultado de
+    cada id, y el cambio se hace con un único UPDATE condicionado a
+    `estado IN (estados de origen)` según CitaMedica.TRANSICIONES, sin cargar ni
+    guardar cada modelo. Retorna (actualizadas, resultados por id).
+    """
+    estados_origen = CitaMedica.estados_origen(nuevo_estado)
+    ids = list(dict.fromkeys(ids))
+
+    with transaction.atomic():
+        filas = list(
+            CitaMedica.objects.select_for_update()
+            .filter(pk__in=ids, activo=True)
+            .values_list('id', 'estado', 'sucursal_id', 'fecha_hora')
+        )
+        estados = {pk: estado for pk, estado, _, _ in filas}
+        sucursales = {pk: sucursal_id for pk, _, sucursal_id, _ in filas}
+        fechas = {pk: fecha_hora for pk, _, _, fecha_hora in filas}
+        aplicables = [pk for pk in ids if estados.get(pk) in estados_origen]
+
+        actualizadas = 0
+        if aplicables:
+            cambios = {'estado': nuevo_estado, 'actualizado_en': timezone.now()}
+            if comentarios:
+                cambios['comentarios'] = comentarios
+            actualizadas = CitaMedica.objects.filter(
+                pk__in=aplicables, activo=True, estado__in=estados_origen
+            ).update(**cambios)
+            invalidar_reportes('citas', [fechas[pk] for pk in aplicables])
+
+            por_sucursal = {}
+            for pk in aplicables:
+                por_sucursal.setdefault(sucursales[pk], []).append(pk)
+            for sucursal_id, ids_sucursal in por_sucursal.items():
+                publicar_evento(sucursal_id, 'citas_actualizadas', {'ids': ids_sucursal, 'estado': nuevo_estado})
+
+    resultados = []
+    for pk in ids:
+        if pk not in estados:
+            resultados.append({'id': pk, 'resultado': 'no_encontrada'})
+        elif estados[pk] not in estados_origen:
+            resultados.append({
+                'id': pk,
+                'resultado': 'transicion_invalida',
+                'estado_actual': estados[pk],
+            })
+        else:
+            resultados.append({
+                'id': pk,
+                'resultado': 'actualizada',
+                'estado_anterior': estados[pk],
+            })
+    return actualizadas, resultados
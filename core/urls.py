@@ -7,7 +7,12 @@ urlpatterns = [
     # URLs para pacientes
     path('pacientes/', views.listar_pacientes, name='listar_pacientes'),
     path('pacientes/crear/', views.crear_paciente, name='crear_paciente'), 
+    path('pacientes/importar/', views.importar_pacientes, name='importar_pacientes'),
+    path('pacientes/cambios/', views.cambios_pacientes, name='cambios_pacientes'),
+    path('pacientes/exportar/', views.exportar_pacientes, name='exportar_pacientes'),
     path('pacientes/<int:pk>/', views.obtener_paciente, name='obtener_paciente'),
+    path('pacientes/<int:pk>/resumen/', views.resumen_paciente, name='resumen_paciente'),
+    path('pacientes/<int:pk>/progresion-rx/', views.progresion_rx_paciente, name='progresion_rx_paciente'),
     path('pacientes/<int:pk>/actualizar/', views.actualizar_paciente, name='actualizar_paciente'),
     path('pacientes/<int:pk>/eliminar/', views.eliminar_paciente, name='eliminar_paciente'),
     path('pacientes/<int:pk>/activar/', views.activar_paciente, name='activar_paciente'),
@@ -16,6 +21,12 @@ urlpatterns = [
     # URLs para citas médicas
     path('citas/', views.listar_citas, name='listar_citas'),
     path('citas/crear/', views.crear_cita, name='crear_cita'),
+    path('citas/cambios/', views.cambios_citas, name='cambios_citas'),
+    path('citas/exportar/', views.exportar_citas, name='exportar_citas'),
+    path('citas/cambiar-estado/', views.cambiar_estado_citas_masivo, name='cambiar_estado_citas_masivo'),
+    path('citas/reprogramar/', views.reprogramar_citas_doctor, name='reprogramar_citas_doctor'),
+    path('citas/eventos/<int:sucursal_id>/', views.eventos_agenda, name='eventos_agenda'),
+    path('citas/disponibilidad/', views.disponibilidad_citas, name='disponibilidad_citas'),
     path('citas/<int:pk>/', views.obtener_cita, name='obtener_cita'),
     path('citas/<int:pk>/actualizar/', views.actualizar_cita, name='actualizar_cita'),
     path('citas/<int:pk>/eliminar/', views.eliminar_cita, name='eliminar_cita'),
@@ -27,13 +38,22 @@ urlpatterns = [
     # URLs para diagnósticos
     path('diagnosticos/', views.listar_diagnosticos, name='listar_diagnosticos'),
     path('diagnosticos/crear/', views.crear_diagnostico, name='crear_diagnostico'),
+    path('diagnosticos/cambios/', views.cambios_diagnosticos, name='cambios_diagnosticos'),
+    path('diagnosticos/exportar/', views.exportar_diagnosticos, name='exportar_diagnosticos'),
     path('diagnosticos/<int:pk>/', views.obtener_diagnostico, name='obtener_diagnostico'),
     path('diagnosticos/<int:pk>/actualizar/', views.actualizar_diagnostico, name='actualizar_diagnostico'),
     path('diagnosticos/<int:pk>/eliminar/', views.eliminar_diagnostico, name='eliminar_diagnostico'),
     path('diagnosticos/paciente/<int:paciente_id>/', views.diagnosticos_por_paciente, name='diagnosticos_por_paciente'),
     path('diagnosticos/recordatorios/', views.recordatorios_pendientes, name='recordatorios_pendientes'),
+    path('diagnosticos/recordatorios/marcar-enviados/', views.marcar_recordatorios_enviados_masivo, name='marcar_recordatorios_enviados_masivo'),
     path('diagnosticos/<int:pk>/recordatorio-enviado/', views.marcar_recordatorio_enviado, name='marcar_recordatorio_enviado'),
+    path('diagnosticos/analitica/refraccion/', views.analitica_refraccion, name='analitica_refraccion'),
+    path('diagnosticos/progresion-rx/', views.progresion_rx_cohorte, name='progresion_rx_cohorte'),
     path('diagnosticos/estadisticas/', views.estadisticas_diagnosticos, name='estadisticas_diagnosticos'),
     path('diagnosticos/estructura-datos-clinicos/', views.estructura_datos_clinicos, name='estructura_datos_clinicos'),
     path('diagnosticos/validar-estructura/', views.validar_estructura_datos_clinicos, name='validar_estructura_datos_clinicos'),
+    path('diagnosticos/validar-lote/', views.validar_diagnosticos_lote, name='validar_diagnosticos_lote'),
+    
+    # URLs para reportes
+    path('reportes/<str:entidad>/', views.reporte_agrupado, name='reporte_agrupado'),
 ] 
\ No newline at end of file
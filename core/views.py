@@ -1,11 +1,33 @@
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from django.db import transaction
 from .models import Paciente, CitaMedica, Diagnostico
+from .paginacion import paginar, CursorInvalido
+from .sincronizacion import cambios_desde, serializar_cambios
+from users.campos_dinamicos import campos_solicitados
+from .agenda import ConflictoAgenda, horarios_disponibles, reprogramar_citas
+from .transiciones import cambiar_estado_citas
+from .recordatorios import anotar_recordatorio
+from .eventos import flujo_eventos, publicar_cita, publicar_evento
+from .filtros import filtrar_pacientes, filtrar_citas, filtrar_diagnosticos
+from .exportacion import (
+    FORMATOS_EXPORTACION,
+    COLUMNAS_PACIENTES,
+    COLUMNAS_CITAS,
+    COLUMNAS_DIAGNOSTICOS,
+    generar_exportacion
+)
+from .importacion import (
+    FormatoInvalido,
+    detectar_formato,
+    leer_filas,
+    importar_pacientes as importar_filas_pacientes
+)
 from .serializers import (
     PacienteSerializer,
     PacienteCreateSerializer,
@@ -14,11 +36,15 @@ from .serializers import (
     CitaMedicaCreateSerializer,
     CitaMedicaListSerializer,
     CitaMedicaCambioEstadoSerializer,
+    CitaMedicaCambioEstadoMasivoSerializer,
+    CitaMedicaReprogramacionSerializer,
     DiagnosticoSerializer,
     DiagnosticoCreateSerializer,
     DiagnosticoListSerializer,
     DiagnosticoResumenSerializer,
-    RecordatorioSerializer
+    RecordatorioSerializer,
+    RecordatorioConfirmacionMasivaSerializer,
+    validar_horario_cita
 )
 
 def format_error_response(errors):
@@ -34,67 +60,87 @@ def format_error_response(errors):
         return {"error": " ".join(error_messages)}
     return {"error": str(errors)}
 
+def respuesta_exportacion(request, queryset, columnas, nombre, aplanar_clinicos=False):
+    """Construye la respuesta en streaming para los endpoints de exportación"""
+    formato = request.query_params.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        return Response(
+            {"error": f"Formato no soportado. Use uno de: {', '.join(FORMATOS_EXPORTACION)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    response = StreamingHttpResponse(
+        generar_exportacion(queryset, columnas, formato, aplanar_clinicos),
+        content_type=FORMATOS_EXPORTACION[formato]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    return response
+
+def respuesta_cambios(request, queryset, serializer_class):
+    """Construye la respuesta de los endpoints de sincronización incremental"""
+    sucursal = request.query_params.get('sucursal', None)
+    if sucursal:
+        queryset = queryset.filter(sucursal_id=sucursal)
+    
+    campos = campos_solicitados(request)
+    if campos['campos'] is not None:
+        # El cliente siempre necesita saber qué fila cambió y si sigue activa
+        campos['campos'] = campos['campos'] + ['id', 'activo', 'actualizado_en']
+    queryset = serializer_class.optimizar_queryset(queryset, **campos)
+    
+    try:
+        registros, cursor, hay_mas = cambios_desde(queryset, request)
+    except CursorInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'results': serializar_cambios(registros, serializer_class, **campos),
+        'next_cursor': cursor,
+        'has_more': hay_mas
+    })
+
 # Vistas de Pacientes
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_pacientes(request):
     """Lista todos los pacientes con paginación y filtros de búsqueda"""
     queryset = Paciente.objects.select_related('usuario_registro', 'sucursal').filter(activo=True)
+    queryset = filtrar_pacientes(queryset, request.query_params)
     
-    # Filtros de búsqueda
-    search = request.query_params.get('search', None)
-    if search:
-        queryset = queryset.filter(
-            Q(nombre_completo__icontains=search) |
-            Q(codigo_paciente__icontains=search) |
-            Q(correo__icontains=search) |
-            Q(telefono__icontains=search)
-        )
-    
-    # Filtro por sucursal
-    sucursal_id = request.query_params.get('sucursal', None)
-    if sucursal_id:
-        queryset = queryset.filter(sucursal_id=sucursal_id)
-    
-    # Filtro por género
-    genero = request.query_params.get('genero', None)
-    if genero:
-        queryset = queryset.filter(genero=genero)
-    
-    # Paginación
-    page = request.query_params.get('page', 1)
-    page_size = request.query_params.get('page_size', 10)
+    # Selección de campos (?fields= / ?exclude=)
+    campos = campos_solicitados(request)
+    queryset = PacienteListSerializer.optimizar_queryset(queryset, **campos)
     
+    # Paginación (por página o por cursor)
     try:
-        page_size = int(page_size)
-        if page_size > 100:  # Límite máximo
-            page_size = 100
-    except ValueError:
-        page_size = 10
-    
-    paginator = Paginator(queryset, page_size)
-    
-    try:
-        pacientes = paginator.page(page)
-    except PageNotAnInteger:
-        pacientes = paginator.page(1)
-    except EmptyPage:
-        pacientes = paginator.page(paginator.num_pages)
+        pacientes, pagination = paginar(
+            queryset, request,
+            orden_defecto='-creado_en',
+            ordenes_permitidos=['-creado_en', 'creado_en']
+        )
+    except CursorInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = PacienteListSerializer(pacientes, many=True)
+    serializer = PacienteListSerializer(pacientes, many=True, **campos)
     
     return Response({
         'results': serializer.data,
-        'pagination': {
-            'current_page': pacientes.number,
-            'total_pages': paginator.num_pages,
-            'total_items': paginator.count,
-            'page_size': page_size,
-            'has_next': pacientes.has_next(),
-            'has_previous': pacientes.has_previous(),
-        }
+        'pagination': pagination
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exportar_pacientes(request):
+    """Exporta los pacientes filtrados en CSV o NDJSON usando memoria constante"""
+    queryset = filtrar_pacientes(Paciente.objects.filter(activo=True), request.query_params)
+    return respuesta_exportacion(request, queryset, COLUMNAS_PACIENTES, 'pacientes')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cambios_pacientes(request):
+    """Pacientes creados, modificados o dados de baja desde el cursor (sincronización incremental)"""
+    return respuesta_cambios(request, Paciente.objects.all(), PacienteSerializer)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_paciente(request):
@@ -107,17 +153,102 @@ def crear_paciente(request):
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     return Response(format_error_response(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def importar_pacientes(request):
+    """Importa pacientes de forma masiva desde un archivo CSV o NDJSON"""
+    archivo = request.FILES.get('archivo')
+    if not archivo:
+        return Response({"error": "Se requiere el archivo a importar"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        formato = detectar_formato(archivo.name, request.data.get('formato'))
+    except FormatoInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    sucursal_id = request.data.get('sucursal') or None
+    if sucursal_id:
+        try:
+            sucursal_id = int(sucursal_id)
+        except ValueError:
+            return Response({"error": "La sucursal debe ser un ID válido"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    resultado = importar_filas_pacientes(
+        leer_filas(archivo, formato),
+        usuario=request.user,
+        sucursal_defecto=sucursal_id
+    )
+    return Response(resultado, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def obtener_paciente(request, pk):
     """Obtiene un paciente específico por ID"""
+    campos = campos_solicitados(request)
     try:
-        paciente = Paciente.objects.select_related('usuario_registro', 'sucursal').get(pk=pk, activo=True)
-        serializer = PacienteSerializer(paciente)
+        paciente = PacienteSerializer.optimizar_queryset(Paciente.objects.all(), **campos).get(pk=pk, activo=True)
+        serializer = PacienteSerializer(paciente, **campos)
         return Response(serializer.data)
     except Paciente.DoesNotExist:
         return Response({"error": "Paciente no encontrado"}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def resumen_paciente(request, pk):
+    """Obtiene en una sola llamada el expediente resumido de un paciente (consultas fijas)"""
+    from django.db.models import Prefetch, OuterRef, Subquery
+    from django.db.models.fields.json import KT
+    from django.utils import timezone
+    
+    try:
+        limite = min(max(int(request.query_params.get('limite', 5)), 1), 50)
+    except ValueError:
+        limite = 5
+    
+    ahora = timezone.now()
+    diagnosticos_activos = Diagnostico.objects.filter(paciente=OuterRef('pk'), activo=True)
+    
+    try:
+        paciente = Paciente.objects.select_related('usuario_registro', 'sucursal').annotate(
+            ultima_rx_final=Subquery(
+                diagnosticos_activos.order_by('-fecha_hora_consulta').annotate(
+                    rx=KT('datos_clinicos__rx_final')
+                ).values('rx')[:1]
+            ),
+            proximo_control_pendiente=Subquery(
+                diagnosticos_activos.filter(
+                    proximo_control__gte=ahora.date()
+                ).order_by('proximo_control').values('proximo_control')[:1]
+            ),
+        ).prefetch_related(
+            Prefetch(
+                'citas',
+                queryset=CitaMedica.objects.select_related('doctor_asignado', 'sucursal').filter(
+                    activo=True, fecha_hora__gte=ahora
+                ).exclude(
+                    estado__in=['cancelada', 'finalizada']
+                ).order_by('fecha_hora')[:limite],
+                to_attr='proximas_citas'
+            ),
+            Prefetch(
+                'diagnosticos',
+                queryset=Diagnostico.objects.select_related('usuario_creacion').filter(
+                    activo=True
+                ).order_by('-fecha_hora_consulta')[:limite],
+                to_attr='ultimos_diagnosticos'
+            ),
+        ).get(pk=pk, activo=True)
+    except Paciente.DoesNotExist:
+        return Response({"error": "Paciente no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'paciente': PacienteSerializer(paciente).data,
+        'proximas_citas': CitaMedicaListSerializer(paciente.proximas_citas, many=True).data,
+        'ultimos_diagnosticos': DiagnosticoResumenSerializer(paciente.ultimos_diagnosticos, many=True).data,
+        'ultima_rx_final': paciente.ultima_rx_final,
+        'proximo_control_pendiente': paciente.proximo_control_pendiente,
+    })
+
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def actualizar_paciente(request, pk):
@@ -178,85 +309,53 @@ def listar_citas(request):
     queryset = CitaMedica.objects.select_related(
         'paciente', 'doctor_asignado', 'usuario_creacion', 'sucursal'
     ).filter(activo=True)
+    queryset = filtrar_citas(queryset, request.query_params)
     
-    # Filtros de búsqueda
-    search = request.query_params.get('search', None)
-    if search:
-        queryset = queryset.filter(
-            Q(paciente__nombre_completo__icontains=search) |
-            Q(paciente__codigo_paciente__icontains=search) |
-            Q(doctor_asignado__nombre_completo__icontains=search)
-        )
-    
-    # Filtro por estado
-    estado = request.query_params.get('estado', None)
-    if estado:
-        queryset = queryset.filter(estado=estado)
-    
-    # Filtro por sucursal
-    sucursal_id = request.query_params.get('sucursal', None)
-    if sucursal_id:
-        queryset = queryset.filter(sucursal_id=sucursal_id)
-    
-    # Filtro por doctor
-    doctor_id = request.query_params.get('doctor', None)
-    if doctor_id:
-        queryset = queryset.filter(doctor_asignado_id=doctor_id)
-    
-    # Filtro por paciente
-    paciente_id = request.query_params.get('paciente', None)
-    if paciente_id:
-        queryset = queryset.filter(paciente_id=paciente_id)
-    
-    # Filtro por fecha
-    fecha_desde = request.query_params.get('fecha_desde', None)
-    fecha_hasta = request.query_params.get('fecha_hasta', None)
-    if fecha_desde:
-        queryset = queryset.filter(fecha_hora__gte=fecha_desde)
-    if fecha_hasta:
-        queryset = queryset.filter(fecha_hora__lte=fecha_hasta)
-    
-    # Paginación
-    page = request.query_params.get('page', 1)
-    page_size = request.query_params.get('page_size', 10)
-    
-    try:
-        page_size = int(page_size)
-        if page_size > 100:  # Límite máximo
-            page_size = 100
-    except ValueError:
-        page_size = 10
-    
-    paginator = Paginator(queryset, page_size)
+    # Selección de campos (?fields= / ?exclude=)
+    campos = campos_solicitados(request)
+    queryset = CitaMedicaListSerializer.optimizar_queryset(queryset, **campos)
     
+    # Paginación (por página o por cursor)
     try:
-        citas = paginator.page(page)
-    except PageNotAnInteger:
-        citas = paginator.page(1)
-    except EmptyPage:
-        citas = paginator.page(paginator.num_pages)
+        citas, pagination = paginar(
+            queryset, request,
+            orden_defecto='-fecha_hora',
+            ordenes_permitidos=['-fecha_hora', 'fecha_hora']
+        )
+    except CursorInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = CitaMedicaListSerializer(citas, many=True)
+    serializer = CitaMedicaListSerializer(citas, many=True, **campos)
     
     return Response({
         'results': serializer.data,
-        'pagination': {
-            'current_page': citas.number,
-            'total_pages': paginator.num_pages,
-            'total_items': paginator.count,
-            'page_size': page_size,
-            'has_next': citas.has_next(),
-            'has_previous': citas.has_previous(),
-        }
+        'pagination': pagination
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exportar_citas(request):
+    """Exporta las citas médicas filtradas en CSV o NDJSON usando memoria constante"""
+    queryset = filtrar_citas(CitaMedica.objects.filter(activo=True), request.query_params)
+    return respuesta_exportacion(request, queryset, COLUMNAS_CITAS, 'citas')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cambios_citas(request):
+    """Citas creadas, modificadas o dadas de baja desde el cursor (sincronización incremental)"""
+    return respuesta_cambios(request, CitaMedica.objects.all(), CitaMedicaSerializer)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_cita(request):
     """Crea una nueva cita médica"""
     serializer = CitaMedicaCreateSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        cita = serializer.save()
+        try:
+            cita = serializer.save()
+        except ValidationError as e:
+            return Response(format_error_response(e.detail), status=status.HTTP_400_BAD_REQUEST)
+        publicar_cita(cita, 'cita_creada')
         # Retornar la cita creada con todos los datos
         response_serializer = CitaMedicaSerializer(cita)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -266,11 +365,10 @@ def crear_cita(request):
 @permission_classes([IsAuthenticated])
 def obtener_cita(request, pk):
     """Obtiene una cita médica específica por ID"""
+    campos = campos_solicitados(request)
     try:
-        cita = CitaMedica.objects.select_related(
-            'paciente', 'doctor_asignado', 'usuario_creacion', 'sucursal'
-        ).get(pk=pk, activo=True)
-        serializer = CitaMedicaSerializer(cita)
+        cita = CitaMedicaSerializer.optimizar_queryset(CitaMedica.objects.all(), **campos).get(pk=pk, activo=True)
+        serializer = CitaMedicaSerializer(cita, **campos)
         return Response(serializer.data)
     except CitaMedica.DoesNotExist:
         return Response({"error": "Cita médica no encontrada"}, status=status.HTTP_404_NOT_FOUND)
@@ -281,9 +379,17 @@ def actualizar_cita(request, pk):
     """Actualiza una cita médica existente"""
     try:
         cita = CitaMedica.objects.get(pk=pk, activo=True)
+        sucursal_anterior = cita.sucursal_id
         serializer = CitaMedicaSerializer(cita, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                serializer.save()
+            except ValidationError as e:
+                return Response(format_error_response(e.detail), status=status.HTTP_400_BAD_REQUEST)
+            # Si la cita cambió de sucursal, se retira del tablero anterior
+            if cita.sucursal_id != sucursal_anterior:
+                publicar_evento(sucursal_anterior, 'cita_eliminada', {'id': cita.id})
+            publicar_cita(cita, 'cita_actualizada')
             return Response(serializer.data)
         return Response(format_error_response(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
     except CitaMedica.DoesNotExist:
@@ -297,6 +403,7 @@ def eliminar_cita(request, pk):
         cita = CitaMedica.objects.get(pk=pk, activo=True)
         cita.activo = False
         cita.save()
+        publicar_cita(cita, 'cita_eliminada')
         return Response({"mensaje": "Cita médica eliminada correctamente"}, status=status.HTTP_200_OK)
     except CitaMedica.DoesNotExist:
         return Response({"error": "Cita médica no encontrada"}, status=status.HTTP_404_NOT_FOUND)
@@ -312,30 +419,11 @@ def cambiar_estado_cita(request, pk):
         if serializer.is_valid():
             nuevo_estado = serializer.validated_data['nuevo_estado']
             
-            # Validar transiciones de estado
-            if nuevo_estado == 'confirmada' and not cita.puede_confirmar:
-                return Response(
-                    {"error": "No se puede confirmar esta cita en su estado actual"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            elif nuevo_estado == 'reagendada' and not cita.puede_reagendar:
-                return Response(
-                    {"error": "No se puede reagendar esta cita en su estado actual"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            elif nuevo_estado == 'cancelada' and not cita.puede_cancelar:
-                return Response(
-                    {"error": "No se puede cancelar esta cita en su estado actual"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            elif nuevo_estado == 'en_progreso' and not cita.puede_iniciar:
-                return Response(
-                    {"error": "No se puede iniciar esta cita en su estado actual"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            elif nuevo_estado == 'finalizada' and not cita.puede_finalizar:
+            # Validar la transición contra la tabla del modelo
+            if not cita.puede_cambiar_a(nuevo_estado):
+                accion = CitaMedica.TRANSICIONES.get(nuevo_estado, {}).get('accion', 'pasar a ese estado')
                 return Response(
-                    {"error": "No se puede finalizar esta cita en su estado actual"}, 
+                    {"error": f"No se puede {accion} esta cita en su estado actual"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
@@ -351,7 +439,17 @@ def cambiar_estado_cita(request, pk):
             if serializer.validated_data.get('nuevo_doctor'):
                 cita.doctor_asignado = serializer.validated_data['nuevo_doctor']
             
-            cita.save()
+            # Un cambio de horario o de doctor debe respetar la agenda
+            if serializer.validated_data.get('nueva_fecha_hora') or serializer.validated_data.get('nuevo_doctor'):
+                try:
+                    with transaction.atomic():
+                        validar_horario_cita({}, cita, bloquear=True)
+                        cita.save()
+                except ValidationError as e:
+                    return Response(format_error_response(e.detail), status=status.HTTP_400_BAD_REQUEST)
+            else:
+                cita.save()
+            publicar_cita(cita, 'cita_actualizada')
             
             # Retornar cita actualizada
             response_serializer = CitaMedicaSerializer(cita)
@@ -362,6 +460,27 @@ def cambiar_estado_cita(request, pk):
     except CitaMedica.DoesNotExist:
         return Response({"error": "Cita médica no encontrada"}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cambiar_estado_citas_masivo(request):
+    """Cambia el estado de varias citas médicas con una sola actualización"""
+    serializer = CitaMedicaCambioEstadoMasivoSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(format_error_response(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+    
+    actualizadas, resultados = cambiar_estado_citas(
+        serializer.validated_data['ids'],
+        serializer.validated_data['nuevo_estado'],
+        serializer.validated_data.get('comentarios')
+    )
+    
+    return Response({
+        'nuevo_estado': serializer.validated_data['nuevo_estado'],
+        'actualizadas': actualizadas,
+        'rechazadas': len(resultados) - actualizadas,
+        'resultados': resultados
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def reasignar_doctor(request, pk):
@@ -387,7 +506,13 @@ def reasignar_doctor(request, pk):
             )
         
         cita.doctor_asignado = nuevo_doctor
-        cita.save()
+        try:
+            with transaction.atomic():
+                validar_horario_cita({}, cita, bloquear=True)
+                cita.save()
+        except ValidationError as e:
+            return Response(format_error_response(e.detail), status=status.HTTP_400_BAD_REQUEST)
+        publicar_cita(cita, 'cita_actualizada')
         
         serializer = CitaMedicaSerializer(cita)
         return Response(serializer.data)
@@ -395,6 +520,54 @@ def reasignar_doctor(request, pk):
     except CitaMedica.DoesNotExist:
         return Response({"error": "Cita médica no encontrada"}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def reprogramar_citas_doctor(request):
+    """Reasigna o corre en bloque las citas pendientes de un doctor en una sucursal y rango de fechas"""
+    from datetime import timedelta
+    
+    serializer = CitaMedicaReprogramacionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(format_error_response(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+    
+    datos = serializer.validated_data
+    desplazamiento = timedelta(minutes=datos.get('desplazamiento_minutos') or 0)
+    try:
+        ids = reprogramar_citas(
+            datos['doctor'], datos['sucursal'], datos['desde'], datos['hasta'],
+            nuevo_doctor=datos.get('nuevo_doctor'),
+            desplazamiento=desplazamiento
+        )
+    except ConflictoAgenda as e:
+        return Response({
+            "error": str(e),
+            "conflictos": [
+                {'cita': cita_id, 'se_cruza_con': otra_id} for cita_id, otra_id in e.cruces
+            ]
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'citas_actualizadas': len(ids),
+        'ids': ids,
+        'nuevo_doctor': datos['nuevo_doctor'].id if datos.get('nuevo_doctor') else None,
+        'desplazamiento_minutos': datos.get('desplazamiento_minutos') or 0
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def eventos_agenda(request, sucursal_id):
+    """Canal Server-Sent Events con las citas creadas o modificadas en una sucursal (requiere ASGI)"""
+    from users.models import Sucursal
+    
+    if not Sucursal.objects.filter(id=sucursal_id).exists():
+        return Response({"error": "Sucursal no encontrada"}, status=status.HTTP_404_NOT_FOUND)
+    
+    response = StreamingHttpResponse(flujo_eventos(sucursal_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evitar que nginx acumule el flujo antes de enviarlo
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def citas_por_doctor(request, doctor_id):
@@ -427,6 +600,71 @@ def citas_por_doctor(request, doctor_id):
     serializer = CitaMedicaListSerializer(queryset, many=True)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def disponibilidad_citas(request):
+    """Calcula los horarios libres de un doctor o de los doctores de una sucursal en un rango de fechas"""
+    from datetime import time, timedelta
+    from django.contrib.auth import get_user_model
+    from django.utils.dateparse import parse_date
+    Usuario = get_user_model()
+    
+    doctor_id = request.query_params.get('doctor', None)
+    sucursal_id = request.query_params.get('sucursal', None)
+    if not doctor_id and not sucursal_id:
+        return Response({"error": "Se requiere el doctor o la sucursal"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        fecha_desde = parse_date(request.query_params.get('fecha_desde', ''))
+        fecha_hasta = parse_date(request.query_params.get('fecha_hasta', '')) if request.query_params.get('fecha_hasta') else fecha_desde
+        duracion = int(request.query_params.get('duracion', CitaMedica.DURACION_DEFECTO_MINUTOS))
+        hora_inicio = request.query_params.get('hora_inicio', None)
+        hora_fin = request.query_params.get('hora_fin', None)
+        hora_inicio = time.fromisoformat(hora_inicio) if hora_inicio else None
+        hora_fin = time.fromisoformat(hora_fin) if hora_fin else None
+    except ValueError:
+        return Response({"error": "Formato de parámetros inválido"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not fecha_desde or not fecha_hasta:
+        return Response({"error": "Se requiere fecha_desde en formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+    if fecha_hasta < fecha_desde or fecha_hasta - fecha_desde > timedelta(days=31):
+        return Response({"error": "El rango de fechas debe ser válido y de máximo 31 días"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 5 <= duracion <= CitaMedica.DURACION_MAXIMA_MINUTOS:
+        return Response(
+            {"error": f"La duración debe estar entre 5 y {CitaMedica.DURACION_MAXIMA_MINUTOS} minutos"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # No hay un rol de doctor: se ofrece la agenda de todo usuario activo, que es lo que
+    # acepta doctor_asignado al crear una cita; por sucursal se listan todos sus usuarios activos
+    doctores = Usuario.objects.filter(is_active=True).only('id', 'nombre_completo')
+    if doctor_id:
+        doctores = doctores.filter(id=doctor_id)
+    if sucursal_id:
+        doctores = doctores.filter(sucursal_id=sucursal_id)
+    doctores = list(doctores)
+    if doctor_id and not doctores:
+        return Response({"error": "Doctor no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    
+    disponibles = horarios_disponibles(
+        doctores, fecha_desde, fecha_hasta, duracion,
+        hora_inicio=hora_inicio, hora_fin=hora_fin
+    )
+    
+    return Response({
+        'fecha_desde': fecha_desde,
+        'fecha_hasta': fecha_hasta,
+        'duracion_minutos': duracion,
+        'doctores': [
+            {
+                'doctor': doctor.id,
+                'doctor_nombre': doctor.nombre_completo,
+                'horarios': [{'inicio': inicio, 'fin': fin} for inicio, fin in disponibles[doctor.id]],
+            }
+            for doctor in doctores
+        ]
+    })
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def citas_por_paciente(request, paciente_id):
@@ -452,92 +690,43 @@ def listar_diagnosticos(request):
     queryset = Diagnostico.objects.select_related(
         'paciente', 'usuario_creacion', 'sucursal'
     ).filter(activo=True)
+    queryset = filtrar_diagnosticos(queryset, request.query_params)
     
-    # Filtros de búsqueda
-    search = request.query_params.get('search', None)
-    if search:
-        queryset = queryset.filter(
-            Q(paciente__nombre_completo__icontains=search) |
-            Q(paciente__codigo_paciente__icontains=search) |
-            Q(datos_clinicos__rx_final__icontains=search) |
-            Q(datos_clinicos__diagnostico_tratamiento__icontains=search) |
-            Q(datos_clinicos__hallazgos_encontrados__icontains=search) |
-            Q(comentario__icontains=search)
-        )
-    
-    # Filtro por sucursal
-    sucursal_id = request.query_params.get('sucursal', None)
-    if sucursal_id:
-        queryset = queryset.filter(sucursal_id=sucursal_id)
-    
-    # Filtro por paciente
-    paciente_id = request.query_params.get('paciente', None)
-    if paciente_id:
-        queryset = queryset.filter(paciente_id=paciente_id)
-    
-    # Filtro por tipo de lente
-    tipo_lente = request.query_params.get('tipo_lente', None)
-    if tipo_lente:
-        queryset = queryset.filter(tipo_lente=tipo_lente)
-    
-    # Filtro por remisión oftalmológica
-    remision = request.query_params.get('remision_oftalmologica', None)
-    if remision:
-        queryset = queryset.filter(remision_oftalmologica=remision.lower() == 'true')
-    
-    # Filtro por fecha de consulta
-    fecha_desde = request.query_params.get('fecha_desde', None)
-    fecha_hasta = request.query_params.get('fecha_hasta', None)
-    if fecha_desde:
-        queryset = queryset.filter(fecha_hora_consulta__gte=fecha_desde)
-    if fecha_hasta:
-        queryset = queryset.filter(fecha_hora_consulta__lte=fecha_hasta)
-    
-    # Filtro por próximos controles
-    proximos_controles = request.query_params.get('proximos_controles', None)
-    if proximos_controles:
-        from django.utils import timezone
-        from datetime import timedelta
-        fecha_limite = timezone.now().date() + timedelta(days=30)
-        queryset = queryset.filter(
-            proximo_control__lte=fecha_limite,
-            proximo_control__gte=timezone.now().date()
-        )
-    
-    # Paginación
-    page = request.query_params.get('page', 1)
-    page_size = request.query_params.get('page_size', 10)
-    
-    try:
-        page_size = int(page_size)
-        if page_size > 100:  # Límite máximo
-            page_size = 100
-    except ValueError:
-        page_size = 10
-    
-    paginator = Paginator(queryset, page_size)
+    # Selección de campos (?fields= / ?exclude=)
+    campos = campos_solicitados(request)
+    queryset = DiagnosticoListSerializer.optimizar_queryset(queryset, **campos)
+    queryset = anotar_recordatorio(queryset)
     
+    # Paginación (por página o por cursor)
     try:
-        diagnosticos = paginator.page(page)
-    except PageNotAnInteger:
-        diagnosticos = paginator.page(1)
-    except EmptyPage:
-        diagnosticos = paginator.page(paginator.num_pages)
+        diagnosticos, pagination = paginar(
+            queryset, request,
+            orden_defecto='-fecha_hora_consulta',
+            ordenes_permitidos=['-fecha_hora_consulta', 'fecha_hora_consulta']
+        )
+    except CursorInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = DiagnosticoListSerializer(diagnosticos, many=True)
+    serializer = DiagnosticoListSerializer(diagnosticos, many=True, **campos)
     
     return Response({
         'results': serializer.data,
-        'pagination': {
-            'current_page': diagnosticos.number,
-            'total_pages': paginator.num_pages,
-            'total_items': paginator.count,
-            'page_size': page_size,
-            'has_next': diagnosticos.has_next(),
-            'has_previous': diagnosticos.has_previous(),
-        }
+        'pagination': pagination
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exportar_diagnosticos(request):
+    """Exporta los diagnósticos filtrados en CSV o NDJSON, con los datos clínicos como columnas"""
+    queryset = filtrar_diagnosticos(Diagnostico.objects.filter(activo=True), request.query_params)
+    return respuesta_exportacion(request, queryset, COLUMNAS_DIAGNOSTICOS, 'diagnosticos', aplanar_clinicos=True)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cambios_diagnosticos(request):
+    """Diagnósticos creados, modificados o dados de baja desde el cursor (sincronización incremental)"""
+    return respuesta_cambios(request, anotar_recordatorio(Diagnostico.objects.all()), DiagnosticoSerializer)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_diagnostico(request):
@@ -554,11 +743,11 @@ def crear_diagnostico(request):
 @permission_classes([IsAuthenticated])
 def obtener_diagnostico(request, pk):
     """Obtiene un diagnóstico específico por ID"""
+    campos = campos_solicitados(request)
     try:
-        diagnostico = Diagnostico.objects.select_related(
-            'paciente', 'usuario_creacion', 'sucursal'
-        ).get(pk=pk, activo=True)
-        serializer = DiagnosticoSerializer(diagnostico)
+        queryset = DiagnosticoSerializer.optimizar_queryset(Diagnostico.objects.all(), **campos)
+        diagnostico = anotar_recordatorio(queryset).get(pk=pk, activo=True)
+        serializer = DiagnosticoSerializer(diagnostico, **campos)
         return Response(serializer.data)
     except Diagnostico.DoesNotExist:
         return Response({"error": "Diagnóstico no encontrado"}, status=status.HTTP_404_NOT_FOUND)
@@ -605,32 +794,110 @@ def diagnosticos_por_paciente(request, paciente_id):
     serializer = DiagnosticoResumenSerializer(queryset, many=True)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def progresion_rx_paciente(request, pk):
+    """Evolución de la prescripción de un paciente, con la diferencia contra la visita anterior"""
+    from .progresion import formatear_visita, progresion_refraccion
+    from .refraccion import CAMPOS_REFRACCION
+    
+    if not Paciente.objects.filter(id=pk, activo=True).exists():
+        return Response({"error": "Paciente no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    
+    campo = request.query_params.get('campo', 'rx_final')
+    ojo = request.query_params.get('ojo', None)
+    if campo not in CAMPOS_REFRACCION or ojo not in (None, 'OD', 'OI'):
+        return Response({"error": "Parámetros campo u ojo inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    filas = progresion_refraccion(campo, ojo, diagnostico__paciente_id=pk)
+    return Response({
+        'paciente': pk,
+        'campo': campo,
+        'visitas': [formatear_visita(fila) for fila in filas]
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def progresion_rx_cohorte(request):
+    """Progresión de la prescripción de una cohorte de pacientes (sucursal, edad, miopía)"""
+    from .progresion import (
+        LIMITE_DEFECTO, LIMITE_MAXIMO, fecha_nacimiento_para_edad, progresion_refraccion, resumen_cohorte
+    )
+    from .models import RefraccionDiagnostico
+    from .refraccion import CAMPOS_REFRACCION
+    
+    campo = request.query_params.get('campo', 'rx_final')
+    ojo = request.query_params.get('ojo', None)
+    if campo not in CAMPOS_REFRACCION or ojo not in (None, 'OD', 'OI'):
+        return Response({"error": "Parámetros campo u ojo inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        edad_min = request.query_params.get('edad_min', None)
+        edad_max = request.query_params.get('edad_max', None)
+        edad_min = int(edad_min) if edad_min else None
+        edad_max = int(edad_max) if edad_max else None
+        limite = min(int(request.query_params.get('limite', LIMITE_DEFECTO)), LIMITE_MAXIMO)
+        sucursal_id = request.query_params.get('sucursal', None)
+        sucursal_id = int(sucursal_id) if sucursal_id else None
+    except ValueError:
+        return Response(
+            {"error": "sucursal, edad_min, edad_max y limite deben ser números enteros"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Los filtros seleccionan pacientes, no visitas, para no alterar la visita anterior
+    pacientes = Paciente.objects.filter(activo=True)
+    if sucursal_id is not None:
+        pacientes = pacientes.filter(sucursal_id=sucursal_id)
+    if edad_min is not None:
+        pacientes = pacientes.filter(fecha_nacimiento__lte=fecha_nacimiento_para_edad(edad_min))
+    if edad_max is not None:
+        pacientes = pacientes.filter(fecha_nacimiento__gt=fecha_nacimiento_para_edad(edad_max + 1))
+    if request.query_params.get('miopia', '').lower() == 'true':
+        pacientes = pacientes.filter(id__in=RefraccionDiagnostico.objects.filter(
+            campo=campo, esfera__lt=0, diagnostico__activo=True
+        ).values('diagnostico__paciente_id'))
+    
+    filas = progresion_refraccion(campo, ojo, diagnostico__paciente__in=pacientes.values('id'))
+    return Response(dict(
+        {'campo': campo},
+        **resumen_cohorte(filas.iterator(chunk_size=2000), limite=max(limite, 0))
+    ))
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def recordatorios_pendientes(request):
     """Lista los pacientes que necesitan recordatorio para próximo control"""
+    from django.db.models import CharField, F, Value
+    from django.db.models.functions import Coalesce, NullIf
     from django.utils import timezone
     from datetime import timedelta
+    from .recordatorios import DIAS_ANTICIPACION
     
-    # Obtener diagnósticos que necesitan recordatorio (próximos 7 días)
-    fecha_limite = timezone.now().date() + timedelta(days=7)
+    # Diagnósticos con control en los próximos días (?dias=, 7 por defecto), ordenados por fecha
+    try:
+        dias = max(0, int(request.query_params.get('dias', DIAS_ANTICIPACION)))
+    except ValueError:
+        return Response({"error": "El parámetro dias debe ser un número entero"}, status=status.HTTP_400_BAD_REQUEST)
+    hoy = timezone.localdate()
     
-    queryset = Diagnostico.objects.select_related('paciente').filter(
-        proximo_control__lte=fecha_limite,
-        proximo_control__gte=timezone.now().date(),
+    queryset = anotar_recordatorio(Diagnostico.objects.filter(
+        proximo_control__lte=hoy + timedelta(days=dias),
+        proximo_control__gte=hoy,
         recordatorio_enviado=False,
         activo=True
-    )
+    ), hoy)
     
-    recordatorios = []
-    for diagnostico in queryset:
-        recordatorios.append({
-            'diagnostico_id': diagnostico.id,
-            'paciente_nombre': diagnostico.paciente.nombre_completo,
-            'proximo_control': diagnostico.proximo_control,
-            'dias_restantes': diagnostico.dias_hasta_proximo_control,
-            'contacto_paciente': diagnostico.paciente.telefono or diagnostico.paciente.correo
-        })
+    # Las filas salen armadas de la consulta, sin instanciar modelos
+    recordatorios = queryset.order_by('proximo_control', 'id').values(
+        'proximo_control',
+        diagnostico_id=F('id'),
+        paciente_nombre=F('paciente__nombre_completo'),
+        dias_restantes=F('dias_hasta_proximo_control'),
+        contacto_paciente=Coalesce(
+            NullIf('paciente__telefono', Value('')), 'paciente__correo', output_field=CharField()
+        ),
+    )
     
     serializer = RecordatorioSerializer(recordatorios, many=True)
     return Response(serializer.data)
@@ -639,65 +906,75 @@ def recordatorios_pendientes(request):
 @permission_classes([IsAuthenticated])
 def marcar_recordatorio_enviado(request, pk):
     """Marca un recordatorio como enviado"""
-    try:
-        diagnostico = Diagnostico.objects.get(pk=pk, activo=True)
-        diagnostico.recordatorio_enviado = True
-        diagnostico.save()
-        return Response({"mensaje": "Recordatorio marcado como enviado"}, status=status.HTTP_200_OK)
-    except Diagnostico.DoesNotExist:
+    from .recordatorios import marcar_recordatorios_enviados
+    
+    _, resultados = marcar_recordatorios_enviados([pk])
+    if resultados[0]['resultado'] == 'no_encontrado':
         return Response({"error": "Diagnóstico no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"mensaje": "Recordatorio marcado como enviado"}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def marcar_recordatorios_enviados_masivo(request):
+    """Marca como enviados los recordatorios de varios diagnósticos (por ids o por filtro)"""
+    from .recordatorios import MAXIMO_CONFIRMACIONES, ids_por_filtro, marcar_recordatorios_enviados
+    
+    serializer = RecordatorioConfirmacionMasivaSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(format_error_response(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+    
+    hay_mas = False
+    ids = serializer.validated_data.get('ids')
+    if ids is None:
+        ids, hay_mas = ids_por_filtro(serializer.validated_data, MAXIMO_CONFIRMACIONES)
+    
+    marcados, resultados = marcar_recordatorios_enviados(ids)
+    return Response({
+        'marcados': marcados,
+        'no_marcados': len(resultados) - marcados,
+        # Con filtro se procesa un máximo por petición; repetir mientras hay_mas sea verdadero
+        'hay_mas': hay_mas,
+        'resultados': resultados
+    })
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def estadisticas_diagnosticos(request):
-    """Obtiene estadísticas de diagnósticos"""
-    from django.db.models import Count
-    from django.utils import timezone
-    from datetime import timedelta
+    """Obtiene estadísticas de diagnósticos (desde las tablas de estadísticas diarias)"""
+    from .estadisticas import resumen_estadisticas
+    from .recordatorios import DIAS_ANTICIPACION
     
-    # Estadísticas generales
-    total_diagnosticos = Diagnostico.objects.filter(activo=True).count()
-    diagnosticos_este_mes = Diagnostico.objects.filter(
-        activo=True,
-        creado_en__month=timezone.now().month,
-        creado_en__year=timezone.now().year
-    ).count()
-    
-    # Próximos controles (próximos 30 días)
-    fecha_limite = timezone.now().date() + timedelta(days=30)
-    proximos_controles = Diagnostico.objects.filter(
-        proximo_control__lte=fecha_limite,
-        proximo_control__gte=timezone.now().date(),
-        activo=True
-    ).count()
+    sucursal_id = request.query_params.get('sucursal', None)
+    if sucursal_id and not sucursal_id.isdigit():
+        return Response({"error": "El parámetro sucursal debe ser un número entero"}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Recordatorios pendientes
-    recordatorios_pendientes = Diagnostico.objects.filter(
-        proximo_control__lte=timezone.now().date() + timedelta(days=7),
-        proximo_control__gte=timezone.now().date(),
-        recordatorio_enviado=False,
-        activo=True
-    ).count()
+    return Response(resumen_estadisticas(sucursal_id, dias_recordatorio=DIAS_ANTICIPACION))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def reporte_agrupado(request, entidad):
+    """Conteos de citas o diagnósticos agrupados por dimensiones permitidas (?agrupar=sucursal,mes)"""
+    from .reportes import ParametroInvalido, parametros_reporte, reporte
+    
+    try:
+        parametros = parametros_reporte(entidad, request.query_params)
+    except ParametroInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Tipos de lentes más comunes
-    tipos_lentes = Diagnostico.objects.filter(activo=True).exclude(tipo_lente='').values('tipo_lente').annotate(
-        count=Count('tipo_lente')
-    ).order_by('-count')[:5]
+    return Response(reporte(parametros))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analitica_refraccion(request):
+    """Distribución (percentiles e histograma) de esfera, cilindro o adición por grupo"""
+    from .analitica import ParametroInvalido, distribucion_refraccion, parametros_analisis
     
-    # Remisiones oftalmológicas
-    remisiones_oftalmologicas = Diagnostico.objects.filter(
-        activo=True,
-        remision_oftalmologica=True
-    ).count()
+    try:
+        parametros = parametros_analisis(request.query_params)
+    except ParametroInvalido as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response({
-        'total_diagnosticos': total_diagnosticos,
-        'diagnosticos_este_mes': diagnosticos_este_mes,
-        'proximos_controles': proximos_controles,
-        'recordatorios_pendientes': recordatorios_pendientes,
-        'tipos_lentes_mas_comunes': tipos_lentes,
-        'remisiones_oftalmologicas': remisiones_oftalmologicas
-    })
+    return Response(distribucion_refraccion(parametros))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -734,6 +1011,8 @@ def estructura_datos_clinicos(request):
 @permission_classes([IsAuthenticated])
 def validar_estructura_datos_clinicos(request):
     """Valida una estructura de datos clínicos antes de crear el diagnóstico"""
+    from .esquema_clinico import campos_desconocidos, validar_datos_clinicos
+    
     datos_clinicos = request.data.get('datos_clinicos', {})
     
     if not isinstance(datos_clinicos, dict):
@@ -742,13 +1021,16 @@ def validar_estructura_datos_clinicos(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    campos_validos = Diagnostico.get_campos_clinicos_disponibles()
-    campos_invalidos = []
-    
-    for campo in datos_clinicos.keys():
-        if campo not in campos_validos:
-            campos_invalidos.append(campo)
+    # Los campos no reconocidos se reportan como advertencia; tipos y tamaños son errores
+    errores = validar_datos_clinicos(datos_clinicos, permitir_desconocidos=True)
+    if errores:
+        return Response(
+            {"error": format_error_response(errores)["error"], "errores": errores},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
+    campos_invalidos = campos_desconocidos(datos_clinicos)
+    campos_validos = Diagnostico.get_campos_clinicos_disponibles()
     if campos_invalidos:
         return Response({
             "warning": f"Los siguientes campos no son reconocidos: {', '.join(campos_invalidos)}",
@@ -762,4 +1044,69 @@ def validar_estructura_datos_clinicos(request):
         "estructura_recibida": datos_clinicos
     })
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def validar_diagnosticos_lote(request):
+    """Valida un lote de diagnósticos (clientes sin conexión) sin guardarlos"""
+    from users.models import Sucursal
+    
+    MAXIMO_LOTE = 500
+    diagnosticos = request.data.get('diagnosticos', None)
+    if not isinstance(diagnosticos, list) or not diagnosticos:
+        return Response(
+            {"error": "Se requiere una lista de diagnósticos en el campo 'diagnosticos'"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(diagnosticos) > MAXIMO_LOTE:
+        return Response(
+            {"error": f"El lote no puede tener más de {MAXIMO_LOTE} diagnósticos"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Una consulta por tipo de referencia para todo el lote; el serializer resuelve contra estos diccionarios
+    def ids_referencia(campo):
+        ids = set()
+        for diagnostico in diagnosticos:
+            if isinstance(diagnostico, dict) and not isinstance(diagnostico.get(campo), bool):
+                try:
+                    ids.add(int(diagnostico.get(campo)))
+                except (TypeError, ValueError):
+                    pass
+        return ids
+    
+    precargados = {
+        'paciente': Paciente.objects.in_bulk(ids_referencia('paciente')),
+        'sucursal': Sucursal.objects.in_bulk(ids_referencia('sucursal')),
+    }
+    
+    resultados = []
+    for indice, diagnostico in enumerate(diagnosticos):
+        if not isinstance(diagnostico, dict):
+            resultados.append({'indice': indice, 'valido': False, 'errores': {'diagnostico': ['Error: Debe ser un objeto JSON']}})
+            continue
+        
+        # Las mismas reglas que crear_diagnostico
+        serializer = DiagnosticoCreateSerializer(
+            data=diagnostico, context={'request': request, 'precargados': precargados}
+        )
+        errores = {}
+        if not serializer.is_valid():
+            errores = dict(serializer.errors)
+            # Los errores del esquema clínico se reportan por campo, igual que validar-estructura
+            if isinstance(errores.get('datos_clinicos'), dict):
+                errores.update(errores.pop('datos_clinicos'))
+        
+        resultado = {'indice': indice, 'valido': not errores}
+        if errores:
+            resultado['errores'] = errores
+        resultados.append(resultado)
+    
+    validos = sum(1 for r in resultados if r['valido'])
+    return Response({
+        'total': len(resultados),
+        'validos': validos,
+        'invalidos': len(resultados) - validos,
+        'resultados': resultados
+    })
+
 # Create your views here.
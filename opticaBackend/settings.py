@@ -112,6 +112,37 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Citas médicas: máximo de citas simultáneas por sucursal (vacío = sin límite)
+CITAS_SIMULTANEAS_POR_SUCURSAL = env.int('CITAS_SIMULTANEAS_POR_SUCURSAL', default=None)
+
+# Horario de atención usado para calcular la disponibilidad (días: 0 = lunes)
+HORARIO_ATENCION = {
+    'hora_inicio': env('HORARIO_ATENCION_INICIO', default='09:00'),
+    'hora_fin': env('HORARIO_ATENCION_FIN', default='18:00'),
+    'dias': env.list('HORARIO_ATENCION_DIAS', cast=int, default=[0, 1, 2, 3, 4, 5]),
+}
+
+# Broker de eventos de agenda (SSE); el local solo reparte dentro del mismo proceso ASGI
+AGENDA_BROKER = env('AGENDA_BROKER', default='core.eventos.BrokerLocal')
+
+# Caché de Django (p. ej. CACHE_URL=redis://redis:6379/1 o pymemcache://memcached:11211).
+# El LocMemCache por defecto es por proceso: con varios workers cada uno guarda sus propios
+# reportes y versiones por mes, y una escritura solo invalida los reportes de su proceso.
+CACHES = {'default': env.cache_url('CACHE_URL', default='locmemcache://')}
+
+# Tiempo que se conservan en caché los resultados de analítica (segundos)
+ANALITICA_CACHE_SEGUNDOS = env.int('ANALITICA_CACHE_SEGUNDOS', default=600)
+
+# Tiempo que se conservan en caché los reportes agrupados (se invalidan antes si cambian sus meses)
+REPORTES_CACHE_SEGUNDOS = env.int('REPORTES_CACHE_SEGUNDOS', default=300)
+
+# Envío de recordatorios de próximo control (ver core/recordatorios.py)
+RECORDATORIOS_BACKEND = env('RECORDATORIOS_BACKEND', default='core.recordatorios.BackendCorreo')
+RECORDATORIOS_ARCHIVO = env('RECORDATORIOS_ARCHIVO', default=os.path.join(BASE_DIR, 'recordatorios_enviados.jsonl'))
+EMAIL_HOST = env('EMAIL_HOST', default='localhost')
+EMAIL_PORT = env.int('EMAIL_PORT', default=25)
+DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='recordatorios@localhost')
+
 # Custom user model
 AUTH_USER_MODEL = 'users.Usuario'
 
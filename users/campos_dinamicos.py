@@ -0,0 +1,95 @@
+from django.core.exceptions import FieldDoesNotExist
+
+
+def _lista_campos(valor):
+    if not valor:
+        return None
+    return [campo.strip() for campo in valor.split(',') if campo.strip()]
+
+
+def campos_solicitados(request):
+    """Lee ?fields=a,b y ?exclude=c de la petición para pasarlos al serializer"""
+    return {
+        'campos': _lista_campos(request.query_params.get('fields')),
+        'excluir': _lista_campos(request.query_params.get('exclude')),
+    }
+
+
+class CamposDinamicosMixin:
+    """
+    Permite seleccionar los campos de un ModelSerializer con `campos` / `excluir`.
+
+    Además de podar la salida, `optimizar_queryset` deduce de los campos restantes
+    qué columnas y relaciones hacen falta, de modo que el SQL también se reduce
+    (only() y select_related/prefetch_related solo de lo que se va a serializar).
+    Los campos calculados (propiedades del modelo) declaran sus columnas en
+    `Meta.campos_dependientes`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        campos = kwargs.pop('campos', None)
+        excluir = kwargs.pop('excluir', None)
+        super().__init__(*args, **kwargs)
+
+        if campos is not None:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+        if excluir:
+            for nombre in excluir:
+                self.fields.pop(nombre, None)
+
+    def _requerimientos(self):
+        """Retorna (columnas, relaciones select_related, relaciones prefetch); columnas es None si no se pueden deducir"""
+        model = self.Meta.model
+        dependencias = getattr(self.Meta, 'campos_dependientes', {})
+        columnas = {model._meta.pk.name}
+        relaciones = set()
+        prefetch = set()
+
+        for nombre, field in self.fields.items():
+            if field.write_only:
+                continue
+            if nombre in dependencias:
+                columnas.update(dependencias[nombre])
+                continue
+
+            source = field.source
+            if source == '*':
+                columnas = None
+                continue
+
+            partes = source.split('.')
+            if source.startswith('get_') and source.endswith('_display'):
+                partes = [source[len('get_'):-len('_display')]]
+
+            try:
+                campo_modelo = model._meta.get_field(partes[0])
+            except FieldDoesNotExist:
+                # Propiedad del modelo sin dependencias declaradas: no se poda el SELECT
+                columnas = None
+                continue
+
+            if campo_modelo.many_to_many or campo_modelo.one_to_many:
+                prefetch.add(partes[0])
+            elif len(partes) > 1 and campo_modelo.is_relation:
+                relaciones.add(partes[0])
+                if columnas is not None:
+                    columnas.update([partes[0], '__'.join(partes)])
+            elif columnas is not None:
+                columnas.add(partes[0])
+
+        return columnas, relaciones, prefetch
+
+    @classmethod
+    def optimizar_queryset(cls, queryset, campos=None, excluir=None):
+        """Ajusta el queryset a los campos que realmente se serializarán"""
+        columnas, relaciones, prefetch = cls(campos=campos, excluir=excluir)._requerimientos()
+
+        queryset = queryset.select_related(None)
+        if relaciones:
+            queryset = queryset.select_related(*relaciones)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if columnas is not None and (campos is not None or excluir):
+            queryset = queryset.only(*columnas)
+        return queryset
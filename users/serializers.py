@@ -1,11 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Permiso, Rol, Sucursal
+from .campos_dinamicos import CamposDinamicosMixin
 from django.core.validators import RegexValidator
 
 Usuario = get_user_model()
 
-class PermisoSerializer(serializers.ModelSerializer):
+class PermisoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Permiso
         fields = ['id', 'nombre', 'codigo', 'descripcion', 'activo', 'creado_en', 'actualizado_en']
@@ -40,7 +41,7 @@ class PermisoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Error: Ya existe un registro con este nombre")
         return value
 
-class RolSerializer(serializers.ModelSerializer):
+class RolSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     permisos = PermisoSerializer(many=True, read_only=True)
     permisos_ids = serializers.PrimaryKeyRelatedField(
         queryset=Permiso.objects.all(),
@@ -82,7 +83,7 @@ class RolSerializer(serializers.ModelSerializer):
             instance.permisos.set(permisos)
         return instance
 
-class SucursalSerializer(serializers.ModelSerializer):
+class SucursalSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     responsable_nombre = serializers.CharField(source='responsable.nombre_completo', read_only=True)
     
     class Meta:
@@ -121,7 +122,7 @@ class SucursalCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Error: Ya existe un registro con este nombre")
         return value
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     rol_nombre = serializers.CharField(source='rol.nombre', read_only=True)
     sucursal_nombre = serializers.CharField(source='sucursal.nombre', read_only=True)
     
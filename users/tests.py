@@ -147,3 +147,25 @@ class PermisoTests(TestCase):
             nombre='Permiso de Prueba'
         )
         self.assertEqual(permiso.codigo, 'permiso_de_prueba')
+
+class CamposDinamicosTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.usuario = Usuario.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            email='test@example.com',
+            nombre_completo='Usuario de Prueba'
+        )
+        response = self.client.post('/api/users/token/', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        })
+        self.token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_listar_usuarios_con_fields(self):
+        """Test para seleccionar campos del listado de usuarios"""
+        response = self.client.get('/api/users/usuarios/', {'fields': 'id,username'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['usuarios'][0]), {'id', 'username'})
@@ -6,6 +6,7 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from .models import Permiso, Rol, Sucursal
+from .campos_dinamicos import campos_solicitados
 from .serializers import (
     PermisoSerializer,
     RolSerializer,
@@ -42,7 +43,8 @@ def listar_permisos(request):
             Q(nombre__icontains=search) |
             Q(codigo__icontains=search)
         )
-    serializer = PermisoSerializer(queryset, many=True)
+    campos = campos_solicitados(request)
+    serializer = PermisoSerializer(PermisoSerializer.optimizar_queryset(queryset, **campos), many=True, **campos)
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -58,8 +60,9 @@ def crear_permiso(request):
 @permission_classes([IsAuthenticated])
 def obtener_permiso(request, pk):
     try:
-        permiso = Permiso.objects.get(pk=pk)
-        serializer = PermisoSerializer(permiso)
+        campos = campos_solicitados(request)
+        permiso = PermisoSerializer.optimizar_queryset(Permiso.objects.all(), **campos).get(pk=pk)
+        serializer = PermisoSerializer(permiso, **campos)
         return Response(serializer.data)
     except Permiso.DoesNotExist:
         return Response({"error": "Permiso no encontrado"}, status=status.HTTP_404_NOT_FOUND)
@@ -96,7 +99,8 @@ def listar_roles(request):
     search = request.query_params.get('search', None)
     if search:
         queryset = queryset.filter(nombre__icontains=search)
-    serializer = RolSerializer(queryset, many=True)
+    campos = campos_solicitados(request)
+    serializer = RolSerializer(RolSerializer.optimizar_queryset(queryset, **campos), many=True, **campos)
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -112,8 +116,9 @@ def crear_rol(request):
 @permission_classes([IsAuthenticated])
 def obtener_rol(request, pk):
     try:
-        rol = Rol.objects.get(pk=pk)
-        serializer = RolSerializer(rol)
+        campos = campos_solicitados(request)
+        rol = RolSerializer.optimizar_queryset(Rol.objects.all(), **campos).get(pk=pk)
+        serializer = RolSerializer(rol, **campos)
         return Response(serializer.data)
     except Rol.DoesNotExist:
         return Response({"error": "Rol no encontrado"}, status=status.HTTP_404_NOT_FOUND)
@@ -188,7 +193,8 @@ def listar_sucursales(request):
             Q(nombre__icontains=search) |
             Q(direccion__icontains=search)
         )
-    serializer = SucursalSerializer(queryset, many=True)
+    campos = campos_solicitados(request)
+    serializer = SucursalSerializer(SucursalSerializer.optimizar_queryset(queryset, **campos), many=True, **campos)
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -204,8 +210,9 @@ def crear_sucursal(request):
 @permission_classes([IsAuthenticated])
 def obtener_sucursal(request, pk):
     try:
-        sucursal = Sucursal.objects.get(pk=pk)
-        serializer = SucursalSerializer(sucursal)
+        campos = campos_solicitados(request)
+        sucursal = SucursalSerializer.optimizar_queryset(Sucursal.objects.all(), **campos).get(pk=pk)
+        serializer = SucursalSerializer(sucursal, **campos)
         return Response(serializer.data)
     except Sucursal.DoesNotExist:
         return Response({"error": "Sucursal no encontrada"}, status=status.HTTP_404_NOT_FOUND)
@@ -266,7 +273,8 @@ def listar_usuarios(request):
     sucursales = Sucursal.objects.all()
     
     # Serializar usuarios, roles y sucursales
-    usuarios_serializer = UsuarioSerializer(queryset, many=True)
+    campos = campos_solicitados(request)
+    usuarios_serializer = UsuarioSerializer(UsuarioSerializer.optimizar_queryset(queryset, **campos), many=True, **campos)
     roles_serializer = RolSerializer(roles, many=True)
     sucursales_serializer = SucursalSerializer(sucursales, many=True)
     
@@ -289,8 +297,9 @@ def crear_usuario(request):
 @permission_classes([IsAuthenticated])
 def obtener_usuario(request, pk):
     try:
-        usuario = Usuario.objects.get(pk=pk)
-        serializer = UsuarioSerializer(usuario)
+        campos = campos_solicitados(request)
+        usuario = UsuarioSerializer.optimizar_queryset(Usuario.objects.all(), **campos).get(pk=pk)
+        serializer = UsuarioSerializer(usuario, **campos)
         return Response(serializer.data)
     except Usuario.DoesNotExist:
         return Response({"error": "Usuario no encontrado"}, status=status.HTTP_404_NOT_FOUND)